@@ -0,0 +1,56 @@
+"""
+Engine for running probes concurrently
+
+Probes are blocking callables (usually checker calls) executed on a bounded
+thread pool. At most `limit` probes are in flight, their requests are paced
+by core.scheduler like any other. Results are yielded in submission order,
+so callers still see them in confidence order.
+
+Parameters are already scanned by core.config.threadCount threads, each
+with its own pool, so up to threadCount * limit requests may be in flight.
+"""
+import collections
+import concurrent.futures
+
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def ordered(jobs, limit):
+    """
+    Run jobs concurrently and yield their results in submission order
+
+    Jobs are pulled lazily, so closing the generator early (e.g. once a
+    payload works) cancels everything that has not started yet.
+
+    Args:
+        jobs: iterable of callables
+        limit: maximum number of jobs in flight
+
+    Yields:
+        return value of each callable, in the order the jobs were given
+    """
+    limit = max(1, limit)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=limit)
+    pending = collections.deque()
+    jobs = iter(jobs)
+
+    def fill():
+        while len(pending) < limit:
+            try:
+                job = next(jobs)
+            except StopIteration:
+                return
+            pending.append(executor.submit(job))
+
+    try:
+        fill()
+        while pending:
+            result = pending.popleft().result()
+            yield result
+            fill()
+    finally:
+        cancelled = sum(1 for future in pending if future.cancel())
+        executor.shutdown(wait=False)
+        logger.debug('Async engine stopped, %i queued probes cancelled' % cancelled)
@@ -1,10 +1,10 @@
 import copy
-from fuzzywuzzy import fuzz
 import re
 from urllib.parse import unquote
 
 from core.config import xsschecker
 from core.requester import requester
+from core.scorer import ratio
 from core.utils import replaceValue, fillHoles
 
 
@@ -12,8 +12,11 @@ def checker(url, params, headers, method, delay, payload, positions, timeout, en
     checkString = 'st4r7s' + payload + '3nd'
     if encoding:
         checkString = encoding(unquote(checkString))
+    # the furthest checker looks past a reflection is its snippet
+    expect = None if encoding else ('st4r7s', len(positions), len(checkString) + 50)
     response = requester(url, replaceValue(
-        params, xsschecker, checkString, copy.deepcopy), headers, method, delay, timeout).text.lower()
+        params, xsschecker, checkString, copy.deepcopy), headers, method, delay, timeout,
+        expect).text.lower()
     reflectedPositions = []
     for match in re.finditer('st4r7s', response):
         reflectedPositions.append(match.start())
@@ -22,16 +25,19 @@ def checker(url, params, headers, method, delay, payload, positions, timeout, en
     num = 0
     efficiencies = []
     reflected_snippets = []
+    snippet_offsets = []  # where the reflection of the probe starts in its snippet
     for position in filledPositions:
         allEfficiencies = []
         snippet = ""
+        offset = None
         try:
             start = max(0, reflectedPositions[num] - 50)
             end = min(len(response), reflectedPositions[num] + len(checkString) + 50)
             reflected = response[reflectedPositions[num]
                 :reflectedPositions[num]+len(checkString)]
             snippet = response[start:end]
-            efficiency = fuzz.partial_ratio(reflected, checkString.lower())
+            offset = reflectedPositions[num] - start
+            efficiency = ratio(reflected, checkString.lower())
             allEfficiencies.append(efficiency)
         except IndexError:
             pass
@@ -41,16 +47,19 @@ def checker(url, params, headers, method, delay, payload, positions, timeout, en
             reflected = response[position:position+len(checkString)]
             if not snippet:
                 snippet = response[start:end]
+                offset = position - start
             if encoding:
                 checkString = encoding(checkString.lower())
-            efficiency = fuzz.partial_ratio(reflected, checkString)
+            efficiency = ratio(reflected, checkString)
             if reflected[:-2] == ('\\%s' % checkString.replace('st4r7s', '').replace('3nd', '')):
                 efficiency = 90
             allEfficiencies.append(efficiency)
             efficiencies.append(max(allEfficiencies))
             reflected_snippets.append(snippet)
+            snippet_offsets.append(offset)
         else:
             efficiencies.append(0)
             reflected_snippets.append("")
+            snippet_offsets.append(None)
         num += 1
-    return efficiencies, reflected_snippets
+    return efficiencies, reflected_snippets, snippet_offsets
@@ -9,19 +9,69 @@ xsschecker = 'v3dm0s'  # A non malicious string to check for reflections and stu
 proxies = {'http': 'http://0.0.0.0:8080', 'https': 'http://0.0.0.0:8080'}
 
 minEfficiency = 90  # payloads below this efficiency will not be displayed
+scorer = 'native'  # reflection scorer backend: native, rapidfuzz (scores differently) or fuzzywuzzy
+batchProbes = True  # probe all filter environments of a parameter with one marker-delimited request
 
-delay = 0  # default delay between http requests
+delay = 0  # min seconds between http requests to a host, across all threads
 threadCount = 3  # default number of threads
 timeout = 10  # default number of http request timeout
 
+# Connection pooling configuration
+poolSize = 10  # maximum number of connections kept alive per host
+keepAlive = True  # reuse connections between requests instead of closing them
+retries = 2  # retries on connection failures (http error responses are never retried)
+retryBackoff = 0.3  # backoff factor between retries, in seconds
+maxResponseSize = 10240  # KB of a body read at most when looking for reflections, 0 for no limit
+
+# Async scan engine configuration
+asyncScan = False  # test payloads concurrently instead of one after another
+asyncLimit = 10  # maximum number of payload probes in flight per parameter, parameters run threadCount at a time
+
+# Request scheduler configuration
+rate = 0  # maximum requests per second and host, 0 for no limit
+globalRate = 0  # maximum requests per second over all hosts, 0 for no limit
+
+# Crawler configuration
+maxPages = 0  # stop crawling after this many pages, 0 for no limit
+hostConcurrency = 0  # max pages of the same host crawled at once, 0 for the thread count
+patternLimit = 5  # max urls crawled per path and set of parameter names, 0 for no limit
+dedupeDistance = 3  # SimHash bits two pages may differ by to be near duplicates, -1 to disable
+domLimit = 4000000  # characters of the scripts of a page analysed for DOM XSS, 0 for no limit
+domCacheSize = 512  # DOM analyses of scripts kept by content hash, 0 to analyse every page from scratch
+retireWorkers = 4  # scripts of crawled pages fetched at once to check for vulnerable components
+
+# Response cache configuration
+cache = False  # answer identical requests from memory
+cacheTtl = 300  # seconds a cached response stays valid
+cacheSize = 64  # memory budget of the cache, in MB
+cacheUnsafe = False  # also cache POST and other non-idempotent requests
+
+# Response store configuration
+record = None  # directory to record every response to
+replay = None  # directory to answer requests from instead of the network
+payloadSeed = False  # derive payload casing from the payload instead of picking it at random
+
+# Payload plan cache configuration
+planCache = None  # json file the payload plans are kept in between scans
+planCacheSize = 256  # payload plans kept by reflection signature, 0 to plan every reflection from scratch
+
+# Adaptive payload ordering configuration
+payloadStats = None  # json file the success rates of vector families are kept in between scans
+pruneAfter = 0  # skip vector families that failed this many times against the same WAF and context, 0 to never skip
+
 # JS rendering configuration
 jsRender = False  # whether to use JavaScript rendering (requires Playwright)
 jsRenderWait = 10  # maximum seconds to wait for page load (continues when page ready or timeout)
 browserHeadless = True  # run browser in headless mode
+jsRenderPages = 4  # pages rendering at once, each in its own browser context
+jsExecWait = 3  # maximum seconds a payload is given to execute when confirming it in the browser
+jsRenderTypes = ('document', 'script', 'xhr', 'fetch')  # resource types fetched while rendering, '*' for all
+jsRenderHosts = ()  # hosts besides the rendered one subresources are fetched from, '*' for any
 
 # Stored XSS verification configuration
 verifyUrl = None  # URL to verify stored XSS payloads
 verifyMethod = 'GET'  # HTTP method for verification URL
+storedBatch = 1  # stored payloads injected before each verification, the page has to keep all of them
 
 # Cookie configuration
 cookie = None  # Cookie string to include in requests (e.g., "session=abc123; user_id=456")
@@ -161,7 +211,7 @@ headers = {  # default headers
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
     'Accept-Language': 'en-US,en;q=0.5',
     'Accept-Encoding': 'gzip,deflate',
-    'Connection': 'close',
+    'Connection': 'keep-alive',
     'DNT': '1',
     'Upgrade-Insecure-Requests': '1',
 }
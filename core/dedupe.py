@@ -0,0 +1,90 @@
+"""
+Url canonicalisation and near-duplicate page detection for the crawler
+
+canonicalUrl() maps equivalent links (/a, /a/, reordered parameters...) to
+one url and urlPattern() reduces a url to its path and parameter names, so
+the crawler can visit each pattern a limited number of times.
+
+Pages are fingerprinted with a 64 bit SimHash of their token shingles.
+Templated pages differ in a few bits only, SimhashIndex finds them without
+comparing against every page seen so far: split into distance + 1 bands,
+two fingerprints within the distance share at least one band exactly.
+"""
+import hashlib
+import posixpath
+import re
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+defaultPorts = {'http': 80, 'https': 443}
+tokenPattern = re.compile(r'\w+')
+minShingles = 32  # smaller pages are cheap to analyse and too small to fingerprint reliably
+
+
+def canonicalUrl(url):
+    """Normalise a url: lowercase scheme and host, no default port, fragment,
+    dot segments or trailing slash and parameters sorted by name"""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    try:
+        if parts.port == defaultPorts.get(scheme):
+            netloc = netloc.rsplit(':', 1)[0]
+    except ValueError:  # invalid port, leave it as it is
+        pass
+    path = parts.path or '/'
+    if '/.' in path or '//' in path:
+        path = posixpath.normpath(path) + ('/' if path.endswith('/') else '')
+        path = '/' + path.lstrip('/')
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def urlPattern(url):
+    """Reduce a canonical url to its path and the set of its parameter names"""
+    parts = urlsplit(url)
+    names = sorted(set(name for name, _ in parse_qsl(parts.query, keep_blank_values=True)))
+    return parts.scheme + '://' + parts.netloc + parts.path + '?' + '&'.join(names)
+
+
+def simhash(text, bits=64):
+    """SimHash of the 3-token shingles of a page, None if the page is too small"""
+    tokens = tokenPattern.findall(text.lower())
+    shingles = set(zip(tokens, tokens[1:], tokens[2:]))
+    if len(shingles) < minShingles:
+        return None
+    hashes = [format(int.from_bytes(hashlib.blake2b(
+        ' '.join(shingle).encode('utf-8'), digest_size=bits // 8).digest(), 'big'), '0%ib' % bits)
+        for shingle in shingles]
+    half = len(hashes) / 2
+    fingerprint = 0
+    for column in zip(*hashes):  # most significant bit first
+        fingerprint = (fingerprint << 1) | (column.count('1') > half)
+    return fingerprint
+
+
+class SimhashIndex:
+    """Thread-safe set of fingerprints answering "is there one within distance bits?" """
+
+    def __init__(self, distance=3, bits=64):
+        self.distance = distance
+        bands = distance + 1
+        self.width = bits // bands
+        self.shifts = [i * self.width for i in range(bands)]
+        self.masks = [(1 << self.width) - 1] * (bands - 1) + [(1 << (bits - self.shifts[-1])) - 1]
+        self.tables = [{} for _ in range(bands)]
+        self.lock = threading.Lock()
+
+    def add(self, fingerprint):
+        """Add a fingerprint, returns True if a near duplicate was already there"""
+        keys = [(fingerprint >> shift) & mask for shift, mask in zip(self.shifts, self.masks)]
+        with self.lock:
+            for table, key in zip(self.tables, keys):
+                for other in table.get(key, ()):
+                    if bin(other ^ fingerprint).count('1') <= self.distance:
+                        return True
+            for table, key in zip(self.tables, keys):
+                table.setdefault(key, []).append(fingerprint)
+        return False
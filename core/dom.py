@@ -1,59 +1,160 @@
+import hashlib
 import re
+import threading
+from collections import OrderedDict
 
+import core.config
 from core.colors import end, red, yellow
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
 
 if len(end) < 1:
     end = red = yellow = '*'
 
+sources = re.compile(r'''\b(?:document\.(URL|documentURI|URLUnencoded|baseURI|cookie|referrer)|location\.(href|search|hash|pathname)|window\.name|history\.(pushState|replaceState)(local|session)Storage)\b''')
+# members like x.innerHTML are only looked for in lines having them, they are the costly part
+memberSinks = ('.onEventName', '.innerHTML')
+sinks = re.compile(r'''\b(?:eval|evaluate|execCommand|assign|navigate|getResponseHeaderopen|showModalDialog|Function|set(Timeout|Interval|Immediate)|execScript|crypto.generateCRMFRequest|ScriptElement\.(src|text|textContent|innerText)|document\.(write|writeln)|Range\.createContextualFragment|(document|window)\.location)\b''')
+allSinks = re.compile(r'[\w$.]*(?:%s)\b|%s' % ('|'.join(re.escape(member) for member in memberSinks), sinks.pattern))
+scriptPattern = re.compile(r'(?i)(?s)<script[^>]*>(.*?)</script>')
+identifier = re.compile(r'[a-zA-Z$_][a-zA-Z0-9$_]+')
+token = re.compile(r'[\w$]+')
+
+def _declared(part):
+    match = identifier.search(part)
+    return match.group() if match else None
+
+
+def _analyse(script):
+    """
+    Highlight the sources, sinks and variables controlled by sources of a script
+
+    Variables assigned from a source, or from another controlled variable,
+    are kept in a set the words of every line are looked up in.
+
+    Returns:
+        tuple: (highlighted lines, whether a sink was found, whether a source was found)
+    """
+    highlighted = []
+    sinkFound, sourceFound = False, False
+    controlled = set()
+    for num, newLine in enumerate(script.split('\n'), 1):
+        line = newLine
+        parts = line.split('var ')
+        if len(parts) > 1 and controlled:
+            for part in parts:
+                if not controlled.isdisjoint(token.findall(part)):
+                    controlled.add(_declared(part))
+        found = set()
+        for grp in sources.finditer(newLine):
+            source = grp.group().replace(' ', '')
+            if source and source not in found:
+                found.add(source)
+                line = line.replace(source, yellow + source + end)
+        if found and len(parts) > 1:
+            for part in parts:
+                if any(source in part for source in found):
+                    controlled.add(_declared(part))
+        controlled.discard(None)
+        if controlled and not controlled.isdisjoint(token.findall(line)):
+            count = [0]
+
+            def mark(match):
+                if match.group() not in controlled:
+                    return match.group()
+                count[0] += 1
+                return yellow + match.group() + end
+            line = token.sub(mark, line)
+            if count[0]:
+                sourceFound = True
+        pattern = allSinks if any(member in newLine for member in memberSinks) else sinks
+        found = set()
+        for grp in pattern.finditer(newLine):
+            sink = grp.group().replace(' ', '')
+            if sink and sink not in found:
+                found.add(sink)
+                line = line.replace(sink, red + sink + end)
+                sinkFound = True
+        if line != newLine:
+            highlighted.append('%-3s %s' % (str(num), line.lstrip(' ')))
+    return highlighted, sinkFound, sourceFound
+
+
+def scriptKey(script):
+    return hashlib.sha1(script.encode('utf-8', 'replace')).hexdigest()
+
+
+class AnalysisCache:
+    """Thread-safe LRU of the _analyse() results of scripts, by the SHA-1 of their content"""
+
+    def __init__(self, size=512):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def analyse(self, script, key=None):
+        key = key or scriptKey(script)
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return result
+            self.stats['misses'] += 1
+        result = _analyse(script)
+        with self.lock:
+            self.entries[key] = result
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return result
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def getAnalysisCache():
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            _cache = AnalysisCache(core.config.domCacheSize)
+        return _cache
+
+
+def scripts(response):
+    """The inline scripts of a page, up to core.config.domLimit characters of them"""
+    found = []
+    budget = core.config.domLimit or float('inf')
+    for script in scriptPattern.findall(response):
+        if not script:  # <script src=...></script>
+            continue
+        if budget <= 0:
+            break
+        if len(script) > budget:
+            logger.debug('Analysing the first %i characters of scripts only' % core.config.domLimit)
+            script = script[:budget]
+        budget -= len(script)
+        found.append(script)
+    return found
+
+
+def analyseScript(script, key=None):
+    """Highlighted lines, sink and source found of a script, see _analyse(), analysed once per content"""
+    if not core.config.domCacheSize:
+        return _analyse(script)
+    return getAnalysisCache().analyse(script, key)
+
+
 def dom(response):
     highlighted = []
-    sources = r'''\b(?:document\.(URL|documentURI|URLUnencoded|baseURI|cookie|referrer)|location\.(href|search|hash|pathname)|window\.name|history\.(pushState|replaceState)(local|session)Storage)\b'''
-    sinks = r'''\b(?:eval|evaluate|execCommand|assign|navigate|getResponseHeaderopen|showModalDialog|Function|set(Timeout|Interval|Immediate)|execScript|crypto.generateCRMFRequest|ScriptElement\.(src|text|textContent|innerText)|.*?\.onEventName|document\.(write|writeln)|.*?\.innerHTML|Range\.createContextualFragment|(document|window)\.location)\b'''
-    scripts = re.findall(r'(?i)(?s)<script[^>]*>(.*?)</script>', response)
     sinkFound, sourceFound = False, False
-    for script in scripts:
-        script = script.split('\n')
-        num = 1
-        allControlledVariables = set()
-        try:
-            for newLine in script:
-                line = newLine
-                parts = line.split('var ')
-                controlledVariables = set()
-                if len(parts) > 1:
-                    for part in parts:
-                        for controlledVariable in allControlledVariables:
-                            if controlledVariable in part:
-                                controlledVariables.add(re.search(r'[a-zA-Z$_][a-zA-Z0-9$_]+', part).group().replace('$', '\\$'))
-                pattern = re.finditer(sources, newLine)
-                for grp in pattern:
-                    if grp:
-                        source = newLine[grp.start():grp.end()].replace(' ', '')
-                        if source:
-                            if len(parts) > 1:
-                               for part in parts:
-                                    if source in part:
-                                        controlledVariables.add(re.search(r'[a-zA-Z$_][a-zA-Z0-9$_]+', part).group().replace('$', '\\$'))
-                            line = line.replace(source, yellow + source + end)
-                for controlledVariable in controlledVariables:
-                    allControlledVariables.add(controlledVariable)
-                for controlledVariable in allControlledVariables:
-                    matches = list(filter(None, re.findall(r'\b%s\b' % controlledVariable, line)))
-                    if matches:
-                        sourceFound = True
-                        line = re.sub(r'\b%s\b' % controlledVariable, yellow + controlledVariable + end, line)
-                pattern = re.finditer(sinks, newLine)
-                for grp in pattern:
-                    if grp:
-                        sink = newLine[grp.start():grp.end()].replace(' ', '')
-                        if sink:
-                            line = line.replace(sink, red + sink + end)
-                            sinkFound = True
-                if line != newLine:
-                    highlighted.append('%-3s %s' % (str(num), line.lstrip(' ')))
-                num += 1
-        except MemoryError:
-            pass
+    for script in scripts(response):
+        lines, sink, source = analyseScript(script)
+        highlighted.extend(lines)
+        sinkFound = sinkFound or sink
+        sourceFound = sourceFound or source
     if sinkFound or sourceFound:
         return highlighted
     else:
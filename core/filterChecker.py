@@ -1,4 +1,15 @@
+import copy
+import re
+
+import core.config
 from core.checker import checker
+from core.config import xsschecker
+from core.log import setup_logger
+from core.requester import requester
+from core.scorer import ratio
+from core.utils import replaceValue
+
+logger = setup_logger(__name__)
 
 
 def filterChecker(url, params, headers, method, delay, occurences, timeout, encoding):
@@ -23,11 +34,66 @@ def filterChecker(url, params, headers, method, delay, occurences, timeout, enco
                     environments.add('&gt;')  # encoded versions of < and >
             if occurences[i]['details']['quote']:
                 environments.add(occurences[i]['details']['quote'])
+    environments = sorted(filter(None, environments))
+    if core.config.batchProbes and not encoding and len(environments) > 1:
+        scores = batchChecker(url, params, headers, method, delay, environments, len(occurences), timeout)
+        if scores:
+            for occurence, score in zip(occurences, scores):
+                occurences[occurence]['score'] = score
+            return occurences
+        logger.debug('Batch probe markers interfered, probing environments one by one')
     for environment in environments:
-        if environment:
-            efficiencies, _ = checker(
-                url, params, headers, method, delay, environment, positions, timeout, encoding)
-            efficiencies.extend([0] * (len(occurences) - len(efficiencies)))
-            for occurence, efficiency in zip(occurences, efficiencies):
-                occurences[occurence]['score'][environment] = efficiency
+        efficiencies, _, _ = checker(
+            url, params, headers, method, delay, environment, positions, timeout, encoding)
+        efficiencies.extend([0] * (len(occurences) - len(efficiencies)))
+        for occurence, efficiency in zip(occurences, efficiencies):
+            occurences[occurence]['score'][environment] = efficiency
     return occurences
+
+
+def marker(index, side):
+    # starting with a digit, '<' followed by a marker isn't parsed as a tag
+    return '0b4tch%i%s' % (index, side)
+
+
+def batchChecker(url, params, headers, method, delay, environments, count, timeout):
+    """
+    Probe all environments with a single request
+
+    Every environment is wrapped in its own marker pair and each one is scored
+    as if it had been sent alone by checker().
+
+    Returns:
+        list with an {environment: efficiency} dict per reflection, or None if
+        the reflections don't line up with the occurences or the markers interfered
+    """
+    payload = ''.join(marker(i, 'o') + environment + marker(i, 'c')
+                      for i, environment in enumerate(environments))
+    response = requester(url, replaceValue(
+        params, xsschecker, 'st4r7s' + payload + '3nd', copy.deepcopy),
+        headers, method, delay, timeout, ('st4r7s', count, len(payload) + 64)).text.lower()
+    starts = [match.start() for match in re.finditer('st4r7s', response)]
+    if len(starts) != count:
+        return None
+    scores = []
+    for start, stop in zip(starts, starts[1:] + [len(response)]):
+        reflection = response[start:stop]
+        score = {}
+        cursor = 0
+        for i, environment in enumerate(environments):
+            opener, closer = marker(i, 'o'), marker(i, 'c')
+            begin = reflection.find(opener, cursor)
+            finish = reflection.find(closer, begin + len(opener))
+            if begin == -1 or finish == -1:
+                return None
+            cursor = finish + len(closer)
+            checkString = 'st4r7s' + environment + '3nd'
+            # the window checker() would have looked at for this environment alone
+            reflected = ('st4r7s' + reflection[begin + len(opener):finish] + '3nd' +
+                         reflection[cursor:])[:len(checkString)]
+            efficiency = ratio(reflected, checkString.lower())
+            if reflected[:-2] == ('\\%s' % environment):
+                efficiency = 90
+            score[environment] = efficiency
+        scores.append(score)
+    return scores
@@ -0,0 +1,69 @@
+"""
+Online learning of what a parameter filters, from checker() snippets
+
+Every probe tells which parts of the payload made it back: special
+characters and words (tags, event handlers, functions...). A part that was
+sent several times and never came back in any reflection is considered
+filtered, and vectors that need it are skipped instead of being sent.
+"""
+import re
+import threading
+from urllib.parse import unquote
+
+specials = '<>()"\'`=/'
+wordPattern = re.compile(r'[a-z]{3,}')
+evidence = 2  # times a part has to go missing before it's considered filtered
+
+
+def features(payload):
+    """The special characters and words of a payload"""
+    text = unquote(payload).lower()
+    return set(char for char in text if char in specials) | set(wordPattern.findall(text))
+
+
+def reflection(snippet, offset):
+    """The payload part of the reflection starting at offset in a checker() snippet, None if it didn't come back whole"""
+    if offset is None or not snippet.startswith('st4r7s', offset):
+        return None
+    end = snippet.find('3nd', offset + 6)
+    if end == -1:
+        return None
+    return snippet[offset + 6:end]
+
+
+class FilterLearner:
+    def __init__(self):
+        self.missing = {}  # part: times it was sent and didn't come back
+        self.passed = set()  # parts seen in a reflection at least once
+        self.filtered = set()
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def learn(self, payload, snippets, offsets):
+        """Update what is filtered with the reflections of a probed payload, see checker()"""
+        reflections = [reflection(snippet, offset) for snippet, offset in zip(snippets, offsets)]
+        reflections = [text for text in reflections if text is not None]
+        if not reflections:  # blocked or cut short, it says nothing about single parts
+            return
+        with self.lock:
+            for part in features(payload):
+                if part in self.passed:
+                    continue
+                if any(part in text for text in reflections):
+                    self.passed.add(part)
+                    self.filtered.discard(part)
+                    continue
+                self.missing[part] = self.missing.get(part, 0) + 1
+                if self.missing[part] >= evidence:
+                    self.filtered.add(part)
+
+    def blocks(self, payload):
+        """The filtered part a payload needs, None if it is worth sending"""
+        with self.lock:
+            if not self.filtered:
+                return None
+            for part in features(payload):
+                if part in self.filtered:
+                    self.skipped += 1
+                    return part
+        return None
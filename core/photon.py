@@ -1,29 +1,74 @@
 import re
 import concurrent.futures
+import threading
+from collections import Counter, deque
 from urllib.parse import urlparse
 
-from core.dom import dom
+import core.config
+from core.dedupe import SimhashIndex, canonicalUrl, simhash, urlPattern
+from core.dom import analyseScript, scripts, scriptKey, getAnalysisCache
 from core.log import setup_logger
 from core.utils import getUrl, getParams
 from core.requester import requester
 from core.zetanize import zetanize
-from plugins.retireJs import retireJs
+from plugins.retireJs import RetireStage
 
 logger = setup_logger(__name__)
 
+maxListed = 10  # other pages listed for a script with DOM findings
+
 
 def photon(seedUrl, headers, level, threadCount, delay, timeout, skipDOM):
+    """
+    Crawl the target breadth first from a shared frontier
+
+    Every url carries its depth. Workers are fed as soon as one of them is
+    free rather than level by level, with at most core.config.hostConcurrency
+    pages of the same host in flight and core.config.maxPages pages overall.
+
+    Links are canonicalised and a path with a given set of parameter names is
+    crawled core.config.patternLimit times at most. Forms and DOM sinks of
+    pages that are near duplicates of a crawled page aren't analysed again.
+    Their external scripts are still checked for vulnerable components in
+    the background, each url once.
+
+    Inline scripts are analysed for DOM XSS once per content, whatever page
+    they are on. Findings are printed at the first page having them, the
+    other pages are listed once the crawl is over or interrupted.
+    """
     forms = []  # web forms
     processed = set()  # urls that have been crawled
     storage = set()  # urls that belong to the target i.e. in-scope
     schema = urlparse(seedUrl).scheme  # extract the scheme e.g. http or https
     host = urlparse(seedUrl).netloc  # extract the host e.g. example.com
     main_url = schema + '://' + host  # join scheme and host to make the root url
-    storage.add(seedUrl)  # add the url to storage
-    checkedDOMs = []
+    domFindings = {}  # sha1 of a script: (highlighted lines, pages having it)
+    frontier = {}  # host: deque of (url, depth) waiting to be crawled
+    active = Counter()  # pages being crawled per host
+    condition = threading.Condition()  # guards all of the above
+    hostLimit = core.config.hostConcurrency or threadCount
+    maxPages = core.config.maxPages
+    patterns = Counter()  # urls queued per path and parameter names
+    fingerprints = SimhashIndex(core.config.dedupeDistance) if core.config.dedupeDistance >= 0 else None
+    skipped = Counter()
+    retire = RetireStage()
 
-    def rec(target):
-        processed.add(target)
+    def enqueue(link, depth):
+        link = canonicalUrl(link)
+        with condition:
+            if link in storage:
+                return
+            storage.add(link)  # add the url to storage
+            pattern = urlPattern(link)
+            if core.config.patternLimit and patterns[pattern] >= core.config.patternLimit:
+                skipped['urls'] += 1
+                return
+            patterns[pattern] += 1
+            if depth < level:
+                frontier.setdefault(urlparse(link).netloc, deque()).append((link, depth))
+                condition.notify()
+
+    def rec(target, depth):
         printableTarget = '/'.join(target.split('/')[3:])
         if len(printableTarget) > 40:
             printableTarget = printableTarget[-40:]
@@ -32,24 +77,57 @@ def photon(seedUrl, headers, level, threadCount, delay, timeout, skipDOM):
         logger.run('Parsing %s\r' % printableTarget)
         url = getUrl(target, True)
         params = getParams(target, '', True)
+        response = requester(url, params, headers, 'GET', delay, timeout).text
+        fingerprint = simhash(response) if fingerprints else None
+        if fingerprint is not None and fingerprints.add(fingerprint):
+            # a templated page we have already seen, its links may still lead somewhere new
+            with condition:
+                skipped['pages'] += 1
+            retire.submit(url, response)  # it may load other libraries, each content is scanned once
+        else:
+            analyse(target, url, params, response)
+        extract(response, depth)
+
+    def analyse(target, url, params, response):
         if '=' in target:  # if there's a = in the url, there should be GET parameters
             inps = []
             for name, value in params.items():
                 inps.append({'name': name, 'value': value})
-            forms.append({0: {'action': url, 'method': 'get', 'inputs': inps}})
-        response = requester(url, params, headers, 'GET', delay, timeout).text
-        retireJs(url, response)
+            with condition:
+                forms.append({0: {'action': url, 'method': 'get', 'inputs': inps}})
+        retire.submit(url, response)
         if not skipDOM:
-            highlighted = dom(response)
-            clean_highlighted = ''.join([re.sub(r'^\d+\s+', '', line) for line in highlighted])
-            if highlighted and clean_highlighted not in checkedDOMs:
-                checkedDOMs.append(clean_highlighted)
-                logger.good('Potentially vulnerable objects found at %s' % url)
-                logger.red_line(level='good')
-                for line in highlighted:
-                    logger.no_format(line, level='good')
-                logger.red_line(level='good')
-        forms.append(zetanize(response))
+            for script in scripts(response):
+                key = scriptKey(script)
+                highlighted, sinkFound, sourceFound = analyseScript(script, key)
+                if highlighted and (sinkFound or sourceFound):
+                    with condition:
+                        pages = domFindings.setdefault(key, (highlighted, []))[1]
+                        pages.append(url)
+                        new = len(pages) == 1
+                    if new:
+                        logger.good('Potentially vulnerable objects found at %s' % url)
+                        logger.red_line(level='good')
+                        for line in highlighted:
+                            logger.no_format(line, level='good')
+                        logger.red_line(level='good')
+        pageForms = zetanize(response)
+        with condition:
+            forms.append(pageForms)
+
+    def reportDom():
+        """List the other pages having each script with DOM findings"""
+        with condition:
+            findings = [pages[:] for highlighted, pages in domFindings.values() if len(pages) > 1]
+        for pages in findings:
+            shown = pages[1:maxListed + 1]
+            logger.info('Script with DOM findings at %s is on %i other pages: %s%s' % (
+                pages[0], len(pages) - 1, ', '.join(shown),
+                ' and %i more' % (len(pages) - 1 - len(shown)) if len(pages) - 1 > len(shown) else ''))
+        if not skipDOM and core.config.domCacheSize:
+            logger.debug('DOM analyses of scripts: {}'.format(getAnalysisCache().stats))
+
+    def extract(response, depth):
         matches = re.findall(r'<[aA].*href=["\']{0,1}(.*?)["\']', response)
         for link in matches:  # iterate over the matches
             # remove everything after a "#" to deal with in-page anchors
@@ -59,24 +137,61 @@ def photon(seedUrl, headers, level, threadCount, delay, timeout, skipDOM):
             else:
                 if link[:4] == 'http':
                     if link.startswith(main_url):
-                        storage.add(link)
+                        enqueue(link, depth + 1)
                 elif link[:2] == '//':
                     if link.split('/')[2].startswith(host):
-                        storage.add(schema + link)
+                        enqueue(schema + link, depth + 1)
                 elif link[:1] == '/':
-                    storage.add(main_url + link)
+                    enqueue(main_url + link, depth + 1)
                 else:
-                    storage.add(main_url + '/' + link)
+                    enqueue(main_url + '/' + link, depth + 1)
+
+    def work(target, depth, netloc):
+        try:
+            rec(target, depth)
+        except Exception as e:
+            logger.debug('Crawling %s failed: %s' % (target, e))
+        finally:
+            with condition:
+                active[netloc] -= 1
+                condition.notify()
+
+    def nextJob():
+        """Pop a url whose host is below the concurrency cap, called with the condition held"""
+        for netloc, queue in frontier.items():
+            if queue and active[netloc] < hostLimit:
+                return netloc, queue.popleft()
+        return None
+
+    enqueue(seedUrl, 0)
+    threadpool = concurrent.futures.ThreadPoolExecutor(max_workers=threadCount)
     try:
-        for x in range(level):
-            urls = storage - processed  # urls to crawl = all urls - urls that have been crawled
-            # for url in urls:
-            #     rec(url)
-            threadpool = concurrent.futures.ThreadPoolExecutor(
-                max_workers=threadCount)
-            futures = (threadpool.submit(rec, url) for url in urls)
-            for i in concurrent.futures.as_completed(futures):
-                pass
+        with condition:
+            while True:
+                running = sum(active.values())
+                job = None
+                if running < threadCount and not (maxPages and len(processed) >= maxPages):
+                    job = nextJob()
+                if job:
+                    netloc, (target, depth) = job
+                    processed.add(target)
+                    active[netloc] += 1
+                    threadpool.submit(work, target, depth, netloc)
+                elif not running:
+                    break
+                else:
+                    condition.wait()
+        reportDom()
+        if maxPages and len(processed) >= maxPages and any(frontier.values()):
+            logger.info('Crawled the maximum of %i pages' % maxPages)
+        if skipped:
+            logger.info('Skipped %i urls repeating a pattern and %i near duplicate pages' % (
+                skipped['urls'], skipped['pages']))
     except KeyboardInterrupt:
+        threadpool.shutdown(wait=False, cancel_futures=True)
+        retire.finish(cancel=True)
+        reportDom()
         return [forms, processed]
+    threadpool.shutdown()
+    retire.finish()
     return [forms, processed]
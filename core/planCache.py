@@ -0,0 +1,126 @@
+"""
+Memoized payload plans, keyed by the signature of a reflection
+
+The vectors planned for a reflection only depend on its context, tag,
+attribute, quote, filter scores and a few details derived from them. On a
+large crawl the same handful of signatures come back over and over, so the
+families planned for a signature are kept and reused.
+
+A family's vectors are kept too once it has been iterated to the end, the
+next reflection with that signature gets them without building anything.
+The least recently used plans are dropped past core.config.planCacheSize.
+Plans can be saved to a json file with all their vectors and loaded by
+later scans.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
+
+version = 1
+
+
+def _vectors(family):
+    """The vectors of a family that has already been built, None otherwise"""
+    build = family.build
+    if isinstance(build, partial) and build.func is iter and isinstance(build.args[0], tuple):
+        return build.args[0]
+    return None
+
+
+class PlanCache:
+    def __init__(self, path=None, size=256):
+        self.path = path
+        self.size = size
+        self.entries = OrderedDict()  # signature: list of families, least recently used first
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'loaded': 0, 'evicted': 0}
+        if path and os.path.isfile(path):
+            self.load()
+
+    def get(self, key):
+        """Get the families planned for a signature, None if it hasn't been planned yet"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return list(entry)
+
+    def put(self, key, families):
+        """Remember the families planned for a signature, returns them wrapped to keep their vectors"""
+        wrapped = [item if _vectors(item) is not None
+                   else item._replace(build=partial(self._build, key, position, item))
+                   for position, item in enumerate(families)]
+        with self.lock:
+            entry = self.entries.setdefault(key, wrapped)
+            self.entries.move_to_end(key)
+            self._evict()
+            return list(entry)
+
+    def _evict(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def _build(self, key, position, item):
+        vectors = []
+        for vector in item.build():
+            vectors.append(vector)
+            yield vector
+        # only reached when the family was exhausted, a partial list is never kept
+        vectors = tuple(vectors)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and position < len(entry):
+                entry[position] = item._replace(size=len(vectors), build=partial(iter, vectors))
+
+    def load(self):
+        from core.generator import Family
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring the plan cache %s: %s' % (self.path, e))
+            return
+        if data.get('version') != version:
+            return
+        for key, families in data.get('plans', {}).items():
+            self.entries[key] = [Family(confidence, context, name, len(vectors), partial(iter, tuple(vectors)))
+                                 for confidence, context, name, vectors in families]
+        while len(self.entries) > self.size:  # the file was written with a larger size
+            self.entries.popitem(last=False)
+        self.stats['loaded'] = len(self.entries)
+        logger.debug('Loaded %i payload plans from %s' % (len(self.entries), self.path))
+
+    def save(self):
+        """Write every plan with all of its vectors to the cache file"""
+        if not self.path:
+            return
+        with self.lock:
+            entries = list(self.entries.items())
+        plans = {}
+        for key, families in entries:
+            # scans stop at the first working vector, build what they didn't get to
+            plans[key] = [[item.confidence, item.context, item.name, list(_vectors(item) or item.build())]
+                          for item in families]
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump({'version': version, 'plans': plans}, file)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning('Could not save the plan cache to %s: %s' % (self.path, e))
+            return
+        logger.debug('Saved %i payload plans to %s' % (len(plans), self.path))
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats, plans=len(self.entries))
@@ -1,10 +1,18 @@
+import codecs
 import random
 import requests
+import threading
 import time
-from urllib3.exceptions import ProtocolError
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from urllib3.exceptions import MaxRetryError, ProtocolError
 import warnings
 
 import core.config
+from core.responseCache import ResponseCache, fingerprint
+from core.responseStore import ResponseStore
+from core.scheduler import getScheduler
 from core.utils import converter, getVar, unflattenJSON
 from core.log import setup_logger
 
@@ -29,20 +37,113 @@ def get_js_renderer():
     return _js_renderer if _js_renderer is not False else None
 
 
-def requester(url, data, headers, method, delay, timeout):
+_sessions = {}  # one pooled session per scheme://host
+_sessionsLock = threading.Lock()
+
+
+def getSession(url):
+    """
+    Get the shared keep-alive session for the host of a url
+
+    Sessions are created on first use and shared by every mode and thread,
+    so connections (and TLS handshakes) are reused across requests.
+    """
+    parsed = urlparse(url)
+    key = parsed.scheme + '://' + parsed.netloc
+    with _sessionsLock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # cookies are only sent when supplied explicitly, like plain requests.get
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            # retries are made by _request(), each one paced by the scheduler
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=core.config.poolSize,
+                                  max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+            logger.debug('Created session pool for {}'.format(key))
+    return session
+
+
+def closeSessions():
+    """Close all pooled sessions and their connections"""
+    with _sessionsLock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def getCache():
+    """Get the shared response cache, or None if caching is disabled"""
+    global _cache
+    if not core.config.cache:
+        return None
+    with _cacheLock:
+        if _cache is None:
+            _cache = ResponseCache(core.config.cacheTtl, core.config.cacheSize * 1024 * 1024,
+                                   core.config.cacheUnsafe)
+    return _cache
+
+
+_store = None
+_storeLock = threading.Lock()
+chunkSize = 16 * 1024
+
+
+def getStore():
+    """Get the response store used by --record/--replay, or None"""
+    global _store
+    directory = core.config.replay or core.config.record
+    if not directory:
+        return None
+    with _storeLock:
+        if _store is None:
+            _store = ResponseStore(directory, replaying=bool(core.config.replay))
+    return _store
+
+
+def closeStore():
+    """Close the response store and log what was recorded or replayed"""
+    if _store is None:
+        return
+    _store.close()
+    if _store.replaying:
+        logger.info('Replayed %i responses from %s, %i requests were not recorded' % (
+            _store.stats['replayed'], _store.directory, _store.stats['missing']))
+    else:
+        logger.info('Recorded %i responses to %s' % (_store.stats['recorded'], _store.directory))
+
+
+def cacheReport():
+    """Log the hit/miss statistics of the response cache"""
+    if _cache is None:
+        return
+    stats = _cache.summary()
+    logger.info('Response cache: %i hits, %i misses (%.1f%% hit rate), %i uncacheable, '
+                '%i evicted, %i invalidated, %i entries (%.1f MB)' % (
+                    stats['hits'], stats['misses'], stats['hitRate'], stats['uncacheable'],
+                    stats['evictions'], stats['invalidations'], stats['entries'],
+                    stats['bytes'] / 1024.0 / 1024.0))
+
+
+def requester(url, data, headers, method, delay, timeout, expect=None):
+    """
+    Send a request through the shared session of the host
+
+    expect=(marker, count, tail) lets a caller looking for reflections stop
+    reading the body once count markers and tail characters after the last
+    one have arrived. Only these responses are streamed and capped to
+    core.config.maxResponseSize KB, the others are read whole.
+    """
     if method is True:
         method = 'GET'
     elif method is False:
         method = 'POST'
-    if getVar('jsonData'):
-        # Unflatten the data back to nested JSON structure
-        data = unflattenJSON(data)
-        data = converter(data)
-    elif getVar('path'):
-        url = converter(data, url)
-        data = []
-        method = 'GET'
-    time.sleep(delay)
     user_agents = ['Mozilla/5.0 (X11; Linux i686; rv:60.0) Gecko/20100101 Firefox/60.0',
                    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.113 Safari/537.36',
                    'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/56.0.2924.87 Safari/537.36 OPR/43.0.2442.991']
@@ -50,11 +151,131 @@ def requester(url, data, headers, method, delay, timeout):
         headers['User-Agent'] = random.choice(user_agents)
     elif headers['User-Agent'] == '$':
         headers['User-Agent'] = random.choice(user_agents)
-    
+    if not core.config.keepAlive:
+        headers['Connection'] = 'close'
+
     # Add cookie to headers if specified
     if core.config.cookie and 'Cookie' not in headers:
         headers['Cookie'] = core.config.cookie
-    
+
+    cache, store = getCache(), getStore()
+    if not cache and not store:
+        return _request(url, data, headers, method, delay, timeout, expect)
+    key = fingerprint(method, url, data, headers, getVar('jsonData'), getVar('path'),
+                      core.config.jsRender)
+    if not cache:
+        return _fetch(key, url, data, headers, method, delay, timeout, expect)
+    if not cache.cacheable(method):
+        cache.skip()
+        response = _fetch(key, url, data, headers, method, delay, timeout, expect)
+        cache.invalidate(url)  # the request may have changed what the host serves
+        return response
+    response = cache.get(key)
+    if response is not None:
+        logger.debug('Requester cache hit: {}'.format(url))
+        return response
+    response = _fetch(key, url, data, headers, method, delay, timeout, expect)
+    if response is not None:
+        cache.put(key, url, response)
+    return response
+
+
+def _fetch(key, url, data, headers, method, delay, timeout, expect):
+    """Send a request, or answer it from the response store when replaying"""
+    store = getStore()
+    if store and store.replaying:
+        return store.replay(key, url)
+    response = _request(url, data, headers, method, delay, timeout, expect)
+    if store and response is not None and response.status_code is not None \
+            and not getattr(response, 'truncated', False):  # a replay may need the whole body
+        store.record(key, method, response)
+    return response
+
+
+def _read(response, expect):
+    """
+    Read the body of a response streamed for a caller looking for reflections
+
+    Reading stops as soon as count reflections of marker (case insensitive)
+    and tail more characters of the decoded body are in, or after
+    core.config.maxResponseSize KB. Cut short responses have
+    response.truncated set and their connection is dropped.
+    """
+    limit = core.config.maxResponseSize * 1024
+    body = bytearray()
+    truncated = False
+    found, searched, end = 0, 0, None
+    marker, count, tail = expect
+    marker = marker.lower().encode('utf-8')
+    try:
+        codecs.lookup(response.encoding or 'utf-8')
+        encoding = response.encoding or 'utf-8'
+    except LookupError:
+        encoding = 'utf-8'
+    chunks = response.iter_content(chunkSize)
+    try:
+        for chunk in chunks:
+            body += chunk
+            if end is None:
+                window = bytes(body[searched:]).lower()
+                position = window.find(marker)
+                while position != -1:
+                    found += 1
+                    searched += position + len(marker)
+                    if found == count:
+                        end = searched
+                        break
+                    window = window[position + len(marker):]
+                    position = window.find(marker)
+                else:
+                    searched = max(searched, len(body) - len(marker) + 1)
+            # a character takes a byte at least, only decode once there may be enough of them
+            if end is not None and len(body) - end >= tail and \
+                    len(bytes(body[end:]).decode(encoding, 'ignore')) >= tail:
+                truncated = _unread(response, chunks)
+                break
+            if limit and len(body) >= limit:
+                truncated = len(body) > limit or _unread(response, chunks)
+                del body[limit:]
+                break
+    finally:
+        if truncated:
+            response.close()  # drop the rest instead of downloading it to reuse the connection
+    response._content = bytes(body)
+    response._content_consumed = True
+    response.truncated = truncated
+
+
+def _unread(response, chunks):
+    """Whether a streamed body has more to it than the chunks read so far"""
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit():
+        return response.raw.tell() < int(length)
+    return bool(next(chunks, b''))  # one more chunk at most, the end of a chunked body is right there
+
+
+def _dropped(error):
+    """Whether a request failed because the connection was cut, rather than refused"""
+    if isinstance(error, requests.exceptions.ChunkedEncodingError):  # cut while reading the body
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        error = error.args[0]
+    if isinstance(error, MaxRetryError):  # the connection was cut on every retry
+        error = error.reason
+    return isinstance(error, ProtocolError)
+
+
+def _request(url, data, headers, method, delay, timeout, expect=None):
+    if getVar('jsonData'):
+        # Unflatten the data back to nested JSON structure
+        data = unflattenJSON(data)
+        data = converter(data)
+    elif getVar('path'):
+        url = converter(data, url)
+        data = []
+        method = 'GET'
+    scheduler = getScheduler()
+    scheduler.acquire(url, delay)
     logger.debug('Requester url: {}'.format(url))
     logger.debug('Requester method: {}'.format(method))
     logger.debug_json('Requester data:', data)
@@ -138,25 +359,41 @@ def requester(url, data, headers, method, delay, timeout):
             logger.warning('JS renderer not available, using standard request')
     
     # Standard request (fallback or when JS rendering is disabled)
-    try:
-        if method == 'GET':
-            response = requests.get(url, params=data, headers=headers,
-                                    timeout=timeout, verify=False, proxies=core.config.proxies)
-        elif getVar('jsonData'):
-            # For JSON data, it's already been processed (unflattened and converted)
-            # data is now a JSON string, we need to parse it for requests.request json parameter
-            import json
-            json_data = json.loads(data) if isinstance(data, str) else data
-            response = requests.request(method, url, json=json_data, headers=headers,
-                                    timeout=timeout, verify=False, proxies=core.config.proxies)
-        else:
-            response = requests.request(method, url, data=data, headers=headers,
-                                     timeout=timeout, verify=False, proxies=core.config.proxies)
-        return response
-    except ProtocolError:
-        logger.warning('WAF is dropping suspicious requests.')
-        logger.warning('Scanning will continue after 10 minutes.')
-        time.sleep(600)
-    except Exception as e:
-        logger.warning('Unable to connect to the target.')
-        return requests.Response()
+    session = getSession(url)
+    stream = bool(expect)
+    for attempt in range(core.config.retries + 1):
+        if attempt:
+            time.sleep(core.config.retryBackoff * 2 ** (attempt - 1))
+            scheduler.acquire(url, delay)
+            logger.debug('Retrying request to {}'.format(url))
+        try:
+            response = _send(session, url, data, headers, method, stream, timeout)
+            if stream:
+                _read(response, expect)
+            scheduler.feedback(url, response)
+            return response
+        except Exception as e:
+            if _dropped(e):
+                pause = scheduler.feedback(url, dropped=True)
+                logger.warning('WAF is dropping suspicious requests.')
+                logger.warning('Requests to this host are slowed down and resume in %i seconds.' % pause)
+                return requests.Response()
+            if isinstance(e, requests.exceptions.ConnectionError) and attempt < core.config.retries:
+                continue
+            logger.warning('Unable to connect to the target.')
+            return requests.Response()
+
+
+def _send(session, url, data, headers, method, stream, timeout):
+    if method == 'GET':
+        return session.get(url, params=data, headers=headers, stream=stream,
+                           timeout=timeout, verify=False, proxies=core.config.proxies)
+    elif getVar('jsonData'):
+        # For JSON data, it's already been processed (unflattened and converted)
+        # data is now a JSON string, we need to parse it for requests.request json parameter
+        import json
+        json_data = json.loads(data) if isinstance(data, str) else data
+        return session.request(method, url, json=json_data, headers=headers, stream=stream,
+                               timeout=timeout, verify=False, proxies=core.config.proxies)
+    return session.request(method, url, data=data, headers=headers, stream=stream,
+                           timeout=timeout, verify=False, proxies=core.config.proxies)
@@ -0,0 +1,132 @@
+"""
+In-memory response cache for requester()
+
+Identical requests (same method, url, parameters, body and headers) are
+answered from memory instead of being sent again. Entries expire after a
+ttl and the least recently used ones are evicted once the cache goes over
+its size budget.
+
+Only safe methods are cached by default. Any other request is always sent
+and drops the cached responses of its host, since it may have changed what
+the host serves (e.g. the stored XSS flow injecting before verifying).
+"""
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+safeMethods = ('GET', 'HEAD', 'OPTIONS')
+ignoredHeaders = ('user-agent',)  # picked at random for every request
+defaultPorts = {'http': 80, 'https': 443}
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return parts.scheme.lower() + '://' + parts.netloc.lower()
+
+
+def fingerprint(method, url, data, headers, *extra):
+    """Build a stable key for a request, insensitive to parameter and header order"""
+    parts = urlsplit(url)
+    netloc = parts.netloc.lower()
+    if parts.port and parts.port == defaultPorts.get(parts.scheme.lower()):
+        netloc = netloc.rsplit(':', 1)[0]
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    base = urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', '', ''))
+    if isinstance(data, dict):
+        body = sorted((str(key), str(value)) for key, value in data.items())
+    else:
+        body = data or ''
+    if method in safeMethods and isinstance(body, list):
+        query, body = query + body, []
+    key = json.dumps([
+        method, base, sorted(query), body,
+        sorted((name.lower(), str(value)) for name, value in headers.items()
+               if name.lower() not in ignoredHeaders),
+        list(extra)], default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _size(response):
+    return len(response.content or b'') + sum(
+        len(name) + len(value) for name, value in response.headers.items()) + 512
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of responses with a ttl and a size budget in bytes"""
+
+    def __init__(self, ttl=300, maxBytes=64 * 1024 * 1024, unsafe=False):
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.unsafe = unsafe
+        self.entries = OrderedDict()  # key: (host, expiry, size, response)
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'uncacheable': 0,
+                      'evictions': 0, 'invalidations': 0}
+
+    def cacheable(self, method):
+        return self.unsafe or method in safeMethods
+
+    def get(self, key):
+        """Get a copy of a cached response, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] < time.time():
+                self._remove(key)
+                entry = None
+            if not entry:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return copy.copy(entry[3])
+
+    def put(self, key, url, response):
+        # failed requests and throttling responses are worth retrying
+        if response.status_code is None or response.status_code == 429 or response.status_code >= 500:
+            return
+        if getattr(response, 'truncated', False):  # another caller may need the whole body
+            return
+        size = _size(response)
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (_host(url), time.time() + self.ttl, size, response)
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, url):
+        """Drop every cached response of the host of url"""
+        host = _host(url)
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry[0] == host]
+            for key in stale:
+                self._remove(key)
+            self.stats['invalidations'] += len(stale)
+
+    def skip(self):
+        with self.lock:
+            self.stats['uncacheable'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def summary(self):
+        with self.lock:
+            stats = dict(self.stats, entries=len(self.entries), bytes=self.bytes)
+        lookups = stats['hits'] + stats['misses']
+        stats['hitRate'] = 100.0 * stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,104 @@
+"""
+On-disk store of responses for recording and replaying scans
+
+A store is a directory with two append-only files:
+
+    responses.dat   zlib compressed response bodies, one after another
+    index.jsonl     one json line per response with its request fingerprint,
+                    status, headers and the offset of its body in responses.dat
+
+Recording appends every response requester() receives. Replaying answers
+requests from the index without touching the network; a request made
+several times gets its recorded responses back in the same order.
+"""
+import datetime
+import json
+import os
+import threading
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
+
+indexName = 'index.jsonl'
+dataName = 'responses.dat'
+
+
+class ResponseStore:
+    def __init__(self, directory, replaying=False):
+        self.directory = directory
+        self.replaying = replaying
+        self.lock = threading.Lock()
+        self.stats = {'recorded': 0, 'replayed': 0, 'missing': 0}
+        if replaying:
+            self.entries = self._load()
+            self.cursors = {}
+            self.data = open(os.path.join(directory, dataName), 'rb')
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.data = open(os.path.join(directory, dataName), 'ab')
+            self.index = open(os.path.join(directory, indexName), 'a', encoding='utf-8')
+
+    def _load(self):
+        entries = {}
+        with open(os.path.join(self.directory, indexName), encoding='utf-8') as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # a line cut short by an interrupted recording
+                    continue
+                entries.setdefault(entry['key'], []).append(entry)
+        logger.debug('Loaded %i recorded requests from %s' % (len(entries), self.directory))
+        return entries
+
+    def record(self, key, method, response):
+        """Append a response to the store"""
+        body = zlib.compress(response.content or b'')
+        entry = {
+            'key': key, 'method': method, 'url': response.url,
+            'status': response.status_code, 'reason': response.reason,
+            'encoding': response.encoding, 'headers': dict(response.headers),
+            'length': len(body),
+        }
+        with self.lock:
+            entry['offset'] = self.data.tell()
+            self.data.write(body)
+            self.data.flush()
+            self.index.write(json.dumps(entry) + '\n')
+            self.index.flush()
+            self.stats['recorded'] += 1
+
+    def replay(self, key, url):
+        """Get the next recorded response of a request, or an empty response if it wasn't recorded"""
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                self.stats['missing'] += 1
+                logger.debug('No recorded response for {}'.format(url))
+                return requests.Response()
+            # replay in the recorded order, the last response answers any extra requests
+            cursor = self.cursors.get(key, 0)
+            self.cursors[key] = cursor + 1
+            entry = entries[min(cursor, len(entries) - 1)]
+            self.data.seek(entry['offset'])
+            body = self.data.read(entry['length'])
+            self.stats['replayed'] += 1
+        response = requests.Response()
+        response._content = zlib.decompress(body)
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.encoding = entry['encoding']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.url = entry['url'] or url
+        response.elapsed = datetime.timedelta(0)
+        return response
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            if not self.replaying:
+                self.index.close()
@@ -0,0 +1,176 @@
+"""
+Central pacing of outgoing requests
+
+Every request takes a token from a global bucket and from the bucket of
+its host before it is sent, whatever thread or mode it comes from.
+
+Host buckets adapt to the target (AIMD): a 429 or 503 response or a
+dropped connection halves the rate of the host, a healthy response raises
+it a little, up to the configured ceiling or back to no limit at all.
+Retry-After is honoured and dropped connections pause the host for a time
+doubling with every consecutive failure.
+"""
+import collections
+import email.utils
+import threading
+import time
+from urllib.parse import urlparse
+
+import core.config
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
+
+congestionStatus = (429, 503)
+decrease = 0.5  # rate multiplier on congestion
+increase = 2.0  # requests per second gained per second of healthy responses
+minRate = 0.1
+unlimitedAbove = 1000.0  # an adapted rate above this without ceiling is no limit at all
+maxPause = 600.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket, rate tokens per second up to burst, 0 for no limit"""
+
+    def __init__(self, rate=0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returns the seconds to wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            if not self.rate:
+                self.last = now
+                return 0
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1  # below zero are tokens promised to the waiting callers
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def setRate(self, rate):
+        with self.lock:
+            now = time.monotonic()
+            if self.rate:
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.rate = rate
+
+
+class Host:
+    def __init__(self):
+        self.bucket = TokenBucket()
+        self.ceiling = 0  # configured rate limit, 0 for none
+        self.adapted = 0  # rate set by the congestion control, 0 until the first congestion
+        self.pausedUntil = 0
+        self.failures = 0  # consecutive dropped connections
+        self.recent = collections.deque(maxlen=20)  # send times, to measure the actual rate
+        self.lock = threading.Lock()
+
+    def observed(self):
+        if len(self.recent) < 2:
+            return 0
+        span = self.recent[-1] - self.recent[0]
+        return (len(self.recent) - 1) / span if span > 0 else 0
+
+    def apply(self):
+        rates = [rate for rate in (self.ceiling, self.adapted) if rate]
+        self.bucket.setRate(min(rates) if rates else 0)
+
+
+class Scheduler:
+    def __init__(self, globalRate=0):
+        self.bucket = TokenBucket(globalRate, burst=max(1, globalRate))
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def host(self, url):
+        netloc = urlparse(url).netloc
+        with self.lock:
+            host = self.hosts.get(netloc)
+            if host is None:
+                host = self.hosts[netloc] = Host()
+            return host
+
+    def acquire(self, url, delay=0):
+        """Block until a request to url may be sent, at most one every delay seconds on its host"""
+        host = self.host(url)
+        with host.lock:
+            rates = [rate for rate in (core.config.rate, 1.0 / delay if delay else 0) if rate]
+            ceiling = min(rates) if rates else 0
+            if ceiling != host.ceiling:
+                host.ceiling = ceiling
+                host.apply()
+            wait = max(0, host.pausedUntil - time.monotonic())
+        wait = max(wait, host.bucket.reserve(), self.bucket.reserve())
+        if wait:
+            with self.lock:
+                self.stats['waited'] += wait
+            time.sleep(wait)
+        with host.lock:
+            host.recent.append(time.monotonic())
+
+    def feedback(self, url, response=None, dropped=False):
+        """Adapt the rate of the host of url to how it answered"""
+        host = self.host(url)
+        status = getattr(response, 'status_code', None)
+        with host.lock:
+            if dropped or status in congestionStatus:
+                current = host.bucket.rate or host.observed() or 1.0
+                host.adapted = max(minRate, current * decrease)
+                pause = _retryAfter(response)
+                if dropped:
+                    host.failures += 1
+                    pause = max(pause, min(maxPause, 2.0 ** host.failures))
+                if pause:
+                    host.pausedUntil = max(host.pausedUntil, time.monotonic() + pause)
+                host.apply()
+                with self.lock:
+                    self.stats['congestions'] += 1
+                logger.debug('Slowing down to %.2f requests per second on %s%s' % (
+                    host.adapted, urlparse(url).netloc, ', pausing %.1fs' % pause if pause else ''))
+                return pause
+            if status is not None:
+                host.failures = 0
+                if host.adapted:
+                    # about `increase` more requests per second after a second of healthy responses
+                    host.adapted += increase / host.adapted
+                    if host.ceiling and host.adapted >= host.ceiling or host.adapted > unlimitedAbove:
+                        host.adapted = 0
+                    host.apply()
+        return 0
+
+    def summary(self):
+        with self.lock:
+            hosts = dict(self.hosts)
+        return dict(self.stats, rates={netloc: host.bucket.rate for netloc, host in hosts.items()})
+
+
+def _retryAfter(response):
+    value = response.headers.get('Retry-After') if response is not None and response.headers else None
+    if not value:
+        return 0
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:  # or an http date
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return 0
+    return min(maxPause, max(0.0, seconds))
+
+
+_scheduler = None
+_schedulerLock = threading.Lock()
+
+
+def getScheduler():
+    global _scheduler
+    with _schedulerLock:
+        if _scheduler is None:
+            _scheduler = Scheduler(core.config.globalRate)
+        return _scheduler
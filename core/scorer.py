@@ -0,0 +1,100 @@
+"""
+Reflection efficiency scorers
+
+checker() rates how much of a payload survived in a reflection with a
+partial ratio between 0 and 100. The backend is picked by core.config.scorer:
+
+    native      fuzzywuzzy's partial_ratio (difflib flavour) with fast paths, no dependency
+    rapidfuzz   rapidfuzz.fuzz.partial_ratio, fastest but it scores differently: its
+                partial_ratio is an optimal alignment, test/bench_scorer.py finds
+                about 44% of checker windows scored otherwise than by fuzzywuzzy.
+                Efficiencies, and so the vectors planned and reported, change
+    fuzzywuzzy  the original fuzzywuzzy implementation
+
+New backends can be added with register().
+"""
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+import core.config
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@lru_cache(maxsize=8192)
+def nativeRatio(s1, s2):
+    """Same scores as fuzzywuzzy.fuzz.partial_ratio without python-Levenshtein"""
+    if s1 is None or s2 is None:
+        return 0
+    if s1 == s2:
+        return 100
+    if not s1 or not s2:
+        return 0
+    if len(s1) <= len(s2):
+        shorter, longer = s1, s2
+    else:
+        shorter, longer = s2, s1
+    # a full match is the longest block, difflib's autojunk heuristic only starts at 200 chars
+    if len(longer) < 200 and shorter in longer:
+        return 100
+    best = 0
+    tried = set()
+    for block in SequenceMatcher(None, shorter, longer).get_matching_blocks():
+        longStart = max(block[1] - block[0], 0)
+        if longStart in tried:
+            continue
+        tried.add(longStart)
+        matcher = SequenceMatcher(None, shorter, longer[longStart:longStart + len(shorter)])
+        # ratio() never exceeds quick_ratio(), skip windows that can't beat the best one
+        if best and matcher.quick_ratio() <= best:
+            continue
+        ratio = matcher.ratio()
+        if ratio > .995:
+            return 100
+        best = max(best, ratio)
+    return int(round(100 * best))
+
+
+def _rapidfuzz():
+    from rapidfuzz import fuzz
+    logger.warning('The rapidfuzz scorer rates reflections differently from native, verdicts may change')
+
+    def rapidfuzzRatio(s1, s2):
+        return int(round(fuzz.partial_ratio(s1, s2)))
+    return rapidfuzzRatio
+
+
+def _fuzzywuzzy():
+    from fuzzywuzzy import fuzz
+    return fuzz.partial_ratio
+
+
+_backends = {
+    'native': lambda: nativeRatio,
+    'rapidfuzz': _rapidfuzz,
+    'fuzzywuzzy': _fuzzywuzzy,
+}
+_loaded = {}
+
+
+def register(name, loader):
+    """Add a backend, loader returns a function taking (reflected, expected) and returning 0-100"""
+    _backends[name] = loader
+    _loaded.pop(name, None)
+
+
+def getScorer(name=None):
+    """Get the scoring function of a backend, falling back to native if it can't be loaded"""
+    name = name or core.config.scorer
+    if name not in _loaded:
+        try:
+            _loaded[name] = _backends[name]()
+        except (ImportError, KeyError) as e:
+            logger.warning('Scorer %s is not available (%s), using native' % (name, e))
+            _loaded[name] = nativeRatio
+    return _loaded[name]
+
+
+def ratio(reflected, expected):
+    return getScorer()(reflected, expected)
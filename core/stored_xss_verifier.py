@@ -6,8 +6,11 @@ This module handles verification of stored XSS payloads by:
 2. Verifying payload execution on a separate verification URL
 3. Supporting both standard HTTP and JS-rendered verification
 4. Detecting XSS triggers on load, click, hover events
+5. Verifying batches of tagged payloads with a single fetch or render
 """
 
+import itertools
+import random
 import re
 import time
 from urllib.parse import unquote
@@ -19,6 +22,15 @@ from core.config import xsschecker
 
 logger = setup_logger(__name__)
 
+# alert(1), confirm(), (confirm)(), a(), (prompt)`` and [8].find(confirm), where the tag can be the argument
+_tag_calls = re.compile(r'(?<=[\w)])(?:\((?:1)?\)|``)|\[8\](?=\.find\()')
+# tags of a scan are unique and distinct from those of earlier scans on the same page
+_tags = itertools.count(random.randrange(10 ** 5, 10 ** 6) * 100)
+
+_verify_headers = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
 # Import JS renderer (lazy import to avoid dependency issues)
 _js_renderer = None
 
@@ -112,7 +124,7 @@ def detect_interactive_xss(html_content, payload):
     return False, None, None
 
 
-def verify_stored_xss_with_js(verify_url, payload, timeout=10, wait_time=3):
+def verify_stored_xss_with_js(verify_url, payload, timeout=10, wait_time=3, tag=None):
     """
     Verify stored XSS using JS rendering (Playwright)
     
@@ -124,6 +136,9 @@ def verify_stored_xss_with_js(verify_url, payload, timeout=10, wait_time=3):
         payload: The injected payload
         timeout: Request timeout
         wait_time: Time to wait for JS execution
+        tag: number the payload was tagged with, see tag_payload(). Only a hook
+             fired with it proves execution, other hooks may come from the page
+             or from payloads stored earlier
         
     Returns:
         tuple: (success, method, context) where success is bool,
@@ -142,15 +157,24 @@ def verify_stored_xss_with_js(verify_url, payload, timeout=10, wait_time=3):
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        # Render the page with JavaScript
-        html_content, status_code, final_url = js_renderer.render_page(
+        # Render the page with JavaScript, the page is left to load as other hooks may fire first
+        rendered = js_renderer.render_execution(
             verify_url,
             verify_headers,
-            wait_time
+            wait_time,
+            settle=True
         )
         
-        if not html_content:
+        if not rendered or not rendered.html:
             return False, None, None
+        html_content = rendered.html
+        
+        # Proof of execution: a hooked alert/confirm/prompt fired with the tag of the payload
+        for hook, argument in rendered.hooks:
+            if tag is not None and argument == str(tag):
+                logger.debug(f'Payload executed in browser: {hook}({argument})')
+                found, context = detect_xss_in_content(html_content, payload)
+                return True, f'js_executed_{hook}', context
         
         # Check if payload is present in rendered content
         found, context = detect_xss_in_content(html_content, payload)
@@ -220,7 +244,7 @@ def verify_stored_xss_standard(verify_url, method, payload, delay, timeout):
         return False, None, None
 
 
-def verify_stored_xss(verify_url, verify_method, payload, delay, timeout, use_js_render=False):
+def verify_stored_xss(verify_url, verify_method, payload, delay, timeout, use_js_render=False, tag=None):
     """
     Main function to verify if a stored XSS payload was successfully injected
     Note: Does not share headers with main requests, only cookies via core.config.cookie
@@ -232,6 +256,7 @@ def verify_stored_xss(verify_url, verify_method, payload, delay, timeout, use_js
         delay: Delay between requests
         timeout: Request timeout
         use_js_render: Whether to use JS rendering
+        tag: number the payload was tagged with, see verify_stored_xss_with_js()
         
     Returns:
         tuple: (success, detection_method, context) where success is bool,
@@ -244,7 +269,7 @@ def verify_stored_xss(verify_url, verify_method, payload, delay, timeout, use_js
     if use_js_render:
         success, method, context = verify_stored_xss_with_js(
             verify_url, payload, timeout, 
-            wait_time=core.config.jsRenderWait
+            wait_time=core.config.jsExecWait, tag=tag
         )
         if success:
             return True, method, context
@@ -255,3 +280,104 @@ def verify_stored_xss(verify_url, verify_method, payload, delay, timeout, use_js
     )
     
     return success, method, context
+
+
+def tag_payload(payload):
+    """
+    Make a stored payload identifiable: it is prefixed with a unique number and
+    the calls of its function get the number as argument, e.g. alert(1) becomes
+    alert(1234500), so a hook that fires tells which payload ran
+
+    Returns:
+        tuple: (number, tagged_payload, traceable) where traceable tells whether
+               the number reaches the hooks
+    """
+    number = next(_tags)
+
+    def argument(match):
+        call = match.group()
+        return f'`{number}`' if call == '``' else f'[{number}]' if call == '[8]' else f'({number})'
+
+    tagged, calls = _tag_calls.subn(argument, payload)
+    return number, f'sx{number}{tagged}', bool(calls)
+
+
+def page_hooks(verify_url):
+    """The (hook, argument) a page fires by itself, before anything is injected"""
+    js_renderer = get_js_renderer()
+    if not verify_url or not js_renderer:
+        return []
+    try:
+        rendered = js_renderer.render_execution(
+            verify_url, dict(_verify_headers), core.config.jsExecWait, settle=True)
+    except Exception as e:
+        logger.warning(f'Error in JS-based verification: {e}')
+        return []
+    return rendered.hooks if rendered else []
+
+
+def _detect_batch(html_content, payloads, found, method):
+    for number, payload in payloads.items():
+        if number in found:
+            continue
+        present, context = detect_xss_in_content(html_content, payload)
+        if present:
+            found[number] = (method, context)
+            continue
+        interactive, event_type, context = detect_interactive_xss(html_content, payload)
+        if interactive:
+            found[number] = (f'interactive_{event_type}', context)
+
+
+def verify_stored_batch(verify_url, verify_method, payloads, delay, timeout, use_js_render=False):
+    """
+    Verify a batch of tagged payloads with a single render and/or fetch of verify_url
+    Note: Does not share headers with main requests, only cookies via core.config.cookie
+
+    Args:
+        verify_url: URL to check for stored XSS
+        verify_method: HTTP method for verification
+        payloads: dict of tag number: tagged payload, see tag_payload()
+        delay: Delay between requests
+        timeout: Request timeout
+        use_js_render: Whether to use JS rendering
+
+    Returns:
+        tuple: (found, hooks) where found maps the numbers of the payloads detected
+               to (detection_method, context) and hooks lists the (hook, argument)
+               that fired without the number of one of the payloads
+    """
+    found = {}
+    hooks = []
+    if not verify_url or not payloads:
+        return found, hooks
+
+    if use_js_render:
+        js_renderer = get_js_renderer()
+        try:
+            # the page is left to load, every payload of the batch gets to run
+            rendered = js_renderer.render_execution(
+                verify_url, dict(_verify_headers), core.config.jsExecWait, settle=True) if js_renderer else None
+        except Exception as e:
+            logger.warning(f'Error in JS-based verification: {e}')
+            rendered = None
+        if rendered and rendered.html:
+            for hook, argument in rendered.hooks:
+                number = int(argument) if argument.isdigit() else None
+                if number in payloads:
+                    if number not in found:
+                        context = detect_xss_in_content(rendered.html, payloads[number])[1]
+                        found[number] = (f'js_executed_{hook}', context)
+                else:
+                    hooks.append((hook, argument))
+            _detect_batch(rendered.html, payloads, found, 'js_rendered')
+
+    if len(found) < len(payloads):
+        try:
+            response = requester(verify_url, {}, dict(_verify_headers), verify_method, delay, timeout)
+            if response and response.text:
+                _detect_batch(response.text, payloads, found, 'standard')
+        except Exception as e:
+            logger.warning(f'Error in standard verification: {e}')
+
+    return found, hooks
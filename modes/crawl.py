@@ -5,7 +5,7 @@ import core.config
 from core.colors import green, end
 from core.config import xsschecker
 from core.filterChecker import filterChecker
-from core.generator import generator
+from core.generator import plan
 from core.htmlParser import htmlParser
 from core.requester import requester
 from core.log import setup_logger
@@ -44,18 +44,14 @@ def crawl(scheme, host, main_url, form, blindXSS, blindPayload, headers, delay,
                             positions = occurences.keys()
                             occurences = filterChecker(
                                 url, paramsCopy, headers, method, delay, occurences, timeout, encoding)
-                            vectors = generator(occurences, response.text)
-                            if vectors:
-                                for confidence, vects in vectors.items():
-                                    try:
-                                        payload = list(vects)[0]
-                                        logger.vuln('Vulnerable webpage: %s%s%s' %
-                                                    (green, url, end))
-                                        logger.vuln('Vector for %s%s%s: %s' %
-                                                    (green, paramName, end, payload))
-                                        break
-                                    except IndexError:
-                                        pass
+                            vectors = plan(occurences, response.text)
+                            # only the best vector is reported, the others are never built
+                            for confidence, payload in vectors:
+                                logger.vuln('Vulnerable webpage: %s%s%s' %
+                                            (green, url, end))
+                                logger.vuln('Vector for %s%s%s: %s' %
+                                            (green, paramName, end, payload))
+                                break
                             if blindXSS and blindPayload:
                                 paramsCopy[paramName] = blindPayload
                                 requester(url, paramsCopy, headers,
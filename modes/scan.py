@@ -1,26 +1,67 @@
+import collections
+import concurrent.futures
 import copy
 import re
+import threading
+from functools import partial
 from urllib.parse import urlparse, quote, unquote
 
+from core import asyncEngine
 from core.checker import checker
 from core.colors import end, green, que
 import core.config
 from core.config import xsschecker, minEfficiency
 from core.dom import dom
 from core.filterChecker import filterChecker
-from core.generator import generator
+from core.filterLearner import FilterLearner
+from core.generator import plan
 from core.htmlParser import htmlParser
-from core.requester import requester
+from core.requester import requester, get_js_renderer
 from core.utils import getUrl, getParams, getVar, flattenParams, replaceValue
+from core.vectorScores import getVectorScores
 from core.wafDetector import wafDetector
-from core.log import setup_logger
-from core.stored_xss_verifier import verify_stored_xss
+from core.log import setup_logger, start_buffering, flush_buffer
+from core.stored_xss_verifier import verify_stored_xss, verify_stored_batch, tag_payload, page_hooks
 
 logger = setup_logger(__name__)
 
-find_dom_vul = False
-find_reflected_vul = False
-find_stored_vul = False
+_findings = {'dom': False, 'reflected': False, 'stored': False}  # shared by all parameter workers
+_findingsLock = threading.Lock()
+_promptLock = threading.Lock()
+_abort = threading.Event()  # set once the user chooses to stop scanning
+
+
+def _markFound(kind):
+    with _findingsLock:
+        _findings[kind] = True
+
+
+def _continueScanning(question):
+    """Ask the user whether to continue, printing the pending output of this worker first"""
+    with _promptLock:
+        if _abort.is_set():
+            return False
+        buffering = flush_buffer()
+        choice = input('%s %s [y/N] ' % (que, question)).lower()
+        if buffering:
+            start_buffering()
+    if choice != 'y':
+        _abort.set()
+        return False
+    return True
+
+
+def _confirmExecution(reproduction, headers):
+    """Render a reproduction url and log whether the payload actually ran"""
+    renderer = get_js_renderer()
+    rendered = renderer.render_execution(reproduction, headers, core.config.jsExecWait) if renderer else None
+    if rendered is None or rendered.html is None:
+        logger.warning('Execution: could not be checked in browser')
+    elif rendered.executed:
+        logger.good('Execution: confirmed in browser, %s(%s) fired' % rendered.executed)
+    else:
+        logger.info('Execution: not confirmed in browser')
+
 
 def scan(target, paramData, encoding, headers, delay, timeout, skipDOM, skip):
     GET, POST = (False, True) if paramData else (True, False)
@@ -49,12 +90,11 @@ def scan(target, paramData, encoding, headers, delay, timeout, skipDOM, skip):
         response = requester(check_url, {}, headers, core.config.verifyMethod, delay, timeout).text
 
     # DOM XSS check (only if we have HTML response)
-    global find_dom_vul
     if not skipDOM:
         logger.run('Checking for DOM vulnerabilities')
         highlighted = dom(response)
         if highlighted:
-            find_dom_vul = True
+            _markFound('dom')
             logger.good('DOM XSS Detected!')
             logger.good('Potentially vulnerable objects found')
             logger.red_line(level='good')
@@ -78,62 +118,95 @@ def scan(target, paramData, encoding, headers, delay, timeout, skipDOM, skip):
         logger.error('WAF detected: %s%s%s' % (green, WAF, end))
     else:
         logger.good('WAF Status: %sOffline%s' % (green, end))
+    core.config.globalVariables['waf'] = WAF
 
-    for paramName in params.keys():
-        paramsCopy = copy.deepcopy(params)
-        logger.info('Testing parameter: %s' % paramName)
-        if encoding:
-            paramsCopy[paramName] = encoding(xsschecker)
-        else:
-            paramsCopy[paramName] = xsschecker
-        
-        # Inject payload into target URL
-        inject_response = requester(url, paramsCopy, headers, method, delay, timeout)
-        
-        # Check for reflections
-        # For non-GET methods with verifyUrl, check reflections on verifyUrl
-        if use_verify_for_reflection_dom:
-            logger.debug('Using verify URL for reflection check: {}'.format(check_url))
-            check_response = requester(check_url, {}, headers, 'GET', delay, timeout)
-        else:
-            check_response = inject_response
-        
-        occurences = htmlParser(check_response, encoding)
-        positions = occurences.keys()
-        logger.debug('Scan occurences: {}'.format(occurences))
-        
-        # ===== Reflected XSS Detection Flow =====
-        has_reflection = len(occurences) > 0
-        reflected_xss_tested = False
-        
-        if has_reflection:
-            logger.info('Reflections found: %i' % len(occurences))
-            reflected_xss_tested = True
-            
-            # Test reflected XSS
-            _test_reflected_xss(
-                url, paramsCopy, headers, method, delay, timeout, encoding,
-                occurences, check_response.text, check_url, use_verify_for_reflection_dom,
-                paramName, params, GET, skip
-            )
-        else:
-            logger.error('No reflection found for reflected XSS detection')
-        
-        # ===== Stored XSS Detection Flow (Independent) =====
-        if core.config.verifyUrl:
-            logger.run('Testing for stored XSS')
-            _test_stored_xss(
-                url, paramsCopy, headers, method, delay, timeout,
-                paramName, params, GET, skip
-            )
-        
-        if all([not find_dom_vul, not find_reflected_vul, not find_stored_vul]):
-            logger.no_format('')
-            logger.info('all tested parameters do not appear to be injectable')
+    # Parameters are independent of each other, unless they all store into the verification page
+    workers = 1 if core.config.verifyUrl else min(getVar('threadCount'), len(params))
+    scanParam = partial(_scanParam, url, params, headers, method, delay, timeout, encoding,
+                        check_url, use_verify_for_reflection_dom, GET, skip, workers > 1)
+    if workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as threadpool:
+            futures = [threadpool.submit(scanParam, paramName) for paramName in params]
+            for future in futures:
+                future.result()
+    else:
+        for paramName in params:
+            scanParam(paramName)
+    if _abort.is_set():
+        quit()
 
+    if not any(_findings.values()):
+        logger.info('all tested parameters do not appear to be injectable')
         logger.no_format('')
 
 
+def _scanParam(url, params, headers, method, delay, timeout, encoding,
+               check_url, use_verify_for_reflection_dom, GET, skip, buffered, paramName):
+    """Run reflection analysis and payload testing for a single parameter"""
+    if _abort.is_set():
+        return
+    if buffered:
+        start_buffering()
+    try:
+        _testParam(url, params, headers, method, delay, timeout, encoding,
+                   check_url, use_verify_for_reflection_dom, GET, skip, paramName)
+    finally:
+        if buffered:
+            flush_buffer()
+
+
+def _testParam(url, params, headers, method, delay, timeout, encoding,
+               check_url, use_verify_for_reflection_dom, GET, skip, paramName):
+    paramsCopy = copy.deepcopy(params)
+    logger.info('Testing parameter: %s' % paramName)
+    if encoding:
+        paramsCopy[paramName] = encoding(xsschecker)
+    else:
+        paramsCopy[paramName] = xsschecker
+    
+    # Inject payload into target URL
+    inject_response = requester(url, paramsCopy, headers, method, delay, timeout)
+    
+    # Check for reflections
+    # For non-GET methods with verifyUrl, check reflections on verifyUrl
+    if use_verify_for_reflection_dom:
+        logger.debug('Using verify URL for reflection check: {}'.format(check_url))
+        check_response = requester(check_url, {}, headers, 'GET', delay, timeout)
+    else:
+        check_response = inject_response
+    
+    occurences = htmlParser(check_response, encoding)
+    positions = occurences.keys()
+    logger.debug('Scan occurences: {}'.format(occurences))
+    
+    # ===== Reflected XSS Detection Flow =====
+    has_reflection = len(occurences) > 0
+    reflected_xss_tested = False
+    
+    if has_reflection:
+        logger.info('Reflections found: %i' % len(occurences))
+        reflected_xss_tested = True
+        
+        # Test reflected XSS
+        _test_reflected_xss(
+            url, paramsCopy, headers, method, delay, timeout, encoding,
+            occurences, check_response.text, check_url, use_verify_for_reflection_dom,
+            paramName, params, GET, skip
+        )
+    else:
+        logger.error('No reflection found for reflected XSS detection')
+    
+    # ===== Stored XSS Detection Flow (Independent) =====
+    if core.config.verifyUrl:
+        logger.run('Testing for stored XSS')
+        _test_stored_xss(
+            url, paramsCopy, headers, method, delay, timeout,
+            paramName, params, GET, skip
+        )
+    
+    logger.no_format('')
+
+
 def _test_reflected_xss(url, paramsCopy, headers, method, delay, timeout, encoding,
                         occurences, response_text, check_url, use_verify_for_reflection_dom,
                         paramName, params, GET, skip):
@@ -149,90 +222,110 @@ def _test_reflected_xss(url, paramsCopy, headers, method, delay, timeout, encodi
     )
     logger.debug('Scan efficiencies: {}'.format(efficiencies))
     logger.run('Generating payloads')
-    vectors = generator(occurences, response_text)
-    total = 0
-    for v in vectors.values():
-        total += len(v)
+    # families that worked against this WAF and context before go first
+    waf = core.config.globalVariables.get('waf')
+    scores = getVectorScores()
+    vectors = plan(occurences, response_text, partial(scores.order, waf))
+    total = vectors.size  # duplicates are skipped, fewer may be sent
     if total == 0:
         logger.error('No vectors were crafted.')
         return
     logger.info('Payloads generated: %i' % total)
     progress = 0
-    skip_current_param = False
-    
-    for confidence, vects in vectors.items():
-        if skip_current_param:
-            break
-        for vect in vects:
-            if skip_current_param:
-                break
+    # what the parameter filters is learnt from the probes, encoded payloads can't tell
+    learner = None if encoding else FilterLearner()
+
+    def payloads():
+        # vectors are built as they are consumed, probing starts right away
+        for family, vect in vectors.walk():
+            if learner and learner.blocks(vect):
+                continue
             if core.config.globalVariables['path']:
                 vect = vect.replace('/', '%2F')
             loggerVector = vect
-            progress += 1
-            logger.run('Progress: %i/%i\r' % (progress, total))
             if not GET:
                 vect = unquote(vect)
+            yield family, vect, loggerVector
+
+    def probe(item):
+        family, vect, loggerVector = item
+        # Inject payload and check on appropriate URL
+        if use_verify_for_reflection_dom:
+            # Inject to target, check on verify URL
+            requester(url, replaceValue(paramsCopy, xsschecker, vect, copy.deepcopy),
+                      headers, method, delay, timeout)
+            efficiencies, snippets, offsets = checker(
+                check_url, {}, headers, 'GET', delay, vect, positions, timeout, encoding)
+        else:
+            # Standard reflected XSS check
+            efficiencies, snippets, offsets = checker(
+                url, paramsCopy, headers, method, delay, vect, positions, timeout, encoding)
+        return family, vect, loggerVector, efficiencies, snippets, offsets
+
+    # Injecting and verifying on another url has to stay sequential
+    if core.config.asyncScan and not use_verify_for_reflection_dom:
+        results = asyncEngine.ordered(
+            (partial(probe, item) for item in payloads()), core.config.asyncLimit)
+    else:
+        results = (probe(item) for item in payloads())
+
+    for family, vect, loggerVector, efficiencies, snippets, offsets in results:
+        if _abort.is_set():
+            break
+        progress += 1
+        logger.run('Progress: %i/%i\r' % (progress, total))
+
+        if not efficiencies:
+            for i in range(len(occurences)):
+                efficiencies.append(0)
+                snippets.append('')
+        bestEfficiency = max(efficiencies)
+        scores.record(waf, family, bestEfficiency)
+        if learner:
+            learner.learn(vect, snippets, offsets)
+        
+        if bestEfficiency > minEfficiency or (vect[0] == '\\' and bestEfficiency >= 95):
+            index = efficiencies.index(bestEfficiency)
+            occurenceList = list(occurences.values())
             
-            # Inject payload and check on appropriate URL
-            if use_verify_for_reflection_dom:
-                # Inject to target, check on verify URL
-                from core.utils import replaceValue
-                requester(url, replaceValue(paramsCopy, xsschecker, vect, copy.deepcopy), 
-                         headers, method, delay, timeout)
-                efficiencies, snippets = checker(
-                    check_url, {}, headers, 'GET', delay, vect, positions, timeout, encoding)
-            else:
-                # Standard reflected XSS check
-                efficiencies, snippets = checker(
-                    url, paramsCopy, headers, method, delay, vect, positions, timeout, encoding)
+            if index >= len(occurenceList) or index >= len(snippets):
+                logger.warning('Index mismatch detected, skipping this payload')
+                continue
             
-            if not efficiencies:
-                for i in range(len(occurences)):
-                    efficiencies.append(0)
-                    snippets.append('')
-            bestEfficiency = max(efficiencies)
+            bestSnippet = snippets[index]
+            bestContext = occurenceList[index]['context']
             
-            if bestEfficiency > minEfficiency or (vect[0] == '\\' and bestEfficiency >= 95):
-                index = efficiencies.index(bestEfficiency)
-                occurenceList = list(occurences.values())
-                
-                if index >= len(occurenceList) or index >= len(snippets):
-                    logger.warning('Index mismatch detected, skipping this payload')
-                    continue
-                
-                bestSnippet = snippets[index]
-                bestContext = occurenceList[index]['context']
-                
-                global find_reflected_vul
-                find_reflected_vul = True
-                logger.red_line()
-                logger.good('Reflected XSS Detected!')
-                logger.good('Payload: %s' % loggerVector)
-                logger.info('Parameter: %s' % paramName)
-                logger.info('Context: %s' % bestContext)
-                logger.info('Efficiency: %i' % bestEfficiency)
-                logger.info('Confidence: %i' % confidence)
-                if GET:
-                    logger.info('Reproduction: %s%s' % (url, flattenParams(paramName, params, loggerVector)))
-                elif use_verify_for_reflection_dom:
-                    logger.info('Injection URL: %s' % url)
-                    logger.info('Reflection URL: %s' % check_url)
-                
-                bestSnippet = bestSnippet.replace('st4r7s', '').replace('3nd', '')
-                logger.info('Reflection: %s' % bestSnippet)
-                logger.red_line()
-
-                if bestEfficiency == 100 or (vect[0] == '\\' and bestEfficiency >= 95):
-                    if not skip:
-                        choice = input(
-                            '%s Would you like to continue scanning? [y/N] ' % que).lower()
-                        if choice != 'y':
-                            quit()
-                    else:
-                        logger.info('Skipping remaining payloads for parameter: %s' % paramName)
-                        skip_current_param = True
+            _markFound('reflected')
+            logger.red_line()
+            logger.good('Reflected XSS Detected!')
+            logger.good('Payload: %s' % loggerVector)
+            logger.info('Parameter: %s' % paramName)
+            logger.info('Context: %s' % bestContext)
+            logger.info('Efficiency: %i' % bestEfficiency)
+            logger.info('Confidence: %i' % family.confidence)
+            if GET:
+                reproduction = url + flattenParams(paramName, params, loggerVector)
+                logger.info('Reproduction: %s' % reproduction)
+                if core.config.jsRender:
+                    _confirmExecution(reproduction, headers)
+            elif use_verify_for_reflection_dom:
+                logger.info('Injection URL: %s' % url)
+                logger.info('Reflection URL: %s' % check_url)
+            
+            bestSnippet = bestSnippet.replace('st4r7s', '').replace('3nd', '')
+            logger.info('Reflection: %s' % bestSnippet)
+            logger.red_line()
+
+            if bestEfficiency == 100 or (vect[0] == '\\' and bestEfficiency >= 95):
+                if not skip:
+                    if not _continueScanning('Would you like to continue scanning?'):
                         break
+                else:
+                    logger.info('Skipping remaining payloads for parameter: %s' % paramName)
+                    break
+    if learner and learner.skipped:
+        logger.info('Saved %i requests, %s filters: %s' % (
+            learner.skipped, paramName, ' '.join(sorted(learner.filtered))))
 
 
 def _test_stored_xss(url, paramsCopy, headers, method, delay, timeout,
@@ -265,30 +358,34 @@ def _test_stored_xss(url, paramsCopy, headers, method, delay, timeout,
         '\' onmouseover=alert(1) ',
     ])
     
-    total = len(stored_vectors)
-    logger.info('Testing %i stored XSS payloads' % total)
-    progress = 0
-    skip_current_param = False
-    
+    prepared = []
     for vect in stored_vectors:
-        if skip_current_param:
-            break
-        
         if core.config.globalVariables['path']:
             vect = vect.replace('/', '%2F')
-        loggerVector = vect
+        prepared.append((vect, unquote(vect) if not GET else vect))
+
+    def inject(test_vect):
+        inject_params = replaceValue(paramsCopy, xsschecker, test_vect, copy.deepcopy)
+        requester(url, inject_params, headers, method, delay, timeout)
+
+    # in the browser, a hook is only attributed to a payload by its tag or against the page's own hooks
+    if core.config.storedBatch > 1 or core.config.jsRender:
+        _test_stored_batches(prepared, inject, delay, timeout, paramName, url, skip)
+        return
+
+    total = len(prepared)
+    logger.info('Testing %i stored XSS payloads' % total)
+    progress = 0
+
+    for loggerVector, test_vect in prepared:
+        if _abort.is_set():
+            break
         progress += 1
         logger.run('Progress: %i/%i\r' % (progress, total))
-        
-        if not GET:
-            test_vect = unquote(vect)
-        else:
-            test_vect = vect
-        
+
         # Inject payload
-        inject_params = replaceValue(paramsCopy, xsschecker, test_vect, copy.deepcopy)
-        requester(url, inject_params, headers, method, delay, timeout)
-        
+        inject(test_vect)
+
         # Verify stored XSS
         stored_xss_found, stored_xss_method, stored_xss_context = verify_stored_xss(
             core.config.verifyUrl,
@@ -298,35 +395,120 @@ def _test_stored_xss(url, paramsCopy, headers, method, delay, timeout,
             timeout,
             use_js_render=core.config.jsRender
         )
-        
+
         if stored_xss_found:
-            global find_stored_vul
-            find_stored_vul = True
-            logger.red_line()
-            logger.good('Stored XSS Detected!')
-            logger.good('Payload: %s' % loggerVector)
-            logger.info('Parameter: %s' % paramName)
-            logger.info('Injection URL: %s' % url)
-            logger.info('Verification URL: %s' % core.config.verifyUrl)
-            logger.info('Detection Method: %s' % stored_xss_method)
-            
-            if stored_xss_method and 'interactive' in stored_xss_method:
-                logger.info('Trigger Type: %s (requires user interaction)' % stored_xss_method.replace('interactive_', ''))
+            _report_stored(loggerVector, stored_xss_method, stored_xss_context, paramName, url)
+            if not skip:
+                if not _continueScanning('Stored XSS found! Would you like to continue scanning?'):
+                    break
             else:
-                logger.info('Trigger Type: Immediate (on page load)')
-            
-            if stored_xss_context:
-                context_preview = stored_xss_context[:200] if len(stored_xss_context) > 200 else stored_xss_context
-                logger.info('Context: %s' % context_preview.replace('st4r7s', '').replace('3nd', ''))
-            
-            logger.red_line()
-            
+                logger.info('Skipping remaining payloads for parameter: %s' % paramName)
+                break
+
+
+def _report_stored(loggerVector, stored_xss_method, stored_xss_context, paramName, url):
+    _markFound('stored')
+    logger.red_line()
+    logger.good('Stored XSS Detected!')
+    logger.good('Payload: %s' % loggerVector)
+    logger.info('Parameter: %s' % paramName)
+    logger.info('Injection URL: %s' % url)
+    logger.info('Verification URL: %s' % core.config.verifyUrl)
+    logger.info('Detection Method: %s' % stored_xss_method)
+
+    if stored_xss_method and stored_xss_method.startswith('js_executed'):
+        logger.info('Execution: confirmed in browser, %s() fired' % stored_xss_method.replace('js_executed_', ''))
+    if stored_xss_method and 'interactive' in stored_xss_method:
+        logger.info('Trigger Type: %s (requires user interaction)' % stored_xss_method.replace('interactive_', ''))
+    else:
+        logger.info('Trigger Type: Immediate (on page load)')
+
+    if stored_xss_context:
+        context_preview = stored_xss_context[:200] if len(stored_xss_context) > 200 else stored_xss_context
+        logger.info('Context: %s' % context_preview.replace('st4r7s', '').replace('3nd', ''))
+
+    logger.red_line()
+
+
+def _test_stored_batches(prepared, inject, delay, timeout, paramName, url, skip):
+    """
+    Inject core.config.storedBatch payloads at a time and verify each batch once
+
+    Payloads are tagged with unique numbers (see tag_payload), the ones found
+    on the verification page or whose number a hook fired with are attributed
+    directly. A hook firing more often than before without a known number
+    can only come from an untraceable payload of the batch, those are
+    bisected until it is found. Payloads verified in the browser go through
+    here one at a time too, for the same attribution.
+    """
+    size = core.config.storedBatch
+    total = len(prepared)
+    # seen counts the untraced hooks of the last verification, the page fires some by itself
+    state = {'issued': set(), 'seen': collections.Counter(), 'verifications': 0}
+    if core.config.jsRender:
+        state['seen'].update(page_hooks(core.config.verifyUrl))
+        state['verifications'] += 1
+    if size > 1:
+        logger.info('Testing %i stored XSS payloads in batches of %i' % (total, size))
+    else:
+        logger.info('Testing %i stored XSS payloads' % total)
+
+    for start in range(0, total, size):
+        if _abort.is_set():
+            break
+        logger.run('Progress: %i/%i\r' % (min(total, start + size), total))
+        found = _verify_stored_batch(prepared[start:start + size], inject, delay, timeout, state)
+        for loggerVector, (stored_xss_method, stored_xss_context) in found:
+            _report_stored(loggerVector, stored_xss_method, stored_xss_context, paramName, url)
+        if found:
             if not skip:
-                choice = input(
-                    '%s Stored XSS found! Would you like to continue scanning? [y/N] ' % que).lower()
-                if choice != 'y':
-                    quit()
+                if not _continueScanning('Stored XSS found! Would you like to continue scanning?'):
+                    break
             else:
                 logger.info('Skipping remaining payloads for parameter: %s' % paramName)
-                skip_current_param = True
                 break
+    logger.info('Verified %i stored payloads with %i verifications' % (
+        len(state['issued']), state['verifications']))
+
+
+def _verify_stored_batch(batch, inject, delay, timeout, state):
+    """Inject and verify a batch, returns [(loggerVector, (method, context))] in batch order"""
+    tagged = {}
+    for item in batch:
+        number, payload, traceable = tag_payload(item[1])
+        tagged[number] = (item, payload, traceable)
+        inject(payload)
+    state['issued'].update(tagged)
+    found, hooks = verify_stored_batch(
+        core.config.verifyUrl, core.config.verifyMethod,
+        {number: entry[1] for number, entry in tagged.items()},
+        delay, timeout, use_js_render=core.config.jsRender)
+    state['verifications'] += 1
+
+    # payloads of earlier batches are still on the page, only new untraced hooks are ambiguous
+    counts = collections.Counter(hook for hook in hooks
+                                 if not (hook[1].isdigit() and int(hook[1]) in state['issued']))
+    unknown = [hook for hook in counts if counts[hook] > state['seen'][hook]]
+    state['seen'] = counts
+    suspects = [number for number, entry in tagged.items() if not entry[2] and
+                not (number in found and found[number][0].startswith('js_executed'))]
+    results = dict(found)
+    if unknown and suspects:
+        if len(suspects) == 1 and len(batch) == 1:
+            number = suspects[0]
+            results[number] = ('js_executed_%s' % unknown[0][0], found.get(number, (None, None))[1])
+        else:
+            items = [tagged[number][0] for number in suspects]
+            if len(items) == len(batch):  # nothing to set aside, split the batch itself
+                halves = (items[:len(items) // 2], items[len(items) // 2:])
+            else:
+                halves = (items,)
+            logger.debug('Bisecting %i untraceable payloads, %s fired' % (len(items), unknown[0]))
+            retested = {}
+            for half in halves:
+                retested.update(_verify_stored_batch(half, inject, delay, timeout, state))
+            for number in suspects:
+                loggerVector = tagged[number][0][0]
+                if loggerVector in retested and retested[loggerVector][0].startswith('js_executed'):
+                    results[number] = retested[loggerVector]
+    return [(tagged[number][0][0], results[number]) for number in tagged if number in results]
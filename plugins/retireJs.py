@@ -1,8 +1,14 @@
 import re
 import json
+import bisect
 import hashlib
+import threading
+import concurrent.futures
+from collections import Counter
+from functools import lru_cache
 from urllib.parse import urlparse
 
+import core.config
 from core.colors import green, end
 from core.requester import requester
 from core.utils import deJSON, js_extractor, handle_anchor, getVar, updateVar
@@ -10,11 +16,179 @@ from core.log import setup_logger
 
 logger = setup_logger(__name__)
 
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+minLiteral = 3  # shorter required literals don't make a useful prefilter
+
 
 def is_defined(o):
     return o is not None
 
 
+def _literal(pattern):
+    """The longest literal a regex can't match without, '' if there is none"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return ''
+    if parsed.state.flags & re.IGNORECASE:
+        return ''
+    best = current = ''
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            current += chr(value)
+            best = max(best, current, key=len)
+        else:
+            current = ''
+    return best if len(best) >= minLiteral else ''
+
+
+class Definitions:
+    """
+    retire.js definitions compiled for scanning
+
+    Every extractor regex is compiled once along with the longest literal it
+    requires, a regex whose literal isn't in the data can't match and isn't
+    run at all. Hashes are indexed. Extractors keep the order of the json so
+    results are the same as with scan().
+
+    The vulnerable ranges of a component are cut into segments between their
+    sorted bounds, each knowing the vulnerabilities it is in, so finding the
+    ones of a version is a bisect, see affecting().
+    """
+
+    def __init__(self, definitions):
+        self.raw = definitions
+        self.extractors = {'uri': [], 'filename': [], 'filecontent': []}
+        self.replacements = []  # (component, regex, replacement)
+        self.hashes = {}  # sha1: (component, version)
+        self.ranges = {}  # component: (sorted bounds, vulnerability indexes of each segment)
+        self.width = max([len(_versionParts(vulnerability[bound]))
+                          for definition in definitions.values()
+                          for vulnerability in definition.get('vulnerabilities') or ()
+                          for bound in ('below', 'atOrAbove') if vulnerability.get(bound)] or [1])
+        for component, definition in definitions.items():
+            self.ranges[component] = self._index(definition.get('vulnerabilities') or ())
+            extractors = definition.get('extractors') or {}
+            for kind, compiled in self.extractors.items():
+                for regex in extractors.get(kind) or ():
+                    regex = deJSON(regex)
+                    try:
+                        compiled.append((component, re.compile(regex), _literal(regex)))
+                    except re.error as e:
+                        logger.debug('Ignoring the %s extractor of %s: %s' % (kind, component, e))
+            for regex in extractors.get('filecontentreplace') or ():
+                parts = re.search(r'^\/(.*[^\\])\/([^\/]+)\/$', deJSON(regex))
+                try:
+                    self.replacements.append((component, re.compile('(' + parts.group(1) + ')'),
+                                              re.compile(parts.group(1)), parts.group(2)))
+                except (AttributeError, re.error):
+                    continue
+            for digest, version in (extractors.get('hashes') or {}).items():
+                self.hashes.setdefault(digest, (component, version))
+
+    def _index(self, vulnerabilities):
+        keys = []
+        for vulnerability in vulnerabilities:
+            below, atOrAbove = vulnerability.get('below'), vulnerability.get('atOrAbove')
+            keys.append((_versionKey(below, self.width) if is_defined(below) else None,
+                         _versionKey(atOrAbove, self.width) if is_defined(atOrAbove) else None))
+        bounds = sorted(set(key for pair in keys for key in pair if key is not None))
+        position = {key: i for i, key in enumerate(bounds)}
+        # segment i holds the versions from bounds[i - 1] up to, not including, bounds[i]
+        segments = []
+        for i in range(len(bounds) + 1):
+            segments.append(tuple(
+                n for n, (below, atOrAbove) in enumerate(keys)
+                if (below is None or position[below] >= i) and
+                (atOrAbove is None or position[atOrAbove] < i)))
+        return bounds, segments
+
+    def affecting(self, component, version):
+        """Indexes of the vulnerabilities of component a version is affected by"""
+        bounds, segments = self.ranges[component]
+        key = _versionKey(version, self.width)
+        if key is None:  # more parts than any bound, compare it the slow way
+            return [n for n, vulnerability in enumerate(self.raw[component].get('vulnerabilities') or ())
+                    if not (is_defined(vulnerability.get('below')) and
+                            _is_at_or_above(version, vulnerability.get('below'))) and not (
+                        is_defined(vulnerability.get('atOrAbove')) and
+                        not _is_at_or_above(version, vulnerability.get('atOrAbove')))]
+        return segments[bisect.bisect_right(bounds, key)]
+
+    def scan(self, data, extractor):
+        """Same as scan(data, extractor, definitions)"""
+        detected = []
+        present = {'': True}
+        for component, regex, literal in self.extractors[extractor]:
+            if literal not in present:
+                present[literal] = literal in data
+            if not present[literal]:
+                continue
+            match = regex.search(data)
+            if match and match.group(1):
+                detected.append({"version": match.group(1),
+                                 "component": component,
+                                 "detection": extractor})
+        return detected
+
+    def scanReplacement(self, data):
+        """Same as scan(data, 'filecontentreplace', definitions, _replacement_match)"""
+        detected = []
+        for component, search, pattern, replacement in self.replacements:
+            match = search.search(data)
+            if match:
+                version = pattern.sub(replacement, match.group(0))
+                if version:
+                    detected.append({"version": version,
+                                     "component": component,
+                                     "detection": 'filecontentreplace'})
+        return detected
+
+    def scanHash(self, digest):
+        if digest not in self.hashes:
+            return []
+        component, version = self.hashes[digest]
+        return [{"version": version, "component": component, "detection": 'hash'}]
+
+
+def _versionParts(version):
+    return [_to_comparable(part) for part in re.split(r'[.-]', version)]
+
+
+@lru_cache(maxsize=1024)
+def _versionKey(version, width):
+    """
+    A version as a tuple ordered like _is_at_or_above(), None if it has more than width parts
+
+    Missing parts count as 0 and a number is above any text, (1, n) for
+    numbers and (0, text) for the rest keeps that order.
+    """
+    parts = _versionParts(version)
+    if len(parts) > width:
+        return None
+    parts += [0] * (width - len(parts))
+    return tuple((1, part) if isinstance(part, int) else (0, part) for part in parts)
+
+
+_compiled = None
+_compiledLock = threading.Lock()
+
+
+def compiled(definitions):
+    """The Definitions of a definitions dict, compiled on first use"""
+    global _compiled
+    if isinstance(definitions, Definitions):
+        return definitions
+    with _compiledLock:
+        if _compiled is None or _compiled.raw is not definitions:
+            _compiled = Definitions(definitions)
+        return _compiled
+
+
 def scan(data, extractor, definitions, matcher=None):
     matcher = matcher or _simple_match
     detected = []
@@ -71,6 +245,8 @@ def _scanhash(hash, definitions):
 
 
 def check(results, definitions):
+    if isinstance(definitions, Definitions):
+        return _checkIndexed(results, definitions)
     for r in results:
         result = r
 
@@ -104,6 +280,27 @@ def check(results, definitions):
     return results
 
 
+def _checkIndexed(results, definitions):
+    """Same as check() with the vulnerable ranges of the compiled definitions"""
+    for result in results:
+        component = result.get("component", None)
+        if not is_defined(definitions.raw.get(component)):
+            continue
+        vulns = definitions.raw[component].get("vulnerabilities", None)
+        for i in definitions.affecting(component, result.get("version", None)):
+            vulnerability = {"info": vulns[i].get("info", None)}
+            if (vulns[i].get("severity", None)):
+                vulnerability["severity"] = vulns[i].get("severity", None)
+
+            if (vulns[i].get("identifiers", None)):
+                vulnerability["identifiers"] = vulns[i].get("identifiers", None)
+
+            result["vulnerabilities"] = result.get("vulnerabilities", None) or []
+            result["vulnerabilities"].append(vulnerability)
+
+    return results
+
+
 def unique(ar):
     return list(set(ar))
 
@@ -151,34 +348,35 @@ def is_vulnerable(results):
 
 
 def scan_uri(uri, definitions):
-    result = scan(uri, 'uri', definitions)
+    definitions = compiled(definitions)
+    result = definitions.scan(uri, 'uri')
     return check(result, definitions)
 
 
 def scan_filename(fileName, definitions):
-    result = scan(fileName, 'filename', definitions)
+    definitions = compiled(definitions)
+    result = definitions.scan(fileName, 'filename')
     return check(result, definitions)
 
 
-def scan_file_content(content, definitions):
-    result = scan(content, 'filecontent', definitions)
+def scan_file_content(content, definitions, digest=None):
+    definitions = compiled(definitions)
+    result = definitions.scan(content, 'filecontent')
     if (len(result) == 0):
-        result = scan(content, 'filecontentreplace', definitions, _replacement_match)
+        result = definitions.scanReplacement(content)
 
     if (len(result) == 0):
-        result = _scanhash(
-            hashlib.sha1(
-                content.encode('utf8')).hexdigest(),
-            definitions)
+        result = definitions.scanHash(
+            digest or hashlib.sha1(content.encode('utf8')).hexdigest())
 
     return check(result, definitions)
 
 
-def main_scanner(uri, response):
-    definitions = getVar('definitions')
+def main_scanner(uri, response, digest=None):
+    definitions = compiled(getVar('definitions'))
     uri_scan_result = scan_uri(uri, definitions)
     filecontent = response
-    filecontent_scan_result = scan_file_content(filecontent, definitions)
+    filecontent_scan_result = scan_file_content(filecontent, definitions, digest)
     uri_scan_result.extend(filecontent_scan_result)
     result = {}
     if uri_scan_result:
@@ -197,22 +395,85 @@ def main_scanner(uri, response):
             result['vulnerabilities'].append(json.loads(vulnerability.replace('\'', '"')))
         return result
 
-def retireJs(url, response):
-    scripts = js_extractor(response)
-    for script in scripts:
-        if script not in getVar('checkedScripts'):
-            updateVar('checkedScripts', script, 'add')
+def _report(uri, result):
+    logger.red_line()
+    logger.good('Vulnerable component: ' + result['component'] + ' v' + result['version'])
+    logger.info('Component location: %s' % uri)
+    details = result['vulnerabilities']
+    logger.info('Total vulnerabilities: %i' % len(details))
+    for detail in details:
+        logger.info('%sSummary:%s %s' % (green, end, detail['identifiers']['summary']))
+        logger.info('Severity: %s' % detail['severity'])
+        logger.info('CVE: %s' % detail['identifiers']['CVE'][0])
+    logger.red_line()
+
+
+_contents = set()  # sha1 of the scripts scanned so far
+_contentsLock = threading.Lock()
+
+
+def _checkScript(uri):
+    """Fetch and scan a script, returns False if the same content was scanned before"""
+    response = requester(uri, '', getVar('headers'), 'GET', getVar('delay'), getVar('timeout')).text
+    digest = hashlib.sha1(response.encode('utf8')).hexdigest()
+    with _contentsLock:
+        known = digest in _contents
+        _contents.add(digest)
+    if known:  # e.g. the same library served by another host or path
+        logger.debug('Already checked the content of %s' % uri)
+        return False
+    result = main_scanner(uri, response, digest)
+    if result:
+        _report(uri, result)
+    return True
+
+
+class RetireStage:
+    """
+    Checks the scripts of crawled pages for vulnerable components in the background
+
+    Pages hand their scripts over with submit() and the crawler goes on, the
+    scripts are fetched and scanned by at most core.config.retireWorkers
+    threads. Scripts are checked once per url and once per content, by SHA-1,
+    whatever page or host they are found on.
+    """
+
+    def __init__(self, workers=None):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers or core.config.retireWorkers)
+        self.futures = []
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def submit(self, url, response):
+        for script in js_extractor(response):
             uri = handle_anchor(url, script)
-            response = requester(uri, '', getVar('headers'), 'GET', getVar('delay'), getVar('timeout')).text
-            result = main_scanner(uri, response)
-            if result:
-                logger.red_line()
-                logger.good('Vulnerable component: ' + result['component'] + ' v' + result['version'])
-                logger.info('Component location: %s' % uri)
-                details = result['vulnerabilities']
-                logger.info('Total vulnerabilities: %i' % len(details))
-                for detail in details:
-                    logger.info('%sSummary:%s %s' % (green, end, detail['identifiers']['summary']))
-                    logger.info('Severity: %s' % detail['severity'])
-                    logger.info('CVE: %s' % detail['identifiers']['CVE'][0])
-                logger.red_line()
+            with self.lock:
+                if uri in getVar('checkedScripts'):
+                    continue
+                updateVar('checkedScripts', uri, 'add')
+                self.futures.append(self.pool.submit(self.check, uri))
+
+    def check(self, uri):
+        try:
+            outcome = 'scanned' if _checkScript(uri) else 'known'
+        except Exception as e:
+            outcome = 'failed'
+            logger.debug('Could not check %s for vulnerable components: %s' % (uri, e))
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def finish(self, cancel=False):
+        """Wait for the scripts submitted so far, or drop the ones not started with cancel"""
+        self.pool.shutdown(wait=not cancel, cancel_futures=cancel)
+        if self.futures:
+            logger.debug('Checked %i scripts for vulnerable components, %i had known content, %i failed' % (
+                self.stats['scanned'] + self.stats['known'], self.stats['known'], self.stats['failed']))
+
+
+def retireJs(url, response):
+    """Check the scripts of a page right away, see RetireStage to do it in the background"""
+    for script in js_extractor(response):
+        uri = handle_anchor(url, script)
+        if uri not in getVar('checkedScripts'):
+            updateVar('checkedScripts', uri, 'add')
+            _checkScript(uri)
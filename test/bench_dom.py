@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Time core.dom on minified bundles against the analyser it replaced
+
+Bundles are generated: minified-looking code with a few sources, tainted
+variables and sinks, as single multi-MB lines and split in statements.
+Pages also load external scripts before and after the bundle, as real
+pages do.
+The old analyser is quadratic in the length of a line, it is only run on
+single lines up to --reference-limit characters and on the split bundles,
+the numbers of the lines both flag are compared.
+
+Usage: python test/bench_dom.py [--reference-limit N]
+"""
+import os
+import random
+import re
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.config
+from core.colors import end, red, yellow
+from core.dom import dom
+
+
+def reference(response):
+    """core.dom.dom() as it was, kept as the reference"""
+    highlighted = []
+    sources = r'''\b(?:document\.(URL|documentURI|URLUnencoded|baseURI|cookie|referrer)|location\.(href|search|hash|pathname)|window\.name|history\.(pushState|replaceState)(local|session)Storage)\b'''
+    sinks = r'''\b(?:eval|evaluate|execCommand|assign|navigate|getResponseHeaderopen|showModalDialog|Function|set(Timeout|Interval|Immediate)|execScript|crypto.generateCRMFRequest|ScriptElement\.(src|text|textContent|innerText)|.*?\.onEventName|document\.(write|writeln)|.*?\.innerHTML|Range\.createContextualFragment|(document|window)\.location)\b'''
+    scripts = re.findall(r'(?i)(?s)<script[^>]*>(.*?)</script>', response)
+    sinkFound, sourceFound = False, False
+    for script in scripts:
+        script = script.split('\n')
+        num = 1
+        allControlledVariables = set()
+        try:
+            for newLine in script:
+                line = newLine
+                parts = line.split('var ')
+                controlledVariables = set()
+                if len(parts) > 1:
+                    for part in parts:
+                        for controlledVariable in allControlledVariables:
+                            if controlledVariable in part:
+                                controlledVariables.add(re.search(r'[a-zA-Z$_][a-zA-Z0-9$_]+', part).group().replace('$', '\\$'))
+                pattern = re.finditer(sources, newLine)
+                for grp in pattern:
+                    if grp:
+                        source = newLine[grp.start():grp.end()].replace(' ', '')
+                        if source:
+                            if len(parts) > 1:
+                                for part in parts:
+                                    if source in part:
+                                        controlledVariables.add(re.search(r'[a-zA-Z$_][a-zA-Z0-9$_]+', part).group().replace('$', '\\$'))
+                            line = line.replace(source, yellow + source + end)
+                for controlledVariable in controlledVariables:
+                    allControlledVariables.add(controlledVariable)
+                for controlledVariable in allControlledVariables:
+                    matches = list(filter(None, re.findall(r'\b%s\b' % controlledVariable, line)))
+                    if matches:
+                        sourceFound = True
+                        line = re.sub(r'\b%s\b' % controlledVariable, yellow + controlledVariable + end, line)
+                pattern = re.finditer(sinks, newLine)
+                for grp in pattern:
+                    if grp:
+                        sink = newLine[grp.start():grp.end()].replace(' ', '')
+                        if sink:
+                            line = line.replace(sink, red + sink + end)
+                            sinkFound = True
+                if line != newLine:
+                    highlighted.append('%-3s %s' % (str(num), line.lstrip(' ')))
+                num += 1
+        except MemoryError:
+            pass
+    if sinkFound or sourceFound:
+        return highlighted
+    else:
+        return []
+
+
+def bundle(size, rng, split):
+    """A minified bundle of about size characters, one line or a statement per line with split"""
+    names = [''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(1, 3))) for _ in range(300)]
+    tainted = ['src%02d' % i for i in range(40)]
+    parts = []
+    length = 0
+    while length < size:
+        a, b, c = rng.choice(names), rng.choice(names), rng.choice(names)
+        roll = rng.random()
+        if roll < 0.002:
+            part = 'var %s=%s;' % (rng.choice(tainted), rng.choice(('location.hash', 'document.referrer', 'window.name')))
+        elif roll < 0.004:
+            part = 'var %s=%s+%s;' % (a, rng.choice(tainted), b)
+        elif roll < 0.006:
+            part = rng.choice(('eval(%s);', 'setTimeout(%s);', 'document.write(%s);')) % rng.choice(tainted)
+        else:
+            part = rng.choice((
+                'function %s(%s,%s){return %s.%s(%s)}' % (a, b, c, b, a, c),
+                'var %s=%s||{},%s="%s";' % (a, b, c, ''.join(rng.choice(string.ascii_lowercase) for _ in range(8))),
+                'if(%s&&%s.%s){%s[%i]=%s}' % (a, a, b, c, rng.randint(0, 99), b),
+                '%s.prototype.%s=function(){this.%s++};' % (a, b, c),
+            ))
+        parts.append(part)
+        length += len(part)
+    return ('\n' if split else '').join(parts)
+
+
+def flagged(lines):
+    return [line.split(' ', 1)[0] for line in lines]
+
+
+def main():
+    limit = 50000
+    if '--reference-limit' in sys.argv:
+        limit = int(sys.argv[sys.argv.index('--reference-limit') + 1])
+    core.config.domLimit = 0
+    rng = random.Random(0)
+    for size in (20000, 50000, 1000000, 4000000):
+        for split in (False, True):
+            page = ('<script src="/vendor.js"></script><script>' + bundle(size, rng, split) +
+                    '</script><script src="/app.js"></script>')
+            start = time.time()
+            result = dom(page)
+            elapsed = time.time() - start
+            line = '%-8i %-10s %8.3fs  %4i lines' % (size, 'statements' if split else 'one line', elapsed, len(result))
+            if size <= limit or split:
+                start = time.time()
+                expected = reference(page)
+                line += '   reference %8.3fs  %4i lines  %s' % (
+                    time.time() - start, len(expected),
+                    'same lines' if flagged(result) == flagged(expected) else 'different lines')
+            print(line, flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Time htmlParser() on large synthetic pages
+
+Pages of 1 to 16 MB are built from a mix of markup, attributes, comments,
+scripts and style blocks with a few reflections spread through them. The
+time per MB should stay flat as the page grows.
+
+Usage: python test/bench_htmlParser.py [path to another checkout to compare]
+"""
+import os
+import sys
+import time
+
+root = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from core.config import xsschecker
+from core.htmlParser import htmlParser
+
+chunk = (
+    '<div class="row" data-id=42><a href="/item?id=1&amp;p=2">item</a> a < b</div>\n'
+    '<!-- tracking pixel -->\n'
+    '<style>.row{color:red}</style>\n'
+    '<input type=text name=q value="search">\n'
+    '<script>var data = {"key": "value", "list": [1, 2, 3]};</script>\n'
+)
+reflections = (
+    '<p>%s</p>\n'
+    '<img src="%s" alt=x>\n'
+    '<!-- %s -->\n'
+    '<script>var q = \'%s\';</script>\n'
+    '<textarea>%s</textarea>\n'
+) % ((xsschecker,) * 5)
+
+
+class Response:
+    def __init__(self, text):
+        self.text = text
+
+
+def page(megabytes):
+    repeat = megabytes * 1024 * 1024 // len(chunk)
+    body = chunk * (repeat // 2) + reflections + chunk * (repeat // 2)
+    return Response('<html><body>\n%s%s</body></html>' % (reflections, body))
+
+
+def main():
+    print('Parser: %s' % root)
+    for megabytes in (1, 2, 4, 8, 16):
+        response = page(megabytes)
+        start = time.time()
+        found = htmlParser(response, False)
+        elapsed = time.time() - start
+        print('%3i MB  %8.3fs  %7.3fs/MB  %i reflections' % (
+            megabytes, elapsed, elapsed / megabytes, len(found)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Check and time the browser page pool against test_server.py
+
+Starts test_server.py on a local port and renders its comment page through
+the page pool of core/js_renderer.py:
+- the empty page fires no hook
+- a stored payload fires the alert hook with the number tag_payload() gave it
+- a payload that doesn't run isn't confirmed by the hook of one stored before it
+- a batch of stored payloads is verified with a single render, every
+  payload calling a hook is told apart by its number, inert ones are not
+- the page is rendered sequentially and from as many threads as pages
+
+Needs Playwright and a Chromium it can launch. Exits with 1 if a check fails.
+
+Usage: python test/bench_jsRender.py [renders]
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.config
+from core.js_renderer import close_browser, get_pool, render_execution
+from core.stored_xss_verifier import page_hooks, tag_payload, verify_stored_batch, verify_stored_xss
+import test_server
+from test_server import TestHandler
+
+executing = (
+    '<img src=x onerror=alert(1)>',
+    '<svg onload=confirm()>',
+    '<details open ontoggle=prompt(1)>',
+    '<img src=x onerror=alert``>',
+    '<script>[8].find(alert)</script>',
+    '<img src=x onerror=print()>',
+)
+inert = (
+    '<b>bold</b>',
+    '<i title="alert(1)">italic</i>',
+)
+
+
+class QuietHandler(TestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def store(base, payloads):
+    test_server.stored_comments.clear()
+    for payload in payloads:
+        requests.post(base + 'comment', data={'name': 'bench', 'comment': payload}, timeout=10)
+
+
+def check(label, passed, details=''):
+    print('%-4s %s%s' % ('ok' if passed else 'FAIL', label, ' (%s)' % details if details else ''))
+    return passed
+
+
+def timed(label, url, count, threads):
+    start = time.time()
+    with ThreadPoolExecutor(threads) as executor:
+        renders = list(executor.map(lambda _: render_execution(url, {}, 3, settle=True), range(count)))
+    elapsed = time.time() - start
+    print('%-10s %4i renders  %2i threads  %6.1f pages/s' % (label, count, threads, count / elapsed))
+    return all(render and render.html for render in renders)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    server = Server(('127.0.0.1', 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%i/' % server.server_address[1]
+    view = base + 'view'
+
+    core.config.globalVariables = {'jsonData': False, 'path': False}
+    core.config.proxies = {}
+    results = []
+    try:
+        if get_pool() is None:
+            print('The browser page pool is not available, see the errors above')
+            return 1
+        store(base, ())
+        hooks = page_hooks(view)
+        results.append(check('no hook on the empty page', not hooks, hooks))
+
+        number, tagged, traceable = tag_payload(executing[0])
+        store(base, (tagged,))
+        rendered = render_execution(view, {}, core.config.jsExecWait)
+        results.append(check('alert hook fires with the payload number',
+                             traceable and rendered and rendered.executed == ('alert', str(number)),
+                             rendered and rendered.executed))
+
+        later, tagged_later, _ = tag_payload(inert[1])
+        store(base, (tagged, tagged_later))
+        success, method, _ = verify_stored_xss(view, 'GET', tagged_later, 0, 10, use_js_render=True, tag=later)
+        results.append(check('an earlier payload does not confirm a later one',
+                             not (method or '').startswith('js_executed'), method))
+
+        batch = {}
+        for payload in executing + inert:
+            number, tagged, _ = tag_payload(payload)
+            batch[number] = tagged
+        store(base, batch.values())
+        start = time.time()
+        found, hooks = verify_stored_batch(view, 'GET', batch, 0, 10, use_js_render=True)
+        elapsed = time.time() - start
+        executed = set(number for number, (method, _) in found.items() if method.startswith('js_executed_'))
+        expected = set(list(batch)[:len(executing)])
+        results.append(check('batch of %i payloads verified in one render' % len(batch),
+                             executed == expected and not hooks,
+                             '%i of %i executed in %.2fs, untraced hooks: %s' % (
+                                 len(executed & expected), len(expected), elapsed, hooks)))
+
+        results.append(check('sequential renders', timed('sequential', view, count, 1)))
+        pages = core.config.jsRenderPages
+        results.append(check('concurrent renders', timed('concurrent', view, count, pages)))
+    finally:
+        close_browser()
+        server.shutdown()
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark pooled keep-alive sessions against one connection per request
+
+Starts test_server.py on a local port and reports the number of TCP
+connections accepted by the server and the requests per second for both
+strategies.
+
+Usage: python test/bench_requester.py [requests]
+"""
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.config
+from core.requester import requester, closeSessions
+from test_server import TestHandler
+
+
+class QuietHandler(TestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    connections = 0
+
+    def get_request(self):
+        CountingServer.connections += 1
+        return super().get_request()
+
+
+def run(label, send, count):
+    CountingServer.connections = 0
+    start = time.time()
+    for _ in range(count):
+        send()
+    elapsed = time.time() - start
+    print('%-10s %6i requests  %5i connections  %8.1f req/s' % (
+        label, count, CountingServer.connections, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    server = CountingServer(('127.0.0.1', 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%i/' % server.server_address[1]
+
+    core.config.globalVariables = {'jsonData': False, 'path': False}
+    core.config.proxies = {}
+    headers = dict(core.config.headers)
+    closed = dict(headers, Connection='close')
+
+    run('fresh', lambda: requests.get(url, params={'q': 'v3dm0s'}, headers=closed, timeout=10), count)
+    run('pooled', lambda: requester(url, {'q': 'v3dm0s'}, headers, 'GET', 0, 10), count)
+    closeSessions()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Check and time recording and replaying checker() probes
+
+Starts a local server reflecting the q parameter, with a Content-Length or
+chunked, in front of a small or a large page, and probes it the way
+checker() does, looking for the reflections:
+- a body read to its end is not truncated, with or without Content-Length
+- a large body is cut short after the reflection and flagged truncated
+- every complete response is recorded, and replayed with the same body
+
+Exits with 1 if a check fails.
+
+Usage: python test/bench_responseStore.py [probes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.config
+import core.requester
+from core.requester import closeSessions, closeStore, getStore, requester
+
+filler = '<p>' + 'x' * 1000 + '</p>\n'
+footer = '<footer>' + 'y' * 200 + '</footer>'  # the reflection and the tail checker() wants fit before it ends
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        q = parse_qs(parsed.query).get('q', [''])[0]
+        body = ('<html><body><div>%s</div>%s</body></html>' % (
+            q, filler * 2000 if parsed.path == '/large' else footer)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if parsed.path == '/chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(body), body))
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # large bodies are dropped by the client once the reflection is in
+
+
+def check(label, passed, details=''):
+    print('%-4s %s%s' % ('ok' if passed else 'FAIL', label, ' (%s)' % details if details else ''))
+    return passed
+
+
+def probe(url, i):
+    checkString = 'st4r7s<%i>3nd' % i
+    return requester(url, {'q': checkString}, {}, 'GET', 0, 10, ('st4r7s', 1, len(checkString) + 50))
+
+
+def run(label, base, count):
+    start = time.time()
+    responses = [probe(base + path, i) for i in range(count) for path in ('', 'chunked', 'large')]
+    elapsed = time.time() - start
+    print('%-10s %5i probes  %8.1f probes/s' % (label, len(responses), len(responses) / elapsed))
+    return responses
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%i/' % server.server_address[1]
+    directory = tempfile.mkdtemp()
+
+    core.config.globalVariables = {'jsonData': False, 'path': False}
+    core.config.proxies = {}
+    core.config.cache = False
+    results = []
+    try:
+        core.config.record = directory
+        recorded = run('record', base, count)
+        stats = dict(getStore().stats)
+        closeStore()
+        core.requester._store = None
+        results.append(check('complete bodies are not truncated',
+                             not any(response.truncated for response in recorded[0::3] + recorded[1::3])))
+        results.append(check('large bodies are cut short and truncated',
+                             all(response.truncated for response in recorded[2::3])))
+        results.append(check('complete bodies are recorded', stats['recorded'] == 2 * count,
+                             '%i of %i' % (stats['recorded'], 2 * count)))
+
+        core.config.record, core.config.replay = None, directory
+        replayed = run('replay', base, count)
+        stats = dict(getStore().stats)
+        closeStore()
+        core.requester._store = None
+        complete = [(a, b) for a, b in zip(recorded, replayed) if not a.truncated]
+        results.append(check('complete bodies are replayed', complete and stats['replayed'] == len(complete) and
+                             all(a.content == b.content for a, b in complete),
+                             '%i replayed, %i missing' % (stats['replayed'], stats['missing'])))
+    finally:
+        core.config.record = core.config.replay = None
+        closeSessions()
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Compare retire.js scanning with the raw and the compiled definitions
+
+The corpus is made of popular libraries, the scripts of the directories
+given as arguments or else generated ones: the banners of well-known
+libraries in front of minified-looking code, plus application bundles
+without any library. Every script is scanned by uri and content both ways
+and the results are compared.
+
+Vulnerability lookups are compared on their own too, for versions around
+every bound of the definitions as a crawl finding the same libraries over
+and over would look them up.
+
+Usage: python test/bench_retireJs.py [directory ...]
+"""
+import hashlib
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plugins.retireJs import Definitions, scan, check, _replacement_match, _scanhash
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+banners = (
+    ('jquery/1.8.1/jquery.min.js', '/*! jQuery v1.8.1 jquery.com | jquery.org/license */'),
+    ('jquery/3.5.1/jquery.min.js', '/*! jQuery v3.5.1 | (c) JS Foundation and other contributors */'),
+    ('jquery-ui-1.10.4.min.js', '/*! jQuery UI - v1.10.4 - 2014-01-17 */'),
+    ('jquery-migrate-1.4.1.min.js', '/*! jQuery Migrate v1.4.1 | (c) jQuery Foundation */'),
+    ('angular-1.5.8.min.js', '/*\n AngularJS v1.5.8\n (c) 2010-2016 Google, Inc. http://angularjs.org\n*/'),
+    ('bootstrap-3.3.7.min.js', '/*!\n * Bootstrap v3.3.7 (http://getbootstrap.com)\n */'),
+    ('handlebars-v4.0.5.js', '/*!\n\n handlebars v4.0.5\n\n*/'),
+    ('moment-2.15.2.min.js', '//! moment.js\n//! version : 2.15.2'),
+    ('dojo/1.10.4/dojo.js', 'dojo.version={major:1,minor:10,patch:4,flag:""}'),
+    ('knockout-3.4.0.js', '/*!\n * Knockout JavaScript library v3.4.0\n */'),
+    ('vendor.js', ''),
+    ('app.bundle.js', ''),
+)
+
+
+def minified(size, rng):
+    """Code looking like a minified bundle, size characters long"""
+    names = [''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(1, 3))) for _ in range(200)]
+    parts = []
+    length = 0
+    while length < size:
+        a, b, c = rng.choice(names), rng.choice(names), rng.choice(names)
+        part = rng.choice((
+            'function %s(%s,%s){return %s.%s(%s)}' % (a, b, c, b, a, c),
+            'var %s=%s||{},%s="%s";' % (a, b, c, ''.join(rng.choice(string.ascii_lowercase) for _ in range(8))),
+            'if(%s&&%s.%s){%s[%i]=%s}' % (a, a, b, c, rng.randint(0, 99), b),
+            '%s.prototype.%s=function(){this.%s++};' % (a, b, c),
+        ))
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+
+def corpus(directories):
+    scripts = []
+    if directories:
+        for directory in directories:
+            for path, _, names in os.walk(directory):
+                for name in names:
+                    if name.endswith('.js'):
+                        with open(os.path.join(path, name), encoding='utf-8', errors='ignore') as file:
+                            scripts.append(('https://cdn.example.com/' + name, file.read()))
+        return scripts
+    rng = random.Random(0)
+    for size in (20000, 200000, 1000000):
+        for name, banner in banners:
+            scripts.append(('https://cdn.example.com/%i/%s' % (size, name), banner + '\n' + minified(size, rng)))
+    return scripts
+
+
+def reference(uri, content, definitions):
+    """The scan of uri and content before the definitions were compiled"""
+    results = check(scan(uri, 'uri', definitions), definitions)
+    found = scan(content, 'filecontent', definitions)
+    if not found:
+        found = scan(content, 'filecontentreplace', definitions, _replacement_match)
+    if not found:
+        found = _scanhash(hashlib.sha1(content.encode('utf8')).hexdigest(), definitions)
+    return results + check(found, definitions)
+
+
+def compiled(uri, content, definitions):
+    results = check(definitions.scan(uri, 'uri'), definitions)
+    found = definitions.scan(content, 'filecontent')
+    if not found:
+        found = definitions.scanReplacement(content)
+    if not found:
+        found = definitions.scanHash(hashlib.sha1(content.encode('utf8')).hexdigest())
+    return results + check(found, definitions)
+
+
+def versions(raw):
+    """(component, version) pairs on, around and between the bounds of the vulnerabilities"""
+    pairs = []
+    for component, definition in raw.items():
+        for vulnerability in definition.get('vulnerabilities') or ():
+            for bound in ('below', 'atOrAbove'):
+                version = vulnerability.get(bound)
+                if not version:
+                    continue
+                parts = version.split('.')
+                pairs.append((component, version))
+                pairs.append((component, version + '-beta.1'))
+                pairs.append((component, version + '.0.0'))
+                pairs.append((component, '.'.join(parts[:-1] + [str(int(parts[-1]) + 1)]))
+                             if parts[-1].isdigit() else (component, version + '.1'))
+    return pairs * 20
+
+
+def main():
+    with open(os.path.join(root, 'db', 'definitions.json'), encoding='utf-8') as file:
+        raw = json.load(file)
+    scripts = corpus(sys.argv[1:])
+    print('Corpus: %i scripts, %.1f MB' % (len(scripts), sum(len(content) for _, content in scripts) / 1e6))
+
+    start = time.time()
+    definitions = Definitions(raw)
+    print('Compiling: %.1f ms' % ((time.time() - start) * 1000))
+
+    timings = {}
+    outputs = {}
+    for name, scanner, database in (('raw', reference, raw), ('compiled', compiled, definitions)):
+        start = time.time()
+        outputs[name] = [json.dumps(scanner(uri, content, database), sort_keys=True) for uri, content in scripts]
+        timings[name] = time.time() - start
+    mismatches = sum(1 for a, b in zip(outputs['raw'], outputs['compiled']) if a != b)
+    detected = sum(1 for output in outputs['compiled'] if output != '[]')
+    for name, elapsed in timings.items():
+        print('%-9s %8.3fs  %7.1f scripts/s' % (name, elapsed, len(scripts) / elapsed))
+    print('%i scripts with a detected component, %i mismatches' % (detected, mismatches))
+
+    pairs = versions(raw)
+    print('Lookups: %i versions' % len(pairs))
+    outputs = {}
+    for name, database in (('raw', raw), ('compiled', definitions)):
+        start = time.time()
+        outputs[name] = [json.dumps(check([{'component': component, 'version': version}], database))
+                         for component, version in pairs]
+        elapsed = time.time() - start
+        print('%-9s %8.3fs  %7.0f lookups/s' % (name, elapsed, len(pairs) / elapsed))
+    mismatches = sum(1 for a, b in zip(outputs['raw'], outputs['compiled']) if a != b)
+    print('%i mismatches' % mismatches)
+
+
+if __name__ == '__main__':
+    main()
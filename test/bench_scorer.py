@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare reflection scorers on a corpus of checker() windows
+
+The corpus is built from the payloads of both payload modes, each passed
+through typical filters (stripping, entity encoding, escaping...) and cut
+to the fixed-width window checker() scores. Every available backend is
+timed and compared against fuzzywuzzy, the reference implementation.
+
+Usage: python test/bench_scorer.py
+"""
+import os
+import random
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.config
+from core.scorer import getScorer, nativeRatio
+from core.utils import genGen
+
+filters = (
+    lambda p: p,
+    lambda p: p.replace('<', ''),
+    lambda p: p.replace('<', '&lt;').replace('>', '&gt;'),
+    lambda p: p.replace('"', '\\"').replace('\'', '\\\''),
+    lambda p: p.replace('(', '').replace(')', ''),
+    lambda p: p.replace('script', ''),
+    lambda p: p.replace('on', 'xx'),
+    lambda p: p[:len(p) // 2],
+    lambda p: p.upper(),
+)
+
+
+def corpus():
+    random.seed(0)
+    pairs = []
+    for config in (core.config.slim_config, core.config.full_config):
+        payloads = genGen(config['fillings'], config['eFillings'], config['lFillings'],
+                          config['eventHandlers'], config['tags'], config['functions'], ['//', '>'])
+        for payload in payloads:
+            checkString = ('st4r7s' + payload + '3nd').lower()
+            for applyFilter in filters:
+                page = 'st4r7s' + applyFilter(payload) + '3nd</div>\n<p>footer</p>'
+                pairs.append((page.lower()[:len(checkString)], checkString))
+    return pairs
+
+
+def run(name, scorer, pairs):
+    start = time.time()
+    scores = [scorer(reflected, expected) for reflected, expected in pairs]
+    return scores, time.time() - start
+
+
+def main():
+    pairs = corpus()
+    print('Corpus: %i pairs' % len(pairs))
+    warnings.simplefilter('ignore')
+    results = {}
+    for name in ('fuzzywuzzy', 'native', 'rapidfuzz'):
+        scorer = getScorer(name)
+        if scorer is nativeRatio and name != 'native':
+            continue
+        if name == 'native':
+            nativeRatio.cache_clear()
+        results[name] = run(name, scorer, pairs)
+    reference = results.get('fuzzywuzzy')
+    for name, (scores, elapsed) in results.items():
+        line = '%-11s %8.3fs  %9.0f pairs/s' % (name, elapsed, len(pairs) / elapsed)
+        if reference and name != 'fuzzywuzzy':
+            mismatches = sum(1 for a, b in zip(scores, reference[0]) if a != b)
+            line += '  %i mismatches' % mismatches
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
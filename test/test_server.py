@@ -11,6 +11,8 @@ import json
 stored_comments = []
 
 class TestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # allow keep-alive connections
+    disable_nagle_algorithm = True  # headers and body are written separately
     
     def do_GET(self):
         parsed = urlparse(self.path)
@@ -86,6 +88,7 @@ class TestHandler(BaseHTTPRequestHandler):
         
         else:
             self.send_response(404)
+            self.send_header('Content-Length', '0')
             self.end_headers()
     
     def do_POST(self):
@@ -107,16 +110,20 @@ class TestHandler(BaseHTTPRequestHandler):
             # Return success response
             self.send_response(302)
             self.send_header('Location', '/view')
+            self.send_header('Content-Length', '0')
             self.end_headers()
         else:
             self.send_response(404)
+            self.send_header('Content-Length', '0')
             self.end_headers()
     
     def send_html(self, content):
+        body = content.encode('utf-8')
         self.send_response(200)
         self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(content.encode('utf-8'))
+        self.wfile.write(body)
     
     def log_message(self, format, *args):
         # Custom log format
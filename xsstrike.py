@@ -2,7 +2,7 @@
 
 from __future__ import print_function
 
-from core.colors import end, red, white, bad, info
+from core.colors import end, red, white, bad
 
 # Just a fancy ass banner
 print('''%s
@@ -12,24 +12,15 @@ print('''%s
 try:
     import concurrent.futures
     from urllib.parse import urlparse
-    try:
-        import fuzzywuzzy
-    except ImportError:
-        import os
-        print ('%s fuzzywuzzy isn\'t installed, installing now.' % info)
-        ret_code = os.system('pip3 install fuzzywuzzy')
-        if(ret_code != 0):
-            print('%s fuzzywuzzy installation failed.' % bad)
-            quit()
-        print ('%s fuzzywuzzy has been installed, restart XSStrike.' % info)
-        quit()
 except ImportError:  # throws error in python2
     print('%s XSStrike isn\'t compatible with python2.\n Use python > 3.4 to run XSStrike.' % bad)
     quit()
 
 # Let's import whatever we need from standard lib
+import os
 import sys
 import json
+import atexit
 import argparse
 
 # ... and configurations core lib
@@ -65,9 +56,55 @@ parser.add_argument('-l', '--level', help='level of crawling',
                     dest='level', type=int, default=2)
 parser.add_argument('--headers', help='add headers',
                     dest='add_headers', nargs='?', const=True)
+parser.add_argument('--max-pages', help='max number of pages to crawl',
+                    dest='maxPages', type=int, default=core.config.maxPages)
+parser.add_argument('--host-concurrency', help='max pages of the same host crawled at once',
+                    dest='hostConcurrency', type=int, default=core.config.hostConcurrency)
+parser.add_argument('--pattern-limit', help='max urls crawled per path and set of parameter names (0 for no limit)',
+                    dest='patternLimit', type=int, default=core.config.patternLimit)
+parser.add_argument('--dedupe-distance', help='SimHash distance of near duplicate pages (-1 to disable)',
+                    dest='dedupeDistance', type=int, default=core.config.dedupeDistance)
+parser.add_argument('--retire-workers', help='scripts fetched at once to check for vulnerable components',
+                    dest='retireWorkers', type=int, default=core.config.retireWorkers)
 parser.add_argument('-t', '--threads', help='number of threads',
                     dest='threadCount', type=int, default=core.config.threadCount)
-parser.add_argument('-d', '--delay', help='delay between requests',
+parser.add_argument('--pool-size', help='max connections kept alive per host',
+                    dest='poolSize', type=int, default=core.config.poolSize)
+parser.add_argument('--retries', help='retries on connection failures',
+                    dest='retries', type=int, default=core.config.retries)
+parser.add_argument('--max-response-size', help='max KB of a response body to read when looking for reflections (0 for no limit)',
+                    dest='maxResponseSize', type=int, default=core.config.maxResponseSize)
+parser.add_argument('--no-keep-alive', help='open a new connection for every request',
+                    dest='noKeepAlive', action='store_true')
+parser.add_argument('--scorer', help='reflection scorer backend, rapidfuzz is faster but changes verdicts',
+                    dest='scorer', default=core.config.scorer, choices=('native', 'rapidfuzz', 'fuzzywuzzy'))
+parser.add_argument('--async', help='test payloads concurrently',
+                    dest='asyncScan', action='store_true')
+parser.add_argument('--async-limit', help='max payload probes in flight per parameter with --async',
+                    dest='asyncLimit', type=int, default=core.config.asyncLimit)
+parser.add_argument('--rate', help='max requests per second per host, lowered automatically when the host struggles',
+                    dest='rate', type=float, default=core.config.rate)
+parser.add_argument('--global-rate', help='max requests per second over all hosts',
+                    dest='globalRate', type=float, default=core.config.globalRate)
+parser.add_argument('--cache', help='reuse responses of identical requests',
+                    dest='cache', action='store_true')
+parser.add_argument('--cache-ttl', help='seconds a cached response stays valid',
+                    dest='cacheTtl', type=int, default=core.config.cacheTtl)
+parser.add_argument('--cache-size', help='memory budget of the response cache in MB',
+                    dest='cacheSize', type=int, default=core.config.cacheSize)
+parser.add_argument('--cache-unsafe', help='also cache POST and other non-idempotent requests',
+                    dest='cacheUnsafe', action='store_true')
+parser.add_argument('--record', help='record every response to a directory',
+                    dest='record', metavar='DIR')
+parser.add_argument('--replay', help='replay responses recorded with --record instead of sending requests',
+                    dest='replay', metavar='DIR')
+parser.add_argument('--plan-cache', help='keep payload plans in a file to reuse them in later scans',
+                    dest='planCache', metavar='FILE')
+parser.add_argument('--payload-stats', help='learn which payloads work per WAF and context in a file',
+                    dest='payloadStats', metavar='FILE')
+parser.add_argument('--prune-after', help='skip payload families that failed this many times before',
+                    dest='pruneAfter', type=int, default=core.config.pruneAfter)
+parser.add_argument('-d', '--delay', help='min seconds between requests to a host, across all threads',
                     dest='delay', type=int, default=core.config.delay)
 parser.add_argument('--skip', help='don\'t ask to continue',
                     dest='skip', action='store_true')
@@ -86,12 +123,20 @@ parser.add_argument('--js-render', help='use JavaScript rendering (requires Play
                     dest='jsRender', action='store_true')
 parser.add_argument('--js-wait', help='max seconds to wait for page load (default: 10s)',
                     dest='jsRenderWait', type=int, default=core.config.jsRenderWait)
+parser.add_argument('--js-render-pages', help='pages rendering at once with --js-render',
+                    dest='jsRenderPages', type=int, default=core.config.jsRenderPages)
+parser.add_argument('--js-render-types', help='comma separated resource types fetched while rendering, * for all',
+                    dest='jsRenderTypes', default=','.join(core.config.jsRenderTypes))
+parser.add_argument('--js-render-hosts', help='comma separated hosts subresources may come from besides the target, * for any',
+                    dest='jsRenderHosts', default=','.join(core.config.jsRenderHosts))
 parser.add_argument('--full-payloads', help='use full payload set (default: slim mode ~100 payloads)',
                     dest='fullPayloads', action='store_true')
 parser.add_argument('--verify-url', help='URL to verify stored XSS (for POST/PUT/etc injection)',
                     dest='verifyUrl')
 parser.add_argument('--verify-method', help='HTTP method to use for verify-url (default: GET)',
                     dest='verifyMethod', default='GET')
+parser.add_argument('--stored-batch', help='inject this many stored payloads before each verification (default: 1)',
+                    dest='storedBatch', type=int, default=core.config.storedBatch)
 parser.add_argument('--cookie', help='cookie value to include in requests (e.g., "session=abc123; user_id=456")',
                     dest='cookie')
 args = parser.parse_args()
@@ -130,9 +175,37 @@ logger = core.log.setup_logger()
 core.config.globalVariables = vars(args)
 core.config.jsRender = args.jsRender
 core.config.jsRenderWait = args.jsRenderWait
+core.config.jsRenderPages = args.jsRenderPages
+core.config.jsRenderTypes = tuple(filter(None, args.jsRenderTypes.split(',')))
+core.config.jsRenderHosts = tuple(filter(None, args.jsRenderHosts.lower().split(',')))
 core.config.verifyUrl = args.verifyUrl
 core.config.verifyMethod = args.verifyMethod.upper() if args.verifyMethod else 'GET'
+core.config.storedBatch = max(1, args.storedBatch)
 core.config.cookie = args.cookie if args.cookie else None
+core.config.poolSize = args.poolSize
+core.config.retries = args.retries
+core.config.maxResponseSize = args.maxResponseSize
+core.config.keepAlive = not args.noKeepAlive
+core.config.scorer = args.scorer
+core.config.maxPages = args.maxPages
+core.config.hostConcurrency = args.hostConcurrency
+core.config.patternLimit = args.patternLimit
+core.config.dedupeDistance = args.dedupeDistance
+core.config.retireWorkers = max(1, args.retireWorkers)
+core.config.asyncScan = args.asyncScan
+core.config.asyncLimit = args.asyncLimit
+core.config.rate = args.rate
+core.config.globalRate = args.globalRate
+core.config.cache = args.cache or args.cacheUnsafe
+core.config.cacheTtl = args.cacheTtl
+core.config.cacheSize = args.cacheSize
+core.config.cacheUnsafe = args.cacheUnsafe
+core.config.record = args.record
+core.config.replay = args.replay
+core.config.payloadSeed = bool(args.record or args.replay)  # replays must send the recorded payloads
+core.config.planCache = args.planCache
+core.config.payloadStats = args.payloadStats
+core.config.pruneAfter = args.pruneAfter
 
 # Apply payload configuration mode (Slim or Full)
 use_slim = not args.fullPayloads  # Slim mode is used by default unless --full-payloads is specified
@@ -144,16 +217,37 @@ logger.info(f'Payload configuration: {payload_mode}')
 # Import everything else required from core lib
 from core.config import blindPayload
 from core.encoders import base64
+from core.generator import savePlanCache
 from core.photon import photon
 from core.prompt import prompt
+from core.requester import cacheReport, closeStore
+from core.responseStore import indexName
 from core.updater import updater
 from core.utils import extractHeaders, reader, converter
+from core.vectorScores import saveVectorScores
 
 from modes.bruteforcer import bruteforcer
 from modes.crawl import crawl
 from modes.scan import scan
 from modes.singleFuzz import singleFuzz
 
+if core.config.cache:
+    atexit.register(cacheReport)
+if args.record and args.replay:
+    logger.error('--record and --replay can\'t be used together')
+    quit()
+if args.replay:
+    if not os.path.isfile(os.path.join(args.replay, indexName)):
+        logger.error('No recorded responses found in %s' % args.replay)
+        quit()
+    delay = 0  # nothing is sent, there is nothing to wait for
+if args.record or args.replay:
+    atexit.register(closeStore)
+if args.planCache:
+    atexit.register(savePlanCache)
+if args.payloadStats:
+    atexit.register(saveVectorScores)
+
 if type(args.add_headers) == bool:
     headers = extractHeaders(prompt())
 elif type(args.add_headers) == str: